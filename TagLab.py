@@ -59,10 +59,14 @@ from source.QtNewDatasetWidget import QtNewDatasetWidget
 from source.QtTYNWidget import QtTYNWidget
 from source.QtComparePanel import QtComparePanel
 from source.Project import Project, loadProject
+from source.ProjectJournal import ProjectJournal, hasRecoveryData, recoverProject
 from source.Image import Image
 from source.MapClassifier import MapClassifier
+from source.ModelRegistry import modelRegistry
+from source.tools.DeepExtreme import DeepExtreme, DEEPEXTREME_MODEL, loadDeepExtremeNetwork
 from source.NewDataset import NewDataset
 from source import utils
+from source.ConversionUtils import qimage2ndarray
 
 # training modules
 from models.coral_dataset import CoralsDataset
@@ -98,6 +102,15 @@ class TagLab(QWidget):
         self.available_classifiers = config_dict["Available Classifiers"]
         self.labels_dictionary = config_dict["Labels"]
 
+        # the networks stay loaded between their uses (within a memory budget),
+        # DEXTR is loaded in background so the first segmentation does not wait for it
+        models_memory = config_dict.get("Models Memory (MB)", 1024)
+        modelRegistry().setBudget(int(models_memory) * 1024 * 1024)
+        modelRegistry().preload(DEEPEXTREME_MODEL, loadDeepExtremeNetwork)
+
+        # diagnostic output of the tools (e.g. the predictions of DEXTR are saved in temp/), disabled by default
+        DeepExtreme.DIAGNOSTICS = bool(config_dict.get("Diagnostics", False))
+
         logfile.info("[INFO] Initizialization begins..")
 
         # MAP VIEWER preferred size (longest side)
@@ -412,6 +425,7 @@ class TagLab(QWidget):
         # NETWORKS
         self.deepextreme_net = None
         self.corals_classifier = None
+        self.classification_target = None   # viewer, image and size of the map being classified
 
         # a dirty trick to adjust all the size..
         self.showMinimized()
@@ -419,8 +433,9 @@ class TagLab(QWidget):
 
         logfile.info("[INFO] Inizialization finished!")
 
-        # autosave timer
+        # autosave timer and journal of the edits
         self.timer = None
+        self.journal = None
 
         self.move()
 
@@ -456,17 +471,30 @@ class TagLab(QWidget):
 
     def activateAutosave(self):
 
-        pass
-
-        # self.timer = QTimer(self)
-        # self.timer.timeout.connect(self.autosave)
-        # #self.timer.start(1800000)  # save every 3 minute
-        # self.timer.start(600000)  # save every 3 minute
+        # the edits are journaled as soon as they are done, the timer only compacts the journal
+        # into a snapshot of the project (written on a background thread)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.autosave)
+        self.timer.start(180000)  # save every 3 minutes
 
     @pyqtSlot()
     def autosave(self):
-        filename, file_extension = os.path.splitext(self.project.filename)
-        self.project.save(filename + "_autosave.json")
+        if self.journal is not None:
+            self.journal.compact(self.project)
+
+    def setupJournal(self):
+        """
+        Start a new journal of the edits for the current project (only saved projects are journaled).
+        """
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+        if self.project.filename is not None:
+            self.journal = ProjectJournal(self.project.filename)
+
+        self.viewerplus.setJournal(self.journal)
+        self.viewerplus2.setJournal(self.journal)
 
     # call by pressing right button
     def openContextMenu(self, position):
@@ -852,7 +880,13 @@ class TagLab(QWidget):
         logfile.info(msg)
 
         if event.key() == Qt.Key_Escape:
-            if self.activeviewer is not None:
+            if self.isClassificationRunning():
+                # the results are discarded by classificationFinished
+                self.corals_classifier.stopProcessing()
+                self.progress_bar.hidePerc()
+                self.progress_bar.setMessage("Stopping classification..")
+
+            elif self.activeviewer is not None:
             # RESET CURRENT OPERATION
                 self.activeviewer.resetSelection()
                 self.activeviewer.resetTools()
@@ -1300,11 +1334,19 @@ class TagLab(QWidget):
 
     def resetAll(self):
 
+        self.stopClassification()
+
         self.viewerplus.clear()
         self.viewerplus2.clear()
         self.mapviewer.clear()
         # RE-INITIALIZATION
 
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        self.viewerplus.setJournal(None)
+        self.viewerplus2.setJournal(None)
+
         self.mapWidget = None
         self.classifierWidget = None
         self.newDatasetWidget = None
@@ -1722,7 +1764,7 @@ class TagLab(QWidget):
             bbox[3] += 2*padding  # height
 
             img = utils.cropQImage(view.img_map, bbox)
-            img = utils.qimageToNumpyArray(img)
+            img = qimage2ndarray(img)
 
             # USE DEPTH INFORMATION IF AVAILABLE
             # if view.depth_map is not None:
@@ -1934,7 +1976,7 @@ class TagLab(QWidget):
     @pyqtSlot()
     def openProject(self):
 
-        filters = "ANNOTATION PROJECT (*.json)"
+        filters = "ANNOTATION PROJECT (*.json *.tlb)"
         filename, _ = QFileDialog.getOpenFileName(self, "Open a project", self.taglab_dir, filters)
 
         if filename:
@@ -1959,7 +2001,7 @@ class TagLab(QWidget):
     @pyqtSlot()
     def saveAsProject(self):
 
-        filters = "ANNOTATION PROJECT (*.json)"
+        filters = "ANNOTATION PROJECT (*.json *.tlb)"
         filename, _ = QFileDialog.getSaveFileName(self, "Save the project", self.taglab_dir, filters)
 
         if filename:
@@ -1975,7 +2017,7 @@ class TagLab(QWidget):
         Opens a previously saved project and append the annotated images to the current ones.
         """
 
-        filters = "ANNOTATION PROJECT (*.json)"
+        filters = "ANNOTATION PROJECT (*.json *.tlb)"
         filename, _ = QFileDialog.getOpenFileName(self, "Open a project", self.taglab_dir, filters)
         if filename:
             self.append(filename)
@@ -2178,7 +2220,7 @@ class TagLab(QWidget):
         if output_filename:
             size = QSize(self.activeviewer.image.width, self.activeviewer.image.height)
             label_map_img = self.activeviewer.annotations.create_label_map(size, self.labels_dictionary)
-            label_map_np = utils.qimageToNumpyArray(label_map_image)
+            label_map_np = qimage2ndarray(label_map_image)
             georef_filename = self.activeviewer.image.georef_filename
             rasterops.saveGeorefLabelMap(label_map_np, georef_filename, output_filename)
 
@@ -2425,8 +2467,20 @@ class TagLab(QWidget):
         QApplication.setOverrideCursor(Qt.WaitCursor)
         self.resetAll()
 
+        recover = False
+        if hasRecoveryData(filename):
+            reply = QMessageBox.question(self, "Recover project",
+                                         "This project has unsaved changes (e.g. TagLab has been closed unexpectedly).\n"
+                                         "Do you want to recover them?", QMessageBox.Yes | QMessageBox.No)
+            recover = reply == QMessageBox.Yes
+            if not recover:
+                ProjectJournal(filename).discard()
+
         try:
-            self.project = loadProject(filename, self.labels_dictionary)
+            if recover:
+                self.project = recoverProject(filename, self.labels_dictionary)
+            else:
+                self.project = loadProject(filename, self.labels_dictionary)
         except Exception as e:
             msgBox = QMessageBox()
             msgBox.setText("The json project contains an error:\n {0}\n\nPlease contact us.".format(str(e)))
@@ -2435,6 +2489,7 @@ class TagLab(QWidget):
 
         QApplication.restoreOverrideCursor()
         self.setProjectTitle(self.project.filename)
+        self.setupJournal()
 
         # show the first map present in project
         if len(self.project.images) > 0:
@@ -2485,6 +2540,11 @@ class TagLab(QWidget):
         QApplication.setOverrideCursor(Qt.WaitCursor)
         self.project.save()
 
+        # the saved project contains all the edits: the journal and the snapshot are not needed anymore
+        if self.journal is not None:
+            self.journal.discard()
+        self.setupJournal()
+
         QApplication.restoreOverrideCursor()
 
         if self.timer is None:
@@ -2499,6 +2559,8 @@ class TagLab(QWidget):
     #REFACTOR networks should be moved to a new class
     def resetNetworks(self):
 
+        self.stopClassification()
+
         torch.cuda.empty_cache()
 
         if self.deepextreme_net is not None:
@@ -2519,6 +2581,10 @@ class TagLab(QWidget):
             self.move()
             return
 
+        if self.isClassificationRunning():
+            self.infoWidget.setInfoMessage("Automatic classification is running.. (press ESC to stop it)")
+            return
+
         if self.available_classifiers == "None":
             self.btnAutoClassification.setChecked(False)
         else:
@@ -2539,6 +2605,7 @@ class TagLab(QWidget):
 
         # delete classifier widget
         if self.corals_classifier:
+            self.corals_classifier.releaseLabelMap()
             del self.corals_classifier
             self.corals_classifier = None
 
@@ -2602,50 +2669,82 @@ class TagLab(QWidget):
                 self.progress_bar.setProgress(0.0)
                 QApplication.processEvents()
 
-                # runs the classifier
-                self.infoWidget.setInfoMessage("Automatic classification is running..")
+                # runs the classifier (in background, the results are imported by classificationFinished)
+                self.infoWidget.setInfoMessage("Automatic classification is running.. (press ESC to stop it)")
 
-                self.corals_classifier.run(input_orthomap, 768, 512, 128)
+                self.classification_target = (self.activeviewer, self.activeviewer.image, orthomap.width(), orthomap.height())
 
-                if self.corals_classifier.flagStopProcessing is False:
+                self.corals_classifier.processingFinished.connect(self.classificationFinished)
+                self.corals_classifier.start(input_orthomap, 768, 512, 128)
 
-                    # import generated label map
-                    self.progress_bar.hidePerc()
-                    self.progress_bar.setMessage("Finalizing classification results..")
-                    QApplication.processEvents()
+    def isClassificationRunning(self):
+        return self.corals_classifier is not None and self.corals_classifier.isRunning()
 
-                    filename = os.path.join("temp", "labelmap.png")
+    def stopClassification(self):
+        """
+        Stop the automatic classification (if it is running) and wait for its threads.
+        """
+        if self.isClassificationRunning():
+            self.corals_classifier.stopProcessing()
+            self.corals_classifier.wait()
+            logfile.info("[AUTOCLASS] Automatic classification STOP by the users.")
+            self.resetAutomaticClassification()
 
-                    created_blobs = self.activeviewer.annotations.import_label_map(filename, self.labels_dictionary,
-                                                                                   orthomap.width(), orthomap.height())
-                    for blob in created_blobs:
-                        self.viewerplus.addBlob(blob, selected=False)
+    @pyqtSlot()
+    def classificationFinished(self):
+        """
+        Import the results of the automatic classification (called on the GUI thread when the processing ends).
+        """
+        if self.corals_classifier is None or self.sender() is not self.corals_classifier:
+            return
 
-                    logfile.info("[AUTOCLASS] Automatic classification ENDS.")
+        self.corals_classifier.wait()
 
-                    self.resetAutomaticClassification()
+        (viewer, image, w_target, h_target) = self.classification_target
+        self.classification_target = None
 
-                    # save and close
-                    msgBox = QMessageBox()
-                    msgBox.setWindowTitle(self.TAGLAB_VERSION)
-                    msgBox.setText(
-                        "Automatic classification is finished. TagLab will be close. Please, click ok and save the project.")
-                    msgBox.exec()
+        error_message = self.corals_classifier.error_message
+        if error_message is not None:
 
-                    self.saveAsProject()
+            logfile.info("[AUTOCLASS] Automatic classification FAILED: " + error_message)
+            self.resetAutomaticClassification()
 
-                    QApplication.quit()
+            msgBox = QMessageBox()
+            msgBox.setWindowTitle(self.TAGLAB_VERSION)
+            msgBox.setText("Automatic classification has failed: " + error_message)
+            msgBox.exec()
 
-                else:
+        elif self.corals_classifier.flagStopProcessing is False:
 
-                    logfile.info("[AUTOCLASS] Automatic classification STOP by the users.")
+            # import generated label map
+            self.progress_bar.hidePerc()
+            self.progress_bar.setMessage("Finalizing classification results..")
+            QApplication.processEvents()
+
+            created_blobs = image.annotations.import_class_map(self.corals_classifier.label_map,
+                                                               self.corals_classifier.label_names,
+                                                               self.labels_dictionary,
+                                                               w_target, h_target)
+
+            # the user can have changed the map shown in the meantime (the map can be shown in the other viewer)
+            for other_viewer in [self.viewerplus, self.viewerplus2]:
+                if other_viewer.image is image:
+                    viewer = other_viewer
+            viewer.addBlobsToImage(image, created_blobs)
+
+            logfile.info("[AUTOCLASS] Automatic classification ENDS.")
+
+            self.resetAutomaticClassification()
+
+            self.infoWidget.setInfoMessage("Automatic classification is finished (" + str(len(created_blobs)) + " regions).")
+
+        else:
 
-                    self.resetAutomaticClassification()
+            logfile.info("[AUTOCLASS] Automatic classification STOP by the users.")
 
-                    import gc
-                    gc.collect()
+            self.resetAutomaticClassification()
 
-                    self.move()
+            self.infoWidget.setInfoMessage("Automatic classification has been stopped.")
 
     def automaticSegmentation(self):
         self.img_overlay = QImage(self.segmentation_map_filename)
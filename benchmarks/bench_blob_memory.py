@@ -0,0 +1,98 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+# Memory benchmark of the blobs: a project of 50k blobs (built from the blobs of the sample project) is loaded
+# and the resident memory per blob is reported. To compare two versions of TagLab run the script on both, e.g.:
+#
+#   python benchmarks/bench_blob_memory.py
+#   python benchmarks/bench_blob_memory.py --taglab <folder of another version of TagLab>
+
+import os
+import sys
+import gc
+import json
+import argparse
+
+import numpy as np
+
+
+def residentMemory():
+    """
+    Resident memory of the process in bytes (Linux).
+    """
+    with open("/proc/self/statm", "r") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def blobRecords(count, sample_filename):
+    """
+    It generates count blob records (dictionaries as saved in the projects), the blobs of the sample project are
+    repeated with different ids and positions.
+    """
+    with open(sample_filename, "r") as f:
+        samples = json.load(f)["Segmentation Data"]
+
+    for i in range(count):
+        record = dict(samples[i % len(samples)])
+        shift = float(i // len(samples)) * 10.0
+        record["id"] = i + 1
+        record["contour"] = [[x + shift, y] for (x, y) in record["contour"]]
+        record["inner contours"] = [[[x + shift, y] for (x, y) in contour] for contour in record["inner contours"]]
+        record.setdefault("note", "")
+        yield record
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Resident memory per blob.")
+    parser.add_argument("--taglab", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help="folder of the version of TagLab to measure")
+    parser.add_argument("--blobs", type=int, default=50000)
+    args = parser.parse_args()
+
+    taglab_dir = os.path.abspath(args.taglab)
+    sys.path.insert(0, taglab_dir)
+    os.chdir(taglab_dir)
+
+    from PyQt5.QtWidgets import QApplication
+    from source.Blob import Blob
+
+    app = QApplication.instance() or QApplication(["bench"])
+
+    gc.collect()
+    start = residentMemory()
+
+    blobs = []
+    points = 0
+    for record in blobRecords(args.blobs, os.path.join("projects", "sample_project.json")):
+        blob = Blob(None, 0, 0, 0)
+        blob.fromDict(record)
+        points += blob.contour.shape[0] + sum(contour.shape[0] for contour in blob.inner_contours)
+        blobs.append(blob)
+
+    gc.collect()
+    used = residentMemory() - start
+
+    print("{:s}: {:d} blobs ({:d} contour points), {:.1f} MB, {:.0f} bytes per blob".format(
+        taglab_dir, len(blobs), points, used / 1.0e6, used / len(blobs)))
+
+
+if __name__ == '__main__':
+    main()
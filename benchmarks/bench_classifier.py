@@ -0,0 +1,118 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+# Benchmark of the classification of the tiles on the CPU (DeepLab V3+, random weights): the 9 shifted crops
+# of each tile classified one at a time (as before the batching) and in batches (MapClassifier.classifyBatch).
+#
+#   python benchmarks/bench_classifier.py [--tiles 4] [--tile-size 768] [--batch-size N] [--threads N]
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+
+CROPS_PER_TILE = 9
+NUM_CLASSES = 5
+AVERAGE_NORM = [0.4433, 0.4499, 0.4408]
+
+
+def createClassifier():
+    """
+    A MapClassifier with a randomly initialized network (the weights do not change the time of the inference).
+    """
+    from models.deeplab import DeepLab
+    from source.MapClassifier import MapClassifier
+
+    class RandomMapClassifier(MapClassifier):
+
+        def _load_classifier(self, modelName):
+            return DeepLab(backbone='resnet', output_stride=16, num_classes=self.nclasses, sync_bn=False).eval()
+
+    classifier_info = {"Classifier Name": "Benchmark", "Num. Classes": NUM_CLASSES,
+                       "Classes": ["Background"] + ["Class {:d}".format(i) for i in range(1, NUM_CLASSES)],
+                       "Average Norm.": AVERAGE_NORM, "Weights": None}
+    labels_info = {name: [255, 0, 0] for name in classifier_info["Classes"]}
+
+    return RandomMapClassifier(classifier_info, labels_info)
+
+
+def classifyTiles(classifier, crops, batch_size, device):
+
+    for start in range(0, crops.shape[0], batch_size):
+        classifier.classifyBatch(crops[start:start + batch_size], device)
+
+
+def timeIt(function, repetitions):
+
+    best = float("inf")
+    for i in range(repetitions):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Batched vs single-crop classification of the tiles on the CPU.")
+    parser.add_argument("--tiles", type=int, default=4, help="number of tiles classified")
+    parser.add_argument("--tile-size", type=int, default=768, help="input size of the network")
+    parser.add_argument("--batch-size", type=int, default=None, help="crops per batch (default: chooseBatchSize)")
+    parser.add_argument("--threads", type=int, default=None, help="threads of PyTorch (default: one per core)")
+    parser.add_argument("--repetitions", type=int, default=2)
+    args = parser.parse_args()
+
+    if torch is None:
+        print("PyTorch is not installed, the benchmark of the classifier is skipped.")
+        return
+
+    classifier = createClassifier()
+    classifier.num_threads = args.threads
+
+    device = torch.device("cpu")
+    torch.set_num_threads(classifier.cpuThreads())
+
+    batch_size = args.batch_size if args.batch_size is not None else classifier.chooseBatchSize(args.tile_size, device)
+
+    rng = np.random.RandomState(0)
+    crops = rng.randint(0, 256, size=(CROPS_PER_TILE * args.tiles, args.tile_size, args.tile_size, 3), dtype=np.uint8)
+
+    # warm-up (allocation of the buffers of the first inference)
+    classifier.classifyBatch(crops[:1], device)
+
+    print("{:d} tiles of {:d} x {:d} pixels ({:d} crops), {:d} threads".format(args.tiles, args.tile_size,
+          args.tile_size, crops.shape[0], torch.get_num_threads()))
+    print("{:>12s} {:>10s} {:>10s} {:>10s}".format("mode", "batch", "time", "tiles/s"))
+
+    for (mode, size) in [("single", 1), ("batched", batch_size)]:
+        elapsed = timeIt(lambda: classifyTiles(classifier, crops, size, device), args.repetitions)
+        print("{:>12s} {:>10d} {:>9.2f}s {:>10.2f}".format(mode, size, elapsed, args.tiles / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+# Micro-benchmark of the contour extraction (Blob.createContourFromMask) on blobs from 1k x 1k to 8k x 8k pixels:
+# the original per-point implementation, the vectorized one (two iso-contour passes) and the single pass mode.
+#
+#   python benchmarks/bench_contours.py
+
+import os
+import sys
+import time
+import numpy as np
+from skimage import measure
+from skimage.util import pad
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from source.Blob import Blob
+
+
+def originalContourFromMask(blob, mask, bbox):
+    """
+    Blob.createContourFromMask before the vectorization (per-point loops).
+    """
+    blob.inner_contours = []
+
+    PADDED_SIZE = 4
+    img_padded = pad(mask, (PADDED_SIZE, PADDED_SIZE), mode="constant", constant_values=(0, 0))
+
+    contours = measure.find_contours(img_padded, 0.6)
+    inner_contours = measure.find_contours(img_padded, 0.4)
+
+    longest = max(range(len(contours)), key=lambda i: contours[i].shape[0])
+    inner_longest = max(range(len(inner_contours)), key=lambda i: inner_contours[i].shape[0])
+
+    blob.contour = np.array(contours[longest])
+    for i, contour in enumerate(inner_contours):
+        if i != inner_longest and contour.shape[0] > 20:
+            blob.inner_contours.append(np.array(contour))
+
+    for i in range(blob.contour.shape[0]):
+        ycoor = blob.contour[i, 0]
+        xcoor = blob.contour[i, 1]
+        blob.contour[i, 0] = xcoor - PADDED_SIZE + bbox[1]
+        blob.contour[i, 1] = ycoor - PADDED_SIZE + bbox[0]
+
+    for j, contour in enumerate(blob.inner_contours):
+        for i in range(contour.shape[0]):
+            ycoor = contour[i, 0]
+            xcoor = contour[i, 1]
+            blob.inner_contours[j][i, 0] = xcoor - PADDED_SIZE + bbox[1]
+            blob.inner_contours[j][i, 1] = ycoor - PADDED_SIZE + bbox[0]
+
+
+def coralMask(size):
+    """
+    A colony-like region: a disk with a wavy border and a few holes.
+    """
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size - 0.5
+    angle = np.arctan2(y, x)
+    radius = np.sqrt(x * x + y * y)
+    mask = radius < 0.42 + 0.05 * np.sin(17.0 * angle) + 0.02 * np.sin(53.0 * angle)
+    for (cx, cy) in [(-0.15, -0.1), (0.1, 0.15), (0.2, -0.12), (-0.05, 0.25)]:
+        mask &= (x - cx) ** 2 + (y - cy) ** 2 > 0.003
+    return mask.astype(np.uint8)
+
+
+def timeIt(function, repetitions):
+
+    best = float("inf")
+    for i in range(repetitions):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+
+    print("{:>6s} {:>9s} {:>12s} {:>12s} {:>12s}".format("size", "points", "original", "two passes", "single pass"))
+
+    for size in [1024, 2048, 4096, 8192]:
+
+        mask = coralMask(size)
+        bbox = [100, 200, size, size]
+        blob = Blob(None, 0, 0, 0)
+        repetitions = 5 if size <= 2048 else 2
+
+        original = timeIt(lambda: originalContourFromMask(blob, mask, bbox), repetitions)
+        points = blob.contour.shape[0] + sum(contour.shape[0] for contour in blob.inner_contours)
+
+        Blob.SINGLE_PASS_CONTOURS = False
+        two_passes = timeIt(lambda: blob.createContourFromMask(mask, bbox), repetitions)
+
+        Blob.SINGLE_PASS_CONTOURS = True
+        single_pass = timeIt(lambda: blob.createContourFromMask(mask, bbox), repetitions)
+        Blob.SINGLE_PASS_CONTOURS = False
+
+        print("{:>6d} {:>9d} {:>10.1f}ms {:>10.1f}ms {:>10.1f}ms".format(size, points, original * 1000.0,
+                                                                         two_passes * 1000.0, single_pass * 1000.0))
+
+
+if __name__ == '__main__':
+    main()
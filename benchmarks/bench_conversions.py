@@ -0,0 +1,174 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+# Benchmark of the QImage <-> NumPy conversions: the functions of utils removed by the conversion module
+# (copied here) against the ones of ConversionUtils, at the scale of a tile (MapClassifier) and of a map.
+#
+#   python benchmarks/bench_conversions.py
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtGui import QImage, qRgb
+
+from source.ConversionUtils import qimage2ndarray, ndarray2qimage, qimage2mask, mask2qimage, floatmap2qimage
+
+
+def qimageToNumpyArray(qimg):
+
+    w = qimg.width()
+    h = qimg.height()
+
+    arr = np.zeros((h, w, 3), dtype=np.uint8)
+
+    bits = qimg.bits()
+    bits.setsize(int(h * w * 4))
+    arrtemp = np.frombuffer(bits, np.uint8).copy()
+    arrtemp = np.reshape(arrtemp, [h, w, 4])
+    arr[:, :, 0] = arrtemp[:, :, 2]
+    arr[:, :, 1] = arrtemp[:, :, 1]
+    arr[:, :, 2] = arrtemp[:, :, 0]
+
+    return arr
+
+
+def rgbToQImage(image):
+
+    h = image.shape[0]
+    w = image.shape[1]
+
+    imgdata = np.zeros([h, w, 4], dtype=np.uint8)
+    imgdata[:, :, 2] = image[:, :, 0]
+    imgdata[:, :, 1] = image[:, :, 1]
+    imgdata[:, :, 0] = image[:, :, 2]
+    imgdata[:, :, 3] = 255
+    qimg = QImage(imgdata.data, w, h, QImage.Format_RGB32)
+
+    return qimg.copy()
+
+
+def floatmapToQImage(floatmap, nodata=float('NaN')):
+
+    h = floatmap.shape[0]
+    w = floatmap.shape[1]
+
+    fmap = floatmap.copy()
+    max_value = np.max(fmap)
+    fmap[fmap == nodata] = max_value
+    min_value = np.min(fmap)
+
+    fmap = (fmap - min_value) / (max_value - min_value)
+    fmap = 255.0 * fmap
+    fmap = fmap.astype(np.uint8)
+
+    img = np.zeros([h, w, 3], dtype=np.uint8)
+    img[:, :, 0] = fmap
+    img[:, :, 1] = fmap
+    img[:, :, 2] = fmap
+
+    return rgbToQImage(img)
+
+
+def maskToQImage(mask):
+
+    h = mask.shape[0]
+    w = mask.shape[1]
+    qimg = QImage(w, h, QImage.Format_RGB32)
+    qimg.fill(qRgb(0, 0, 0))
+
+    for y in range(h):
+        for x in range(w):
+            if mask[y, x] == 1:
+                qimg.setPixel(x, y, qRgb(255, 255, 255))
+
+    return qimg
+
+
+def qimageToMask(qimg):
+    """
+    The mask extraction of prepareLabelForDeepExtreme.
+    """
+    h = qimg.height()
+    w = qimg.width()
+
+    arr = np.zeros((h, w, 1), dtype=np.uint8)
+
+    bits = qimg.bits()
+    bits.setsize(int(h * w * 4))
+    arrtemp = np.frombuffer(bits, np.uint8).copy()
+    arrtemp = np.reshape(arrtemp, [h, w, 4])
+
+    for y in range(h):
+        for x in range(w):
+            if arrtemp[y, x, 2] != 0 or arrtemp[y, x, 1] != 0 or arrtemp[y, x, 0] != 0:
+                arr[y, x] = 1
+
+    return arr
+
+
+def timeIt(function, repetitions):
+
+    best = float("inf")
+    for i in range(repetitions):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000.0
+
+
+def report(name, old, new):
+    print("{:<40s} {:>10.3f} ms {:>10.3f} ms {:>8.1f}x".format(name, old, new, old / new))
+
+
+def main():
+
+    rng = np.random.default_rng(0)
+
+    print("{:<40s} {:>13s} {:>16s} {:>6s}".format("", "utils", "ConversionUtils", "speedup"))
+
+    for (name, w, h, repetitions) in [("tile", 768, 768, 20), ("map", 8000, 6000, 3)]:
+
+        rgb = rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8)
+        qimg = ndarray2qimage(rgb)
+        heights = rng.random((h, w), dtype=np.float32) * 10.0
+
+        report("qimage -> array (" + name + ")", timeIt(lambda: qimageToNumpyArray(qimg), repetitions),
+               timeIt(lambda: qimage2ndarray(qimg), repetitions))
+        report("qimage -> array view (" + name + ")", timeIt(lambda: qimageToNumpyArray(qimg), repetitions),
+               timeIt(lambda: qimage2ndarray(qimg, copy=False), repetitions))
+        report("array -> qimage (" + name + ")", timeIt(lambda: rgbToQImage(rgb), repetitions),
+               timeIt(lambda: ndarray2qimage(rgb), repetitions))
+        report("float map -> qimage (" + name + ")", timeIt(lambda: floatmapToQImage(heights), repetitions),
+               timeIt(lambda: floatmap2qimage(heights), repetitions))
+
+    # the per-pixel loops are measured on the size of a blob
+    mask = np.zeros((300, 300), dtype=np.uint8)
+    mask[50:250, 60:220] = 1
+    mask_qimg = mask2qimage(mask)
+    report("mask -> qimage (300x300)", timeIt(lambda: maskToQImage(mask), 3), timeIt(lambda: mask2qimage(mask), 20))
+    report("qimage -> mask (300x300)", timeIt(lambda: qimageToMask(mask_qimg), 3),
+           timeIt(lambda: qimage2mask(mask_qimg), 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+# Automatic classification of projects and maps from the command line (no GUI), e.g.:
+#
+#   python classify.py --classifier Porite --output results plot1.tlb plot2.tlb map3.tif --px-to-mm 0.9
+#
+# Each input is saved as a project in the output directory (or in the output file, if there is only one input).
+
+import os
+import sys
+import json
+import argparse
+
+from source.BatchClassifier import runBatch, outputFilename, isProjectFile
+
+# the list of the modes is repeated here: InferenceModes imports PyTorch, only the workers need it
+INFERENCE_MODES = ["float32", "jit", "bfloat16", "int8-dynamic", "int8-static"]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="TagLab automatic classification (headless).")
+    parser.add_argument("inputs", nargs="+", help="projects (.json, .tlb) or RGB maps to classify")
+    parser.add_argument("--classifier", required=True, help="name of the classifier (see \"Available Classifiers\" in config.json)")
+    parser.add_argument("--output", required=True, help="output directory (or output project, for a single input)")
+    parser.add_argument("--px-to-mm", type=float, default=None, help="pixel size (in mm) of the maps given as input")
+    parser.add_argument("--workers", type=int, default=None, help="maximum number of inputs processed concurrently")
+    parser.add_argument("--memory", type=float, default=None, help="memory budget in GB (default: 80%% of the free memory)")
+    parser.add_argument("--batch-size", type=int, default=None, help="crops classified together (default: from the memory)")
+    parser.add_argument("--inference-mode", default="float32", choices=INFERENCE_MODES,
+                        help="reduced precision/quantized inference on the CPU")
+    parser.add_argument("--reference-tiles", default=None,
+                        help="folder of tiles (*.png) used to calibrate and check the inference mode against float32")
+    args = parser.parse_args()
+
+    # the inputs are relative to the current directory, the networks and the configuration to the TagLab directory
+    inputs = [os.path.abspath(filename) for filename in args.inputs]
+    output = os.path.abspath(args.output)
+    reference_tiles = os.path.abspath(args.reference_tiles) if args.reference_tiles is not None else None
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    with open("config.json", "r") as f:
+        config_dict = json.load(f)
+
+    classifier_info = None
+    for info in config_dict["Available Classifiers"]:
+        if info["Classifier Name"] == args.classifier:
+            classifier_info = info
+    if classifier_info is None:
+        names = [info["Classifier Name"] for info in config_dict["Available Classifiers"]]
+        parser.error("unknown classifier " + args.classifier + " (available: " + ", ".join(names) + ")")
+
+    if args.inference_mode != "float32":
+        from source.InferenceModes import availableInferenceModes
+        available = availableInferenceModes()
+        if args.inference_mode not in available:
+            parser.error("the inference mode " + args.inference_mode + " is not supported by the PyTorch installed "
+                         "(available: " + ", ".join(available) + ")")
+
+    if args.px_to_mm is None and not all(isProjectFile(filename) for filename in inputs):
+        parser.error("--px-to-mm is required to classify a map")
+
+    if len(inputs) == 1 and isProjectFile(output):
+        jobs = [(inputs[0], output)]
+    else:
+        os.makedirs(output, exist_ok=True)
+        jobs = [(filename, outputFilename(filename, output)) for filename in inputs]
+
+    memory_budget = int(args.memory * 1.0e9) if args.memory is not None else None
+
+    failed = runBatch(jobs, classifier_info, config_dict["Labels"], px_to_mm=args.px_to_mm,
+                      max_workers=args.workers, memory_budget=memory_budget, batch_size=args.batch_size,
+                      inference_mode=args.inference_mode, reference_tiles=reference_tiles)
+
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,6 +18,7 @@
 # for more details.
 
 import os
+import heapq
 import numpy as np
 from cv2 import fillPoly
 
@@ -32,12 +33,14 @@ from skimage.color import rgb2gray
 from skimage.draw import polygon_perimeter
 
 from source import utils
+from source.ConversionUtils import qimage2ndarray
 
 import pandas as pd
 from scipy import ndimage as ndi
 from skimage.morphology import watershed, flood
 from skimage.filters import gaussian
 from source.Blob import Blob
+from source.SpatialIndex import SpatialIndex
 import source.Mask as Mask
 
 #refactor: remove groups
@@ -76,7 +79,7 @@ class Group(object):
 
         # update instance name for each blob
         for blob in self.blobs:
-            blob.instace_name = "coral-group-" + str(id)
+            blob.instance_name = "coral-group-" + str(id)
 
 
 #refactor: change name to annotationS
@@ -91,6 +94,18 @@ class Annotation(object):
         # list of all blobs
         self.seg_blobs = []
 
+        # id -> blob (to find a blob quickly given its id)
+        self.blobs_by_id = {}
+
+        # min-heap of the ids released below next_id (it may contain ids used again in the meantime)
+        self.free_ids = []
+
+        # all the ids lower than next_id are used or stored in the free_ids heap
+        self.next_id = 0
+
+        # spatial index of the blobs (to speed up picking and selection)
+        self.spatial_index = SpatialIndex()
+
         # list of all groups
         self.groups = []
 
@@ -110,20 +125,31 @@ class Annotation(object):
         return group
 
     def addBlob(self, blob):
-        used = [blob.id for blob in self.seg_blobs]
-        if blob.id in used:
+        if blob.id in self.blobs_by_id:
             blob.id = self.getFreeId()
         self.seg_blobs.append(blob)
+        self.blobs_by_id[blob.id] = blob
+        while self.next_id in self.blobs_by_id:
+            self.next_id += 1
+        self.spatial_index.insert(blob)
 
     def removeBlob(self, blob):
         index = self.seg_blobs.index(blob)
         del self.seg_blobs[index]
+        if self.blobs_by_id.get(blob.id) is blob:
+            del self.blobs_by_id[blob.id]
+            if blob.id < self.next_id:
+                heapq.heappush(self.free_ids, blob.id)
+        self.spatial_index.remove(blob)
+
+    def updateBlob(self, blob):
+        """
+        It must be called when the geometry of a blob already stored is modified (e.g. updateUsingMask).
+        """
+        self.spatial_index.update(blob)
 
     def blobById(self, id):
-        for blob in self.seg_blobs:
-            if blob.id == id:
-                return blob
-        return None
+        return self.blobs_by_id.get(id)
 
     def save(self):
         return self.seg_blobs
@@ -154,20 +180,23 @@ class Annotation(object):
         return last_blobs_added
 
     def getFreeId(self):
-        used = []
-        for blob  in self.seg_blobs:
-            used.append(blob.id)
-        for id in range(len(used)):
-            if id not in used:
-                return id
-        return len(used)
+        """
+        It returns the smallest id not used (the id is not reserved until the blob is added).
+        """
+        while len(self.free_ids) > 0 and self.free_ids[0] in self.blobs_by_id:
+            heapq.heappop(self.free_ids)
+
+        if len(self.free_ids) > 0:
+            return self.free_ids[0]
+
+        return self.next_id
 
     def removeGroup(self, group):
 
         # the blobs no more belong to this group
         for blob in group.blobs:
             blob.group = None
-            blob.instace_name = "coral" + str(blob.id)
+            blob.instance_name = "coral" + str(blob.id)
 
         # remove from the list of the groups
         index = self.groups.index(group)
@@ -213,6 +242,7 @@ class Annotation(object):
         if mask.any():
             # measure is brutally slower with non int types (factor 4), while byte&bool would be faster by 25%, conversion is fast.
             blobA.updateUsingMask(box, mask.astype(int))
+            self.updateBlob(blobA)
             return True
         return False
 
@@ -304,7 +334,7 @@ class Annotation(object):
         mask = blob.getMask()
         box = blob.bbox
         cropimg = utils.cropQImage(map, box)
-        cropimgnp = rgb2gray(utils.qimageToNumpyArray(cropimg))
+        cropimgnp = rgb2gray(qimage2ndarray(cropimg))
 
         edges = sobel(cropimgnp)
 
@@ -404,6 +434,7 @@ class Annotation(object):
             Mask.paintMask(mask, box, inner_mask, inner_box, 0)
 
         blob.updateUsingMask(box, mask)
+        self.updateBlob(blob)
         return
 
     def editBorderContour(self, blob, contour, points):
@@ -467,6 +498,51 @@ class Annotation(object):
         print("Size deviation   : %f" % np.std(dimensions))
         print("-------------------------")
 
+    def computeMeasures(self, blobs=None, scale=1.0):
+        """
+        It computes area, perimeter and centroid of many blobs at once, multiplied by scale (e.g. to convert
+        pixels in millimeters). The area is the pixel count of the mask and the centroid the one of the pixels
+        (as stored in the blobs). The perimeters are computed from the contours of all the blobs stacked in a
+        single buffer, so the computation does not loop over the points.
+        It returns (areas, perimeters, centroids).
+        """
+
+        if blobs is None:
+            blobs = self.seg_blobs
+
+        nblobs = len(blobs)
+
+        areas = np.array([blob.area for blob in blobs], dtype=np.float64) * scale * scale
+        centroids = np.array([blob.centroid for blob in blobs], dtype=np.float64).reshape(nblobs, 2) * scale
+
+        contours = []
+        blob_index = []
+        for i, blob in enumerate(blobs):
+            for contour in [blob.contour] + list(blob.inner_contours):
+                if contour.shape[0] > 0:
+                    contours.append(contour)
+                    blob_index.append(i)
+
+        if len(contours) == 0:
+            return (areas, np.zeros(nblobs), centroids)
+
+        lengths = np.array([contour.shape[0] for contour in contours])
+        starts = np.zeros(len(contours), dtype=np.int64)
+        starts[1:] = np.cumsum(lengths)[:-1]
+        ends = starts + lengths
+
+        points = np.concatenate(contours).astype(np.float64)
+
+        # the contours are closed, the last point of each contour is connected to the first one
+        next_index = np.arange(1, points.shape[0] + 1)
+        next_index[ends - 1] = starts
+        segments = points[next_index] - points
+
+        lengths = np.add.reduceat(np.sqrt((segments * segments).sum(axis=1)), starts)
+        perimeters = np.bincount(np.array(blob_index), weights=lengths, minlength=nblobs) * scale
+
+        return (areas, perimeters, centroids)
+
     def clickedBlob(self, x, y):
         """
         It returns the blob clicked with the smallest area (to avoid problems with overlapping blobs).
@@ -474,9 +550,10 @@ class Annotation(object):
 
         blobs_clicked = []
 
-        for blob in self.seg_blobs:
+        # only the blobs whose bbox contains the point are tested
+        point = np.array([[x, y]])
+        for blob in self.spatial_index.queryPoint(x, y):
 
-            point = np.array([[x, y]])
             out = measure.points_in_poly(point, blob.contour)
             if out[0] == True:
                 blobs_clicked.append(blob)
@@ -491,6 +568,15 @@ class Annotation(object):
 
         return selected_blob
 
+    def blobsInsideBox(self, top, left, width, height):
+        """
+        It returns the blobs entirely contained in the given box (top, left, width, height).
+        """
+
+        if width < 0 or height < 0:
+            return []
+
+        return self.spatial_index.queryInsideBox(top, left, width, height)
 
 
 
@@ -543,7 +629,7 @@ class Annotation(object):
         if w_target > 0 and h_target > 0:
             qimg_label_map = qimg_label_map.scaled(w_target, h_target, Qt.IgnoreAspectRatio, Qt.FastTransformation)
 
-        label_map = utils.qimageToNumpyArray(qimg_label_map)
+        label_map = qimage2ndarray(qimg_label_map)
         label_map = label_map.astype(np.int32)
 
         # RGB -> label code association (ok, it is a dirty trick but it saves time..)
@@ -577,6 +663,44 @@ class Annotation(object):
         return created_blobs
 
 
+    def import_class_map(self, class_map, class_names, labels_info, w_target, h_target, create_holes=False):
+        """
+        It creates the blobs from a map of class indices (e.g. the output of the MapClassifier), class_names
+        gives the name of each index. The map is rescaled (nearest neighbor) such that it coincides with the
+        reference map. The regions of the "Background" class are not converted.
+        """
+
+        (h, w) = class_map.shape[:2]
+        if w_target > 0 and h_target > 0 and (w_target != w or h_target != h):
+            rows = (np.arange(int(h_target)) * h) // int(h_target)
+            cols = (np.arange(int(w_target)) * w) // int(w_target)
+            class_map = class_map[rows[:, np.newaxis], cols]
+        else:
+            class_map = np.asarray(class_map)
+
+        background = class_names.index("Background") if "Background" in class_names else -1
+        labels = measure.label(class_map.astype(np.int16), background=background, connectivity=1)
+
+        too_much_small_area = 50
+
+        created_blobs = []
+        for region in measure.regionprops(labels):
+            if region.area > too_much_small_area:
+                blob = Blob(region, 0, 0, self.getFreeId())
+
+                # assign class
+                row = region.coords[0, 0]
+                col = region.coords[0, 1]
+                label_name = class_names[class_map[row, col]]
+
+                if label_name in labels_info:
+                    blob.class_name = label_name
+                    blob.class_color = labels_info[label_name]
+                if create_holes or blob.class_name != 'Empty':
+                    created_blobs.append(blob)
+
+        return created_blobs
+
     def export_data_table_for_Scripps(self, scale_factor, filename):
 
         # create a list of properties
@@ -601,13 +725,15 @@ class Annotation(object):
         coral_maximum_diameter = np.zeros(number_of_seg)
         coral_note = []
 
+        (areas, perimeters, centroids) = self.computeMeasures(visible_blobs, scale_factor)
+
         for i, blob in enumerate(visible_blobs):
 
             class_name.append(blob.class_name)
             centroid_x[i] = round(blob.centroid[0], 1)
             centroid_y[i] = round(blob.centroid[1], 1)
-            coral_area[i] = round(blob.area * (scale_factor) * (scale_factor)/ 100,2)
-            coral_perimeter[i] = round(blob.perimeter*scale_factor / 10,1)
+            coral_area[i] = round(areas[i] / 100,2)
+            coral_perimeter[i] = round(perimeters[i] / 10,1)
             #coral_maximum_diameter[i] = blob.major_axis_length
             coral_note.append(blob.note)
 
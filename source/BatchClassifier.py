@@ -0,0 +1,310 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+# HEADLESS AUTOMATIC CLASSIFICATION.
+# The same steps of TagLab.applyClassifier (rescaling of the map to the scale of the network, tiled inference,
+# extraction of the regions) without QApplication and widgets. Each input (a project or a map) is processed by
+# a separate process, several inputs are processed concurrently as long as their estimated memory fits the budget.
+
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from PyQt5.QtCore import Qt, QDir
+
+from source.Project import Project, loadProject, loadProjectHeader
+from source.Image import Image
+from source.Channel import Channel
+
+PROJECT_EXTENSIONS = (".json", ".tlb")
+
+# estimated memory used per pixel of the rescaled map: RGB32 map (4), label map (1), labels of the regions (8)
+# and temporary copies made while the regions are extracted
+BYTES_PER_PIXEL = 24
+
+# estimated memory used by the network (weights and activations of a batch)
+NETWORK_MEMORY = 4 * 1024 * 1024 * 1024
+
+
+def isProjectFile(filename):
+    return filename.lower().endswith(PROJECT_EXTENSIONS)
+
+
+def availableMemory():
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def availableCores():
+
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def scaleFactor(image, classifier_info):
+    """
+    Scale factor from the map to the scale the network has been trained on.
+    """
+    return classifier_info['Scale'] / image.map_px_to_mm_factor
+
+
+def createProject(map_filename, px_to_mm, labels_dict):
+    """
+    Create a project with a single map (as done when a map is loaded in TagLab).
+    """
+    name = os.path.splitext(os.path.basename(map_filename))[0]
+
+    image = Image(map_px_to_mm_factor=px_to_mm, id=name, name=name)
+    image.addChannel(QDir(os.getcwd()).relativeFilePath(map_filename), "RGB")
+
+    project = Project()
+    project.importLabelsFromConfiguration(labels_dict)
+    project.images.append(image)
+    return project
+
+
+def openProject(filename, px_to_mm, labels_dict):
+
+    if isProjectFile(filename):
+        project = loadProject(filename, labels_dict)
+        project.importLabelsFromConfiguration(labels_dict)
+        return project
+
+    return createProject(filename, px_to_mm, labels_dict)
+
+
+def mapSizes(filename, px_to_mm):
+    """
+    It returns the (width, height, pixel size) of the maps of a project (or of a map) without loading it,
+    the sizes are read from the header of the project or from the header of the map files.
+    """
+    if not isProjectFile(filename):
+        (width, height) = Channel(filename, "RGB").readSize()
+        return [(width, height, px_to_mm)]
+
+    data = loadProjectHeader(filename)
+
+    # old project format (a single map)
+    if "Map File" in data:
+        (width, height) = Channel(QDir(os.getcwd()).relativeFilePath(data["Map File"]), "RGB").readSize()
+        return [(width, height, data["Map Scale"])]
+
+    sizes = []
+    for image_data in data.get("images", []):
+        width = image_data.get("width")
+        height = image_data.get("height")
+        # the size is not saved in the older projects
+        if width is None or height is None:
+            rgb_channels = [channel for channel in image_data.get("channels", []) if channel.get("type") == "RGB"]
+            if len(rgb_channels) == 0:
+                raise Exception("The map " + str(image_data.get("name")) + " has no RGB channel.")
+            (width, height) = Channel(rgb_channels[0]["filename"], "RGB").readSize()
+        sizes.append((width, height, image_data.get("map_px_to_mm_factor", 1.0)))
+
+    return sizes
+
+
+def estimateMemory(filename, classifier_info, px_to_mm):
+    """
+    Estimate the memory needed to classify the maps of a project (or a map), the maps of a project
+    are classified one at a time.
+    """
+    pixels = 0
+    for (width, height, map_px_to_mm) in mapSizes(filename, px_to_mm):
+        scale = classifier_info['Scale'] / map_px_to_mm
+        pixels = max(pixels, width * height * scale * scale + width * height)
+
+    return int(pixels * BYTES_PER_PIXEL) + NETWORK_MEMORY
+
+
+def classifyImage(image, classifier_info, labels_dict, num_threads=None, batch_size=None, inference_mode="float32",
+                  reference_tiles=None):
+    """
+    Classify the RGB map of an image and add the regions found to its annotations (see InferenceModes for
+    inference_mode and reference_tiles).
+    It returns the statistics of the processing (sizes, times and number of regions).
+    """
+    # imported here: the parent process does not need PyTorch
+    from source.MapClassifier import MapClassifier
+
+    rgb_channel = None
+    for channel in image.channels:
+        if channel.type == "RGB":
+            rgb_channel = channel
+            break
+    if rgb_channel is None:
+        raise Exception("The map " + str(image.name) + " has no RGB channel.")
+
+    start = time.perf_counter()
+
+    orthomap = rgb_channel.loadData()
+
+    scale_factor = scaleFactor(image, classifier_info)
+    w_target = orthomap.width() * scale_factor
+    h_target = orthomap.height() * scale_factor
+    input_orthomap = orthomap.scaled(w_target, h_target, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+    rescaling_time = time.perf_counter()
+
+    classifier = MapClassifier(classifier_info, labels_dict, inference_mode, reference_tiles)
+    classifier.num_threads = num_threads
+    classifier.batch_size = batch_size
+    classifier.run(input_orthomap, 768, 512, 128)
+
+    inference_time = time.perf_counter()
+
+    try:
+        created_blobs = image.annotations.import_class_map(classifier.label_map, classifier.label_names,
+                                                           labels_dict, orthomap.width(), orthomap.height())
+    finally:
+        classifier.releaseLabelMap()
+
+    for blob in created_blobs:
+        image.annotations.addBlob(blob)
+
+    end = time.perf_counter()
+
+    # the map is not needed anymore
+    rgb_channel.qimage = None
+    rgb_channel.pyramid = None
+
+    return { "name": image.name,
+             "width": orthomap.width(),
+             "height": orthomap.height(),
+             "classified pixels": input_orthomap.width() * input_orthomap.height(),
+             "regions": len(created_blobs),
+             "rescaling time": rescaling_time - start,
+             "inference time": inference_time - rescaling_time,
+             "extraction time": end - inference_time,
+             "total time": end - start }
+
+
+def classifyFile(filename, output_filename, classifier_info, labels_dict, px_to_mm=1.0,
+                 num_threads=None, batch_size=None, inference_mode="float32", reference_tiles=None):
+    """
+    Classify all the maps of a project (or a single map) and save the resulting project.
+    It returns the statistics of each map (see classifyImage).
+    """
+    project = openProject(filename, px_to_mm, labels_dict)
+
+    stats = []
+    for image in project.images:
+        stats.append(classifyImage(image, classifier_info, labels_dict, num_threads, batch_size,
+                                   inference_mode, reference_tiles))
+
+    project.save(output_filename)
+    return stats
+
+
+def outputFilename(filename, output, extension=".tlb"):
+    """
+    The name of the project written for an input, output is a directory.
+    """
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(output, name + extension)
+
+
+def formatStats(stats):
+
+    mpixels = stats["width"] * stats["height"] / 1.0e6
+    throughput = mpixels / stats["total time"] if stats["total time"] > 0 else 0.0
+
+    return "{:s}: {:d}x{:d} ({:.1f} Mpx), {:d} regions, rescaling {:.1f} s, inference {:.1f} s, " \
+           "extraction {:.1f} s, total {:.1f} s ({:.2f} Mpx/s)".format(str(stats["name"]), stats["width"],
+           stats["height"], mpixels, stats["regions"], stats["rescaling time"], stats["inference time"],
+           stats["extraction time"], stats["total time"], throughput)
+
+
+def runBatch(jobs, classifier_info, labels_dict, px_to_mm=1.0, max_workers=None, memory_budget=None,
+             batch_size=None, inference_mode="float32", reference_tiles=None, report=print):
+    """
+    Classify a list of (input filename, output filename). The inputs are processed by a pool of processes,
+    a new input is started only if its estimated memory fits in the memory budget left by the running ones
+    (one input is always started, also if it exceeds the budget). The cores are split among the workers.
+    It returns the list of the inputs that failed.
+    """
+    cores = availableCores()
+    if max_workers is None:
+        max_workers = max(1, cores // 4)
+    if memory_budget is None:
+        available = availableMemory()
+        memory_budget = int(0.8 * available) if available is not None else NETWORK_MEMORY
+    num_threads = max(1, cores // max_workers)
+
+    report("Classification of {:d} input(s), {:d} worker(s) with {:d} thread(s), memory budget {:.1f} GB".format(
+        len(jobs), max_workers, num_threads, memory_budget / 1.0e9))
+
+    # an input that cannot be read fails here, the others are classified anyway
+    failed = []
+    pending = []
+    for (filename, output_filename) in jobs:
+        try:
+            memory = estimateMemory(filename, classifier_info, px_to_mm)
+            pending.append((filename, output_filename, memory))
+        except Exception as e:
+            failed.append(filename)
+            report(filename + " FAILED: " + str(e))
+
+    running = {}
+    used_memory = 0
+    batch_start = time.perf_counter()
+    total_pixels = 0
+
+    # spawn: the workers do not inherit the state of PyTorch/CUDA of the parent
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+
+        while len(pending) > 0 or len(running) > 0:
+
+            # start the inputs that fit in the memory left
+            i = 0
+            while i < len(pending) and len(running) < max_workers:
+                (filename, output_filename, memory) = pending[i]
+                if len(running) == 0 or used_memory + memory <= memory_budget:
+                    future = executor.submit(classifyFile, filename, output_filename, classifier_info, labels_dict,
+                                             px_to_mm, num_threads, batch_size, inference_mode, reference_tiles)
+                    running[future] = (filename, output_filename, memory)
+                    used_memory += memory
+                    del pending[i]
+                else:
+                    i += 1
+
+            done, not_done = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            for future in done:
+                (filename, output_filename, memory) = running.pop(future)
+                used_memory -= memory
+                try:
+                    for stats in future.result():
+                        total_pixels += stats["width"] * stats["height"]
+                        report(formatStats(stats))
+                    report(filename + " -> " + output_filename)
+                except Exception as e:
+                    failed.append(filename)
+                    report(filename + " FAILED: " + str(e))
+
+    elapsed = time.perf_counter() - batch_start
+    report("Classified {:.1f} Mpx in {:.1f} s ({:.2f} Mpx/s), {:d} input(s) failed".format(
+        total_pixels / 1.0e6, elapsed, total_pixels / 1.0e6 / elapsed if elapsed > 0 else 0.0, len(failed)))
+
+    return failed
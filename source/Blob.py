@@ -25,7 +25,7 @@ from skimage import measure
 from skimage.util import pad
 from scipy import ndimage as ndi
 from PyQt5.QtGui import QPainterPath, QPolygonF, QImage, QPixmap, qRgba
-from PyQt5.QtCore import QPointF
+from PyQt5.QtCore import Qt, QPointF
 
 from skimage.morphology import flood, flood_fill, binary_dilation, binary_erosion
 from skimage.measure import points_in_poly
@@ -35,21 +35,63 @@ from cv2 import fillPoly
 
 import source.Mask as Mask
 from source import utils
+from source.LRUCache import LRUCache
 
 import time
+import itertools
 
 class Blob(object):
     """
     Blob data. A blob is a group of pixels.
     It can be tagged with the class and other information.
     It is stored as an outer contour (the border) plus a list of inner contours (holes).
+    The attributes are stored in slots (no per-instance __dict__) to keep large projects lean in memory.
     """
 
+    __slots__ = ('uid', 'version', 'id', 'area', 'perimeter', 'centroid', 'bbox', 'contour', 'inner_contours',
+                 'instance_name', 'blob_name', 'extreme_points', 'class_name', 'class_color', 'note', 'group',
+                 'qpath', 'qpath_gitem', 'id_item', 'qimg_mask', 'pxmap_mask', 'pxmap_mask_gitem')
+
+    QT_SLOTS = ('qpath', 'qpath_gitem', 'id_item', 'qimg_mask', 'pxmap_mask', 'pxmap_mask_gitem')
+
+    # if True the outer and the inner contours are extracted from the mask with a single pass
+    SINGLE_PASS_CONTOURS = False
+
+    # masks (bit-packed) of the most recently used blobs, shared by all the blobs (64 MB)
+    mask_cache = LRUCache(max_bytes=64 * 1024 * 1024)
+
+    # unique identifier of each Blob object (the id is not unique, e.g. copies share the same id)
+    uid_counter = itertools.count()
+
     def __init__(self, region, offset_x, offset_y, id):
 
+        self.uid = next(Blob.uid_counter)
         self.version = 0
         self.id = int(id)
 
+        # the Qt objects are created only when the blob is drawn (or edited at pixel-level)
+
+        # QPainterPath associated with the contours
+        self.qpath = None
+
+        # QGraphicsItem associated with the QPainterPath
+        self.qpath_gitem = None
+
+        # QGraphicsItem of the id of the blob
+        self.id_item = None
+
+        # QImage corresponding to the current mask
+        self.qimg_mask = None
+
+        # QPixmap associated with the mask (for pixel-level editing operations)
+        self.pxmap_mask = None
+
+        # QGraphicsItem associated with the pixmap mask
+        self.pxmap_mask_gitem = None
+
+        # deep extreme points (for fine-tuning), allocated only when they are set
+        self.extreme_points = None
+
         if region == None:     # AN EMPTY BLOB IS CREATED..
             self.area = 0.0
             self.perimeter = 0.0
@@ -59,8 +101,6 @@ class Blob(object):
             # placeholder; empty contour
             self.contour = np.zeros((2, 2))
             self.inner_contours = []
-            self.qpath = None
-            self.qpath_gitem = None
 
             self.instance_name = "noname"
             self.blob_name = "noname"
@@ -90,12 +130,6 @@ class Blob(object):
             self.bbox[2] = width
             self.bbox[3] = height
 
-            # QPainterPath associated with the contours
-            self.qpath = None
-
-            # QGraphicsItem associated with the QPainterPath
-            self.qpath_gitem = None
-
             # to extract the contour we use the mask cropped according to the bbox
             input_mask = region.image.astype(int)
             self.contour = np.zeros((2, 2))
@@ -110,9 +144,6 @@ class Blob(object):
             yc = self.centroid[1]
             self.blob_name = "c-{:d}-{:.1f}x-{:.1f}y".format(self.id, xc, yc)
 
-        # deep extreme points (for fine-tuning)
-        self.deep_extreme_points = np.zeros((4, 2))
-
         # name of the class
         self.class_name = "Empty"
 
@@ -122,18 +153,69 @@ class Blob(object):
         # note about the coral, i.e. damage type
         self.note = ""
 
-        # QImage corresponding to the current mask
-        self.qimg_mask = None
+        # membership group (if any)
+        self.group = None
 
-        # QPixmap associated with the mask (for pixel-level editing operations)
-        self.pxmap_mask = None
+    @property
+    def deep_extreme_points(self):
+        if self.extreme_points is None:
+            return np.zeros((4, 2))
+        return self.extreme_points
 
-        # QGraphicsItem associated with the pixmap mask
-        self.pxmap_mask_gitem = None
+    @deep_extreme_points.setter
+    def deep_extreme_points(self, points):
+        self.extreme_points = points
 
-        # membership group (if any)
-        self.group = None
+    @staticmethod
+    def compactContour(contour):
+        """
+        Store the contour points as int32 if they have integer values, as float32 otherwise.
+        """
+        contour = np.asarray(contour)
+        if contour.dtype.kind in "iu" or np.array_equal(contour, np.round(contour)):
+            return contour.astype(np.int32)
+        return contour.astype(np.float32)
+
+    @staticmethod
+    def contourToList(contour):
+        """
+        Convert a (compact) contour to a list. The float32 values are rounded to avoid the float32 -> float64
+        conversion noise in the saved files.
+        """
+        if contour.dtype.kind in "iu":
+            return contour.tolist()
+        return np.round(contour.astype(np.float64), 4).tolist()
+
+    @staticmethod
+    def compactRecord(dict):
+        """
+        Convert the contours and the points of a blob represented as a dictionary (see toDict) to compact arrays,
+        so the records of the blobs not created yet take about the memory of the blobs (see Image.hydrateAnnotations).
+        """
+        for key in ["bbox", "centroid", "deep_extreme_points"]:
+            if key in dict:
+                dict[key] = np.asarray(dict[key])
+        if "contour" in dict:
+            dict["contour"] = Blob.compactContour(dict["contour"])
+        if "inner contours" in dict:
+            dict["inner contours"] = [Blob.compactContour(c) for c in dict["inner contours"]]
+        return dict
 
+    @staticmethod
+    def recordToDict(record):
+        """
+        The dictionary of a compact record (see compactRecord), as saved in the JSON files.
+        """
+        dict = record.copy()
+        for key in ["bbox", "centroid", "deep_extreme_points"]:
+            if isinstance(dict.get(key), np.ndarray):
+                dict[key] = dict[key].tolist()
+        if isinstance(dict.get("contour"), np.ndarray):
+            dict["contour"] = Blob.contourToList(dict["contour"])
+        if "inner contours" in dict:
+            dict["inner contours"] = [Blob.contourToList(c) if isinstance(c, np.ndarray) else c
+                                      for c in dict["inner contours"]]
+        return dict
 
     def copy(self):
         blob = Blob(None, 0, 0, 0)
@@ -156,7 +238,7 @@ class Blob(object):
 
         blob.class_name = self.class_name
 
-        blob.deep_extreme_points = self.deep_extreme_points
+        blob.extreme_points = self.extreme_points
 
         self.note = ""
         self.qimg_mask = None
@@ -166,28 +248,16 @@ class Blob(object):
         return blob
 
     def __deepcopy__(self, memo):
-        #avoid recursion!
-        deepcopy_method = self.__deepcopy__
-        self.__deepcopy__ = None
-        #save and later restore qobjects
-        path = self.qpath
-        pathitem = self.qpath_gitem
-        #no deep copy for qobjects
-        self.qpath = None
-        self.qpath_gitem = None
-
-        blob = copy.deepcopy(self)
-        blob.contour = self.contour.copy()
-        blob.inner_contours.clear()
-        for inner in self.inner_contours:
-            blob.inner_contours.append(inner.copy())
-
-        blob.qpath = None
-        blob.qpath_gitem = None
-        self.qpath = path
-        self.qpath_gitem = pathitem
-        #restore deepcopy (also to the newly created Blob!
-        blob.__deepcopy__ = self.__deepcopy__ = deepcopy_method
+        blob = Blob.__new__(Blob)
+        memo[id(self)] = blob
+        for name in Blob.__slots__:
+            if name in Blob.QT_SLOTS:
+                #no deep copy for qobjects
+                setattr(blob, name, None)
+            else:
+                setattr(blob, name, copy.deepcopy(getattr(self, name), memo))
+
+        blob.uid = next(Blob.uid_counter)
         return blob
 
     def setId(self, id):
@@ -200,10 +270,19 @@ class Blob(object):
     def getMask(self):
         """
         It creates the mask from the contour and returns it.
+        The mask is cached (bit-packed) until the blob changes, the returned mask can be modified.
         """
 
         r = self.bbox[3]
         c = self.bbox[2]
+
+        key = (self.uid, self.version)
+        cached = Blob.mask_cache.get(key)
+        if cached is not None:
+            (contour, bbox, packed) = cached
+            if contour is self.contour and bbox == tuple(self.bbox):
+                return np.unpackbits(packed)[:r * c].reshape((r, c))
+
         origin = np.array([int(self.bbox[1]), int(self.bbox[0])])
 
         mask = np.zeros((r, c), np.uint8)
@@ -219,10 +298,19 @@ class Blob(object):
             points = inner_contour.round().astype(int)
             fillPoly(mask, pts=[points - origin], color=(0, 0, 0))
 
+        packed = np.packbits(mask)
+        Blob.mask_cache.put(key, (self.contour, tuple(self.bbox), packed), size=packed.nbytes)
+
         return mask
 
+    def invalidateMask(self):
+        """
+        Remove the cached mask. It must be called when the contours of the blob change.
+        """
+        Blob.mask_cache.remove((self.uid, self.version))
 
     def updateUsingMask(self, bbox, mask):
+        self.invalidateMask()
         self.createContourFromMask(mask, bbox)
         self.calculatePerimeter()
         self.calculateCentroid(mask, bbox)
@@ -265,74 +353,88 @@ class Blob(object):
         PADDED_SIZE = 4
         img_padded = pad(mask, (PADDED_SIZE, PADDED_SIZE), mode="constant", constant_values=(0, 0))
 
-        contours = measure.find_contours(img_padded, 0.6)
-        inner_contours = measure.find_contours(img_padded, 0.4)
-        number_of_contours = len(contours)
+        if Blob.SINGLE_PASS_CONTOURS:
+            # the borders of the holes are counted as in the two passes (they are also contours at level 0.6)
+            (contours, inner_contours) = self.extractContoursSinglePass(img_padded)
+            number_of_contours = len(contours) + len(inner_contours)
+        else:
+            contours = measure.find_contours(img_padded, 0.6)
+            inner_contours = measure.find_contours(img_padded, 0.4)
+            number_of_contours = len(contours)
 
         threshold = 20 #min number of points in a small hole
 
+        # (row, col) of the padded mask -> (x, y) in the global map coordinates system
+        # (NOTE THAT THE COORDINATES OF THE BBOX ARE IN THE GLOBAL MAP COORDINATES SYSTEM)
+        offset = np.array([bbox[1] - PADDED_SIZE, bbox[0] - PADDED_SIZE], dtype=np.float64)
+
         if number_of_contours > 1:
 
-            # search the longest contour
-            npoints_max = 0
-            longest = 0
-            for i, contour in enumerate(contours):
-                npoints = contour.shape[0]
-                if npoints > npoints_max:
-                    npoints_max = npoints
-                    longest = i
-
-            npoints_max = 0
-            inner_longest = 0
-            for i, contour in enumerate(inner_contours):
-                npoints = contour.shape[0]
-                if npoints > npoints_max:
-                    npoints_max = npoints
-                    inner_longest = i
-
-            # divide the contours in OUTER contour and INNER contours
-            for i, contour in enumerate(contours):
-                if i == longest:
-                    self.contour = np.array(contour)
-
-            for i, contour in enumerate(inner_contours):
-                if i != inner_longest:
-                    if contour.shape[0] > threshold:
-                        coordinates = np.array(contour)
-                        self.inner_contours.append(coordinates)
-
-            # adjust the coordinates of the outer contour
-            # (NOTE THAT THE COORDINATES OF THE BBOX ARE IN THE GLOBAL MAP COORDINATES SYSTEM)
-            for i in range(self.contour.shape[0]):
-                ycoor = self.contour[i, 0]
-                xcoor = self.contour[i, 1]
-                self.contour[i, 0] = xcoor - PADDED_SIZE + bbox[1]
-                self.contour[i, 1] = ycoor - PADDED_SIZE + bbox[0]
-
-            # adjust coordinates of the INNER contours
-            for j, contour in enumerate(self.inner_contours):
-                for i in range(contour.shape[0]):
-                    ycoor = contour[i, 0]
-                    xcoor = contour[i, 1]
-                    self.inner_contours[j][i, 0] = xcoor - PADDED_SIZE + bbox[1]
-                    self.inner_contours[j][i, 1] = ycoor - PADDED_SIZE + bbox[0]
+            # the longest contour is the outer one
+            longest = max(range(len(contours)), key=lambda i: contours[i].shape[0])
+            self.contour = contours[longest][:, ::-1] + offset
+
+            if Blob.SINGLE_PASS_CONTOURS:
+                holes = inner_contours
+            else:
+                inner_longest = max(range(len(inner_contours)), key=lambda i: inner_contours[i].shape[0])
+                holes = [contour for i, contour in enumerate(inner_contours) if i != inner_longest]
+
+            for contour in holes:
+                if contour.shape[0] > threshold:
+                    self.inner_contours.append(contour[:, ::-1] + offset)
+
         elif number_of_contours == 1:
 
             coords = measure.approximate_polygon(contours[0], tolerance=0.2)
-            self.contour = np.array(coords)
-
-            # adjust the coordinates of the outer contour
-            # (NOTE THAT THE COORDINATES OF THE BBOX ARE IN THE GLOBAL MAP COORDINATES SYSTEM)
-            for i in range(self.contour.shape[0]):
-                ycoor = self.contour[i, 0]
-                xcoor = self.contour[i, 1]
-                self.contour[i, 0] = xcoor - PADDED_SIZE + bbox[1]
-                self.contour[i, 1] = ycoor - PADDED_SIZE + bbox[0]
+            self.contour = coords[:, ::-1] + offset
         else:
             raise Exception("Empty contour")
+
+        self.contour = Blob.compactContour(self.contour)
+        self.inner_contours = [Blob.compactContour(contour) for contour in self.inner_contours]
+
         #TODO optimize the bbox
         self.bbox = bbox
 
+    def extractContoursSinglePass(self, img_padded):
+        """
+        It extracts the outer and the inner contours with a single iso-contour pass at level 0.5.
+        The contours are oriented, so the borders of the regions and the borders of the holes
+        are separated by the sign of their (signed) area. The contours are then moved as they were
+        extracted at level 0.6 (outer) and 0.4 (inner), so they round to the pixels of the mask (see getMask).
+        """
+
+        contours = measure.find_contours(img_padded, 0.5, positive_orientation='high')
+
+        outer_contours = []
+        inner_contours = []
+        for contour in contours:
+            r = contour[:, 0]
+            c = contour[:, 1]
+            signed_area = np.dot(c, np.roll(r, -1)) - np.dot(np.roll(c, -1), r)
+            if signed_area < 0.0:
+                outer_contours.append(self.shiftContour(contour, img_padded, 0.1))
+            else:
+                inner_contours.append(self.shiftContour(contour, img_padded, -0.1))
+
+        return (outer_contours, inner_contours)
+
+    @staticmethod
+    def shiftContour(contour, mask, shift):
+        """
+        Move the points of an iso-contour at level 0.5 of a binary mask along their edges, by shift towards the
+        pixel of the mask (a point at level 0.5 is in the middle of an edge between a pixel in and one out).
+        """
+
+        lo = np.floor(contour).astype(int)
+        hi = np.ceil(contour).astype(int)
+
+        # the point moves towards the end of the edge that is in the mask
+        towards_hi = mask[hi[:, 0], hi[:, 1]] > mask[lo[:, 0], lo[:, 1]]
+        direction = np.where(towards_hi, shift, -shift)[:, np.newaxis]
+
+        return contour + (hi - lo) * direction
     def lineToPoints(self, lines, snap = False):
         points = np.empty(shape=(0, 2), dtype=int)
 
@@ -399,40 +501,36 @@ class Blob(object):
         # QPolygon to draw the blob
         #working with mask the center of the pixels is in 0, 0
         #if drawing the center of the pixel is 0.5, 0.5
-        qpolygon = QPolygonF()
-        for i in range(self.contour.shape[0]):
-            qpolygon << QPointF(self.contour[i, 0] + 0.5, self.contour[i, 1] + 0.5)
+        qpolygon = utils.pointsToQPolygonF(self.contour, 0.5)
 
         self.qpath = QPainterPath()
         self.qpath.addPolygon(qpolygon)
 
+        # the holes are obtained with the odd-even fill rule instead of subtracting each inner path
+        # (the boolean operations on QPainterPath are very expensive)
+        self.qpath.setFillRule(Qt.OddEvenFill)
         for inner_contour in self.inner_contours:
-            qpoly_inner = QPolygonF()
-            for i in range(inner_contour.shape[0]):
-                qpoly_inner << QPointF(inner_contour[i, 0], inner_contour[i, 1])
-
-            path_inner = QPainterPath()
-            path_inner.addPolygon(qpoly_inner)
-            self.qpath = self.qpath.subtracted(path_inner)
+            self.qpath.addPolygon(utils.pointsToQPolygonF(inner_contour))
 
     def createQPixmapFromMask(self):
+        """
+        Create the QImage and the QPixmap of the mask (used for pixel-level editing operations).
+        """
 
-        w = self.bbox[2]
-        h = self.bbox[3]
-        self.qimg_mask = QImage(w, h, QImage.Format_ARGB32)
-        self.qimg_mask.fill(qRgba(0, 0, 0, 0))
+        w = int(self.bbox[2])
+        h = int(self.bbox[3])
 
         if self.class_name == "Empty":
             rgba = qRgba(255, 255, 255, 255)
         else:
             rgba = qRgba(self.class_color[0], self.class_color[1], self.class_color[2], 100)
 
+        # ARGB32 pixels are stored as 32-bit integers 0xAARRGGBB
         blob_mask = self.getMask()
-        for x in range(w):
-            for y in range(h):
-                if blob_mask[y, x] == 1:
-                    self.qimg_mask.setPixel(x, y, rgba)
+        argb = np.zeros((h, w), dtype=np.uint32)
+        argb[blob_mask == 1] = rgba
 
+        self.qimg_mask = QImage(argb.data, w, h, 4 * w, QImage.Format_ARGB32).copy()
         self.pxmap_mask = QPixmap.fromImage(self.qimg_mask)
 
     #bbox is used to place the mask!
@@ -448,25 +546,10 @@ class Blob(object):
 
         #self.perimeter = measure.perimeter(mask) instead?
 
-
-        # perimeter of the outer contour
-        px1 = contour[0, 0]
-        py1 = contour[0, 1]
-        N = contour.shape[0]
-        pxlast = contour[N-1, 0]
-        pylast = contour[N-1, 1]
-        perim = math.sqrt((px1-pxlast)*(px1-pxlast) + (py1-pylast)*(py1-pylast))
-        for i in range(1, contour.shape[0]):
-            px2 = contour[i, 0]
-            py2 = contour[i, 1]
-
-            d = math.sqrt((px1 - px2)*(px1-px2) + (py1-py2)*(py1-py2))
-            perim += d
-
-            px1 = px2
-            py1 = py2
-
-        return perim
+        # length of the closed polyline (the last point is connected to the first one)
+        contour = contour.astype(np.float64)
+        segments = np.diff(contour, axis=0, append=contour[:1])
+        return float(np.sqrt((segments * segments).sum(axis=1)).sum())
 
     def calculatePerimeter(self):
         #tole = 2
@@ -487,19 +570,22 @@ class Blob(object):
         Set the blob information given it represented as a dictionary.
         """
 
+        self.invalidateMask()
+
         self.bbox = np.asarray(dict["bbox"])
 
         self.centroid = np.asarray(dict["centroid"])
         self.area = dict["area"]
         self.perimeter = dict["perimeter"]
 
-        self.contour = np.asarray(dict["contour"])
+        self.contour = Blob.compactContour(dict["contour"])
         inner_contours = dict["inner contours"]
         self.inner_contours = []
         for c in inner_contours:
-            self.inner_contours.append(np.asarray(c))
+            self.inner_contours.append(Blob.compactContour(c))
 
-        self.deep_extreme_points = np.asarray(dict["deep_extreme_points"])
+        extreme_points = np.asarray(dict["deep_extreme_points"])
+        self.extreme_points = extreme_points if extreme_points.any() else None
         self.class_name = dict["class name"]
         self.class_color = dict["class color"]
         self.instance_name = dict["instance name"]
@@ -523,11 +609,11 @@ class Blob(object):
         dict["area"] = self.area
         dict["perimeter"] = self.perimeter
 
-        dict["contour"] = self.contour.tolist()
+        dict["contour"] = Blob.contourToList(self.contour)
 
         dict["inner contours"] = []
         for c in self.inner_contours:
-            dict["inner contours"].append(c.tolist())
+            dict["inner contours"].append(Blob.contourToList(c))
 
         dict["deep_extreme_points"] = self.deep_extreme_points.tolist()
 
@@ -17,19 +17,22 @@
 #GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
 # for more details.
 
-from PyQt5.QtGui import QImage
+from PyQt5.QtGui import QImage, QImageReader
 import rasterio as rio
-from source import utils
-import numpy as np
+from source.ImagePyramid import ImagePyramid, DEMPyramid, TiledImage
 
 class Channel(object):
+
+    # RGB maps larger than this (in pixels) are visualized through a tiled pyramid instead of a single QImage
+    PYRAMID_MIN_SIZE = 16384
+
     def __init__(self, filename = None, type = None):
 
         self.filename = filename      # path relative to the TagLab directory
         self.type = type              # RGB | DEM
         self.qimage = None            # cached QImage (to speed up visualization)
-        self.float_map = None         # map of 32-bit floating point (e.g. to store high precision depth values)
         self.nodata = None            # invalid value
+        self.pyramid = None           # tiled multi-resolution pyramid (large RGB maps and DEMs)
 
     def loadData(self):
         """
@@ -37,16 +40,52 @@ class Channel(object):
         """
 
         if self.type == "RGB":
-            self.qimage = QImage(self.filename)
+            if self.usePyramid():
+                # the map is never loaded as a whole, the QImage-like TiledImage reads it from the pyramid
+                self.pyramid = ImagePyramid(self.filename)
+                self.pyramid.open()
+                self.qimage = TiledImage(self.pyramid)
+            else:
+                self.qimage = QImage(self.filename)
 
-        # typically the depth map is stored in a 32-bit Tiff
+        # typically the depth map is stored in a 32-bit Tiff, it is visualized as a gray image normalized
+        # between its min and max heights; the heights are read by windows when needed (see readHeights)
         if self.type == "DEM":
-            dem = rio.open(self.filename)
-            self.float_map = dem.read(1).astype(np.float32)
-            self.nodata = dem.nodata
-            self.qimage = utils.floatmapToQImage(self.float_map, self.nodata)
+            self.pyramid = DEMPyramid(self.filename)
+            self.pyramid.open()
+            self.nodata = self.pyramid.nodata
+            self.qimage = TiledImage(self.pyramid)
 
         return self.qimage
 
+    def readHeights(self, top, left, width, height):
+        """
+        It returns the heights (32-bit floating point) of a region of the DEM.
+        """
+        if self.pyramid is None:
+            self.loadData()
+        return self.pyramid.readWindow(top, left, width, height)
+
+    def readSize(self):
+        """
+        It returns the size (width, height) of the map reading only the header of the file.
+        """
+        try:
+            with rio.open(self.filename) as img:
+                return (img.width, img.height)
+        except rio.errors.RasterioIOError:
+            size = QImageReader(self.filename).size()
+            if not size.isValid():
+                raise Exception("The map " + str(self.filename) + " cannot be read.")
+            return (size.width(), size.height())
+
+    def usePyramid(self):
+
+        try:
+            with rio.open(self.filename) as img:
+                return max(img.width, img.height) > Channel.PYRAMID_MIN_SIZE
+        except rio.errors.RasterioIOError:
+            return False
+
     def save(self):
         return { "filename": self.filename, "type": self.type }
@@ -16,52 +16,137 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             
 #GNU General Public License (http://www.gnu.org/licenses/gpl.txt)          
 # for more details.                                               
+# CONVERSIONS BETWEEN QIMAGE AND NUMPY ARRAYS.
+# The 32-bit QImage formats (RGB32/ARGB32) store each pixel as 0xAARRGGBB, that is B, G, R, A bytes in memory
+# (little-endian), so the bits of the image can be seen as a (h, w, 4) array without copying and the RGB
+# channels as the strided view [:, :, 2::-1] of it. The copies are done by OpenCV (a single pass over the pixels).
+
 import numpy as np
+import cv2
 
 from PyQt5.QtGui import QImage
 
+FORMATS_32BIT = (QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied)
+
+
+def qimageBits(image):
+    """
+    It returns a (h, w, 4) view (BGRA, read-only) of the memory of the image, without copying it.
+    NOTE: the view is valid only as long as the image exists and is not modified.
+    """
+    if image.format() not in FORMATS_32BIT:
+        raise ValueError("The image must be in a 32-bit format (RGB32 or ARGB32).")
 
-def qimage2ndarray(image):
     w = image.width()
     h = image.height()
-    fmt = image.format()
+    if w == 0 or h == 0:
+        return np.zeros((h, w, 4), dtype=np.uint8)
+    stride = image.bytesPerLine()
+
+    ptr = image.constBits()
+    ptr.setsize(h * stride)
+    buffer = np.frombuffer(ptr, dtype=np.uint8).reshape(h, stride)
+    return buffer[:, :4 * w].reshape(h, w, 4)
 
-    arr = np.zeros((h, w, 3), dtype=np.uint8)
 
-    if fmt == QImage.Format_RGB32:
-        bits = image.bits()
-        bits.setsize(h*w*4)
-        arrtemp = np.frombuffer(bits, np.uint8).copy()
-        arrtemp = np.reshape(arrtemp, [h, w, 4])
-        arr[:, :, 0] = arrtemp[:, :, 2]
-        arr[:, :, 1] = arrtemp[:, :, 1]
-        arr[:, :, 2] = arrtemp[:, :, 0]
+def to32bit(image):
 
-    elif fmt == QImage.Format_ARGB32:
-        pass
+    if image.format() in FORMATS_32BIT:
+        return image
+    return image.convertToFormat(QImage.Format_RGB32)
 
-    return arr
+
+def qimage2ndarray(image, copy=True):
+    """
+    Convert a QImage to an RGB (uint8) array. With copy=False a strided view of the image memory is
+    returned (valid as long as the image exists), otherwise a contiguous copy.
+    """
+    image = to32bit(image)
+    bgra = qimageBits(image)
+    if not copy:
+        return bgra[:, :, 2::-1]
+    if bgra.size == 0:
+        return np.zeros(bgra.shape[:2] + (3,), dtype=np.uint8)
+    return cv2.cvtColor(bgra, cv2.COLOR_BGRA2RGB)
 
 
 def ndarray2qimage(image):
+    """
+    Convert an RGB (or RGBA, or gray) uint8 array to a QImage (RGB32, or ARGB32 if there is the alpha channel).
+    """
     h = image.shape[0]
     w = image.shape[1]
-    ch = image.shape[2]
+    if image.dtype != np.uint8:
+        image = image.astype(np.uint8)
+    if image.ndim == 3 and image.shape[2] == 1:
+        image = image[:, :, 0]
+    if h == 0 or w == 0:
+        return QImage(w, h, QImage.Format_RGB32)
+
+    if image.ndim == 2:
+        (code, fmt) = (cv2.COLOR_GRAY2BGRA, QImage.Format_RGB32)
+    elif image.shape[2] == 4:
+        (code, fmt) = (cv2.COLOR_RGBA2BGRA, QImage.Format_ARGB32)
+    else:
+        (code, fmt) = (cv2.COLOR_RGB2BGRA, QImage.Format_RGB32)
+
+    # the pixels are converted directly into the memory of the image
+    qimg = QImage(w, h, fmt)
+    ptr = qimg.bits()
+    ptr.setsize(h * qimg.bytesPerLine())
+    bgra = np.frombuffer(ptr, dtype=np.uint8).reshape(h, qimg.bytesPerLine())[:, :4 * w].reshape(h, w, 4)
+    cv2.cvtColor(image, code, dst=bgra)
+
+    return qimg
+
+
+def qimage2mask(image):
+    """
+    It returns a boolean mask of the pixels that are not black (the alpha channel is ignored).
+    """
+    image = to32bit(image)
+    bgra = qimageBits(image)
+    return (bgra[:, :, 0] != 0) | (bgra[:, :, 1] != 0) | (bgra[:, :, 2] != 0)
+
+
+def mask2qimage(mask):
+    """
+    Convert a binary mask to a QImage (white where the mask is 1, black elsewhere).
+    """
+    gray = np.where(mask == 1, np.uint8(255), np.uint8(0))
+    return ndarray2qimage(gray)
+
+
+def labels2qimage(labels):
+    """
+    Convert a map of (small integer) labels to a QImage, each label has a different color.
+    """
+    labels = labels.astype(np.uint32)
+    rgb = np.empty(labels.shape + (3,), dtype=np.uint8)
+    rgb[:, :, 0] = (labels * 17) & 0xFF
+    rgb[:, :, 1] = (labels * 163) & 0xFF
+    rgb[:, :, 2] = (labels * 211) & 0xFF
+    return ndarray2qimage(rgb)
+
 
-    imgdata = np.zeros([h, w, 4], dtype=np.uint8)
+def floatmap2qimage(floatmap, nodata=float('NaN')):
+    """
+    Convert a map of floating point values to a gray QImage normalized between its min and max values
+    (the nodata values are shown as the max value).
+    """
+    valid = np.isfinite(floatmap)
+    if nodata is not None:
+        valid &= floatmap != nodata
 
-    if ch == 3:
-        imgdata[:, :, 2] = image[:, :, 0]
-        imgdata[:, :, 1] = image[:, :, 1]
-        imgdata[:, :, 0] = image[:, :, 2]
-        imgdata[:, :, 3] = 255
-        qimg = QImage(imgdata.data, w, h, QImage.Format_RGB32)
+    if valid.any():
+        max_value = floatmap[valid].max()
+        min_value = floatmap[valid].min()
+    else:
+        max_value = min_value = 0.0
 
-    elif ch == 4:
-        imgdata[:, :, 3] = image[:, :, 0]
-        imgdata[:, :, 2] = image[:, :, 1]
-        imgdata[:, :, 1] = image[:, :, 2]
-        imgdata[:, :, 0] = image[:, :, 3]
-        qimg = QImage(imgdata.data, w, h, QImage.Format_ARGB32)
+    fmap = np.where(valid, floatmap, max_value).astype(np.float32)
+    fmap -= min_value
+    if max_value > min_value:
+        fmap *= 255.0 / (max_value - min_value)
 
-    return qimg.copy()
\ No newline at end of file
+    return ndarray2qimage(fmap.astype(np.uint8))
@@ -1,6 +1,9 @@
+import numpy as np
+
 from source.Channel import Channel
 from source.Blob import Blob
 from source.Annotation import Annotation
+from source.ProjectArchive import blobsFromColumns
 import rasterio as rio
 
 class Image(object):
@@ -19,11 +22,10 @@ class Image(object):
         self.width = width
         self.height = height                        #in pixels!
 
-        self.annotations = Annotation()
-        for data in annotations:
-            blob = Blob(None, 0, 0, 0)
-            blob.fromDict(data)
-            self.annotations.addBlob(blob)
+        # the blobs are created only when the annotations are used for the first time (see the annotations property),
+        # until then the raw records are kept: a list of dictionaries (JSON) or a dictionary of columns (binary format)
+        self.annotation_records = annotations
+        self.annotations_data = None
 
         self.channels = list(map(lambda c: Channel(**c), channels))
 
@@ -35,6 +37,36 @@ class Image(object):
         self.metadata = metadata                # this follows image_metadata_template, do we want to allow freedom to add custome values?
 
 
+    @property
+    def annotations(self):
+        if self.annotations_data is None:
+            self.hydrateAnnotations()
+        return self.annotations_data
+
+    def isHydrated(self):
+        return self.annotations_data is not None
+
+    def hydrateAnnotations(self):
+        """
+        Create the blobs from the raw annotation records and release the records.
+        """
+
+        self.annotations_data = Annotation()
+
+        if isinstance(self.annotation_records, dict):
+            blobs = blobsFromColumns(self.annotation_records) if len(self.annotation_records) > 0 else []
+        else:
+            blobs = []
+            for data in self.annotation_records:
+                blob = Blob(None, 0, 0, 0)
+                blob.fromDict(data)
+                blobs.append(blob)
+
+        for blob in blobs:
+            self.annotations_data.addBlob(blob)
+
+        self.annotation_records = None
+
     def loadGeoInfo(self, filename):
         """
         Update the georeferencing information.
@@ -63,17 +95,23 @@ class Image(object):
                 raise Exception(
                     "Size of the images is not consistent! It is " + str(img.width) + "x" + str(img.height) + ", should have been: " + str(self.width) + "x" + str(self.height))
 
-        # check image size limits
-        if img.width > 32767 or img.height > 32767:
-            raise Exception(
-                "This map exceeds the image dimension handled by TagLab (the maximum size is 32767 x 32767).")
-
         self.width = img.width
         self.height = img.height
 
         self.channels.append(Channel(filename, type))
 
 
-    def save(self):
+    def save(self, include_annotations=True):
         data = self.__dict__.copy()
+
+        # not hydrated annotations are saved as they have been loaded
+        del data["annotation_records"]
+        del data["annotations_data"]
+        if not include_annotations:
+            data["annotations"] = []
+        elif self.annotations_data is None and not isinstance(self.annotation_records, dict):
+            data["annotations"] = [Blob.recordToDict(record) for record in self.annotation_records]
+        else:
+            data["annotations"] = self.annotations
+
         return data
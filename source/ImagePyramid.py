@@ -0,0 +1,495 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+# MULTI-RESOLUTION PYRAMID OF A MAP.
+# The pyramid is built once and cached on disk next to the map (<map>.pyramid/), or in the cache folder of
+# the user if the folder of the map is not writable (e.g. read-only or network folders). Each level is an RGB
+# (uint8) NumPy array saved as .npy and memory-mapped when used, so only the parts of the map
+# actually accessed (e.g. the visible tiles) are read from the disk.
+# Level 0 is the map at full resolution, each level halves the resolution of the previous one,
+# the last level fits in a single tile.
+
+import os
+import json
+import math
+import hashlib
+import numpy as np
+import cv2
+import rasterio as rio
+from rasterio.windows import Window
+
+from PyQt5.QtCore import Qt, QSize, QStandardPaths
+from PyQt5.QtGui import QImage
+
+from source.ConversionUtils import ndarray2qimage
+
+PYRAMID_VERSION = 1
+
+# rows processed at once while building the pyramid (it bounds the memory used)
+STRIP_HEIGHT = 1024
+
+
+def isWritableDir(path):
+    """
+    Check if a folder can be written (or created, if it does not exist yet).
+    """
+    if not os.path.isdir(path):
+        path = os.path.dirname(os.path.abspath(path))
+    return os.access(path, os.W_OK | os.X_OK)
+
+
+def userCacheDir(filename):
+    """
+    Folder of the pyramid of a map in the cache folder of the user, keyed by the path and the modification time of the map.
+    """
+    path = os.path.abspath(filename)
+    key = path + "|" + str(os.stat(filename).st_mtime)
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+    folder = QStandardPaths.writableLocation(QStandardPaths.CacheLocation)
+    if folder == "":
+        folder = os.path.join(os.path.expanduser("~"), ".cache", "TagLab")
+
+    return os.path.join(folder, "pyramids", os.path.basename(filename) + "_" + digest + ".pyramid")
+
+
+def downsample(rgb):
+    """
+    Halve the resolution of an RGB array (2x2 box filter, the last odd row/column is replicated).
+    """
+    h = rgb.shape[0]
+    w = rgb.shape[1]
+    if h % 2 == 1 or w % 2 == 1:
+        rgb = np.pad(rgb, ((0, h % 2), (0, w % 2), (0, 0)), mode="edge")
+
+    acc = rgb[0::2, 0::2].astype(np.uint16)
+    acc += rgb[1::2, 0::2]
+    acc += rgb[0::2, 1::2]
+    acc += rgb[1::2, 1::2]
+    acc += 2
+    acc >>= 2
+    return acc.astype(np.uint8)
+
+
+def readRGBWindow(src, top, height):
+    """
+    Read a strip of rows of the map as an RGB (uint8) array using a windowed read.
+    """
+    window = Window(0, top, src.width, height)
+    if src.count >= 3:
+        data = src.read([1, 2, 3], window=window)
+    else:
+        data = src.read([1, 1, 1], window=window)
+
+    if data.dtype != np.uint8:
+        if data.dtype == np.uint16:
+            data = (data >> 8).astype(np.uint8)
+        else:
+            data = np.clip(data, 0, 255).astype(np.uint8)
+
+    return np.ascontiguousarray(np.moveaxis(data, 0, -1))
+
+
+# cv2.remap interpolates at 1/32 of pixel
+REMAP_PRECISION = 32.0
+
+
+def interpolationCoordinates(start, stop, k, size):
+    """
+    Coordinates in a level of the pixels [start, stop) of the rescaled map, k is the number of pixels of the level
+    per pixel of the result (the centers of the pixels are aligned as done by cv2.resize). The coordinates are
+    rounded to the precision of cv2.remap, so the regions read separately match exactly.
+    """
+    x = np.clip((np.arange(start, stop) + 0.5) * k - 0.5, 0.0, size - 1)
+    return np.floor(x * REMAP_PRECISION + 0.5) / REMAP_PRECISION
+
+
+class ImagePyramid(object):
+    """
+    Tiled multi-resolution pyramid of an RGB map.
+    The subclasses can store other kinds of data by redefining the channels and readStrip().
+    """
+
+    CHANNELS = 3
+
+    def __init__(self, filename, tile_size=512):
+
+        self.filename = filename
+        self.tile_size = tile_size
+        self.cache_dir = filename + ".pyramid"
+
+        self.width = 0
+        self.height = 0
+        self.levels = []    # memory-mapped arrays, level 0 is the full resolution
+
+    def levelFilename(self, level):
+        return os.path.join(self.cache_dir, "level_" + str(level) + ".npy")
+
+    def infoFilename(self):
+        return os.path.join(self.cache_dir, "pyramid.json")
+
+    def sourceInfo(self):
+
+        stat = os.stat(self.filename)
+        return { "version": PYRAMID_VERSION, "source size": stat.st_size, "source mtime": stat.st_mtime,
+                 "tile size": self.tile_size }
+
+    def isCached(self):
+        """
+        Check if the pyramid on disk exists and it has been built from the current version of the map.
+        """
+        try:
+            with open(self.infoFilename(), "r") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        source = self.sourceInfo()
+        for key in source.keys():
+            if info.get(key) != source[key]:
+                return False
+
+        for level in range(info["levels"]):
+            if not os.path.exists(self.levelFilename(level)):
+                return False
+
+        return True
+
+    def open(self, progress=None):
+        """
+        Open the pyramid, building it if it is not cached yet. progress (optional) is called with the percentage.
+        """
+        if not self.isCached() and not isWritableDir(self.cache_dir):
+            self.cache_dir = userCacheDir(self.filename)
+
+        if not self.isCached():
+            self.build(progress)
+
+        with open(self.infoFilename(), "r") as f:
+            info = json.load(f)
+
+        self.loadInfo(info)
+        self.levels = [np.load(self.levelFilename(level), mmap_mode="r") for level in range(info["levels"])]
+
+    def loadInfo(self, info):
+
+        self.width = info["width"]
+        self.height = info["height"]
+
+    def prepare(self, src):
+        """
+        Called before the strips of the map are read (e.g. to compute statistics), it returns the info to store.
+        """
+        return {}
+
+    def readStrip(self, src, top, height):
+        return readRGBWindow(src, top, height)
+
+    def build(self, progress=None):
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        with rio.open(self.filename) as src:
+
+            self.width = src.width
+            self.height = src.height
+
+            sizes = [(self.width, self.height)]
+            while max(sizes[-1]) > self.tile_size:
+                (w, h) = sizes[-1]
+                sizes.append(((w + 1) // 2, (h + 1) // 2))
+
+            total_rows = sum(h for (w, h) in sizes)
+            done_rows = 0
+
+            extra_info = self.prepare(src)
+
+            # level 0, copied from the map by strips
+            level = np.lib.format.open_memmap(self.levelFilename(0), mode="w+", dtype=np.uint8,
+                                              shape=(self.height, self.width, self.CHANNELS))
+            for top in range(0, self.height, STRIP_HEIGHT):
+                height = min(STRIP_HEIGHT, self.height - top)
+                level[top:top + height] = self.readStrip(src, top, height)
+                done_rows += height
+                if progress is not None:
+                    progress(100.0 * done_rows / total_rows)
+
+        level.flush()
+
+        # the other levels are obtained by downsampling the previous one (strips with an even number of rows)
+        for i in range(1, len(sizes)):
+            (w, h) = sizes[i]
+            previous = level
+            level = np.lib.format.open_memmap(self.levelFilename(i), mode="w+", dtype=np.uint8,
+                                              shape=(h, w, self.CHANNELS))
+            for top in range(0, previous.shape[0], STRIP_HEIGHT):
+                strip = downsample(previous[top:top + STRIP_HEIGHT])
+                level[top // 2:top // 2 + strip.shape[0]] = strip
+                done_rows += strip.shape[0]
+                if progress is not None:
+                    progress(100.0 * done_rows / total_rows)
+            level.flush()
+
+        # the info file is written last, a pyramid partially built is never used
+        info = self.sourceInfo()
+        info.update(extra_info)
+        info["width"] = self.width
+        info["height"] = self.height
+        info["levels"] = len(sizes)
+        with open(self.infoFilename(), "w") as f:
+            json.dump(info, f)
+
+    def levelCount(self):
+        return len(self.levels)
+
+    def levelSize(self, level):
+        array = self.levels[level]
+        return (array.shape[1], array.shape[0])
+
+    def levelForZoom(self, zoom_factor):
+        """
+        It returns the coarsest level with (at least) one pixel per screen pixel at the given zoom.
+        """
+        if zoom_factor >= 1.0:
+            return 0
+        level = int(math.floor(math.log2(1.0 / zoom_factor)))
+        return min(level, len(self.levels) - 1)
+
+    def tileCount(self, level):
+        (w, h) = self.levelSize(level)
+        return ((w + self.tile_size - 1) // self.tile_size, (h + self.tile_size - 1) // self.tile_size)
+
+    def readRegion(self, level, top, left, width, height):
+        """
+        Read a region of a level as an array (height x width x channels). The parts outside the map are black.
+        """
+        array = self.levels[level]
+        (h, w) = array.shape[:2]
+
+        region = np.zeros((height, width, array.shape[2]), dtype=np.uint8)
+
+        y1 = max(top, 0)
+        x1 = max(left, 0)
+        y2 = min(top + height, h)
+        x2 = min(left + width, w)
+        if y2 > y1 and x2 > x1:
+            region[y1 - top:y2 - top, x1 - left:x2 - left] = array[y1:y2, x1:x2]
+
+        return region
+
+    def readScaledRegion(self, map_width, map_height, top, left, width, height, smooth=True):
+        """
+        Read a region of the map rescaled to map_width x map_height (the coordinates of the region are the ones of
+        the rescaled map). The region is interpolated (bilinear, or nearest if smooth is False) from the coarsest
+        level with at least one pixel per pixel of the result, so the rescaled map is never stored as a whole.
+        The parts outside the map are black.
+        """
+        level = self.levelForZoom(max(float(map_width) / self.width, float(map_height) / self.height))
+        (w, h) = self.levelSize(level)
+
+        region = np.zeros((height, width, self.CHANNELS), dtype=np.uint8)
+
+        # part of the region inside the rescaled map
+        x1 = max(left, 0)
+        y1 = max(top, 0)
+        x2 = min(left + width, map_width)
+        y2 = min(top + height, map_height)
+        if x2 <= x1 or y2 <= y1:
+            return region
+
+        x = interpolationCoordinates(x1, x2, float(w) / map_width, w)
+        y = interpolationCoordinates(y1, y2, float(h) / map_height, h)
+
+        # only the part of the level needed is read
+        sx = int(x[0])
+        sy = int(y[0])
+        source = self.readRegion(level, sy, sx, min(int(x[-1]) + 2, w) - sx, min(int(y[-1]) + 2, h) - sy)
+
+        map_x = np.broadcast_to((x - sx).astype(np.float32), (y2 - y1, x2 - x1))
+        map_y = np.broadcast_to((y - sy).astype(np.float32)[:, np.newaxis], (y2 - y1, x2 - x1))
+        interpolation = cv2.INTER_LINEAR if smooth else cv2.INTER_NEAREST
+        scaled = cv2.remap(source, np.ascontiguousarray(map_x), np.ascontiguousarray(map_y), interpolation,
+                           borderMode=cv2.BORDER_REPLICATE)
+
+        region[y1 - top:y2 - top, x1 - left:x2 - left] = scaled.reshape(y2 - y1, x2 - x1, self.CHANNELS)
+        return region
+
+    def tileImage(self, level, tx, ty):
+        """
+        It returns the tile (tx, ty) of the given level as a QImage (the tiles on the border can be smaller).
+        """
+        (w, h) = self.levelSize(level)
+        left = tx * self.tile_size
+        top = ty * self.tile_size
+        width = min(self.tile_size, w - left)
+        height = min(self.tile_size, h - top)
+        return ndarray2qimage(self.readRegion(level, top, left, width, height))
+
+
+class TiledImage(object):
+    """
+    QImage-like access to the full resolution of a pyramid. It supports the part of the QImage interface
+    used on the maps (size, crop and scale), so the tools work on maps that cannot be loaded as a single QImage.
+    """
+
+    def __init__(self, pyramid):
+        self.pyramid = pyramid
+
+    def width(self):
+        return self.pyramid.width
+
+    def height(self):
+        return self.pyramid.height
+
+    def isNull(self):
+        return self.pyramid.width == 0 or self.pyramid.height == 0
+
+    def format(self):
+        return QImage.Format_RGB32
+
+    def copy(self, left, top, width, height):
+        return ndarray2qimage(self.pyramid.readRegion(0, int(top), int(left), int(width), int(height)))
+
+    def scaled(self, width, height, aspect_ratio_mode=Qt.IgnoreAspectRatio, transform_mode=Qt.FastTransformation):
+        """
+        It returns the map rescaled as a QImage-like ScaledTiledImage, the rescaled map is read by regions
+        (e.g. the tiles classified by the MapClassifier) so it has no size limit.
+        """
+        size = QSize(self.width(), self.height()).scaled(int(width), int(height), aspect_ratio_mode)
+        return ScaledTiledImage(self.pyramid, size.width(), size.height(), transform_mode)
+
+
+class ScaledTiledImage(object):
+    """
+    QImage-like access to a map of a pyramid rescaled to a given size (see TiledImage.scaled). The regions are
+    interpolated from the pyramid when they are requested.
+    """
+
+    def __init__(self, pyramid, width, height, transform_mode=Qt.SmoothTransformation):
+
+        self.pyramid = pyramid
+        self.map_width = width
+        self.map_height = height
+        self.smooth = transform_mode == Qt.SmoothTransformation
+
+    def width(self):
+        return self.map_width
+
+    def height(self):
+        return self.map_height
+
+    def isNull(self):
+        return self.map_width == 0 or self.map_height == 0
+
+    def format(self):
+        return QImage.Format_RGB32
+
+    def readRegion(self, top, left, width, height):
+        """
+        Read a region of the rescaled map as an array (height x width x channels).
+        """
+        return self.pyramid.readScaledRegion(self.map_width, self.map_height, int(top), int(left), int(width),
+                                             int(height), self.smooth)
+
+    def copy(self, left, top, width, height):
+        return ndarray2qimage(self.readRegion(top, left, width, height))
+
+
+class DEMPyramid(ImagePyramid):
+    """
+    Pyramid of the display image of a DEM (gray levels, one channel). The statistics used to normalize the
+    heights (min/max without the nodata values) are computed by strips, so the DEM is never loaded as a whole.
+    """
+
+    CHANNELS = 1
+
+    def __init__(self, filename, tile_size=512):
+        ImagePyramid.__init__(self, filename, tile_size)
+
+        self.nodata = None
+        self.min_value = 0.0
+        self.max_value = 0.0
+
+    def loadInfo(self, info):
+        ImagePyramid.loadInfo(self, info)
+
+        self.nodata = info["nodata"]
+        self.min_value = info["min"]
+        self.max_value = info["max"]
+
+    def readHeights(self, src, top, height):
+        """
+        Read a strip of heights, it returns the heights (float32) and the mask of the valid values.
+        """
+        heights = src.read(1, window=Window(0, top, src.width, height)).astype(np.float32)
+        valid = np.isfinite(heights)
+        if self.nodata is not None:
+            valid &= heights != self.nodata
+        return (heights, valid)
+
+    def prepare(self, src):
+
+        self.nodata = src.nodata
+
+        min_value = np.inf
+        max_value = -np.inf
+        for top in range(0, src.height, STRIP_HEIGHT):
+            (heights, valid) = self.readHeights(src, top, min(STRIP_HEIGHT, src.height - top))
+            if valid.any():
+                values = heights[valid]
+                min_value = min(min_value, float(values.min()))
+                max_value = max(max_value, float(values.max()))
+
+        if min_value > max_value:
+            min_value = max_value = 0.0
+
+        self.min_value = min_value
+        self.max_value = max_value
+
+        return { "nodata": self.nodata, "min": min_value, "max": max_value }
+
+    def readStrip(self, src, top, height):
+
+        (heights, valid) = self.readHeights(src, top, height)
+
+        # the nodata values are shown as the highest points (as done by ConversionUtils.floatmap2qimage)
+        heights[~valid] = self.max_value
+        heights -= self.min_value
+        if self.max_value > self.min_value:
+            heights *= 255.0 / (self.max_value - self.min_value)
+
+        return heights.astype(np.uint8)[:, :, np.newaxis]
+
+    def readWindow(self, top, left, width, height):
+        """
+        Read the heights (float32) of a region of the DEM (windowed read, the DEM is not loaded in memory).
+        """
+        fill_value = self.nodata if self.nodata is not None else 0.0
+        heights = np.full((height, width), fill_value, dtype=np.float32)
+
+        y1 = max(top, 0)
+        x1 = max(left, 0)
+        y2 = min(top + height, self.height)
+        x2 = min(left + width, self.width)
+        if y2 > y1 and x2 > x1:
+            with rio.open(self.filename) as src:
+                window = Window(x1, y1, x2 - x1, y2 - y1)
+                heights[y1 - top:y2 - top, x1 - left:x2 - left] = src.read(1, window=window)
+
+        return heights
@@ -0,0 +1,273 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+# INFERENCE MODES OF THE CLASSIFIERS (CPU).
+# Besides the float32 network, a classifier can run:
+#   "jit"           TorchScript traced and frozen model
+#   "bfloat16"      float32 weights, computations in bfloat16 (autocast)
+#   "int8-dynamic"  dynamic int8 quantization (only the Linear layers are quantized, DeepLab is mostly convolutions)
+#   "int8-static"   static int8 quantization (FX graph mode), calibrated on a set of reference tiles
+# The converted models are cached on disk (TorchScript) by the hash of the weights, and each conversion can be
+# checked against the float32 network on the reference tiles (agreement of the predictions, see checkInferenceMode).
+# The modes need recent versions of PyTorch (autocast on the CPU, FX quantization), availableInferenceModes
+# returns the ones supported by the PyTorch installed.
+# Only the models that passed the check are cached as checked, and a cached model is checked again every time
+# reference tiles are given.
+
+import os
+import glob
+import json
+import hashlib
+import logging
+import numpy as np
+import cv2
+
+import torch
+
+INFERENCE_MODES = ["float32", "jit", "bfloat16", "int8-dynamic", "int8-static"]
+
+CACHE_DIR = os.path.join("models", "cache")
+
+# minimum agreement of the predictions with the float32 network to use a converted model
+MIN_AGREEMENT = 0.98
+
+logfile = logging.getLogger("tool-logger")
+
+
+def availableInferenceModes():
+    """
+    The inference modes supported by the PyTorch installed (e.g. torch 1.5 has no CPU autocast and no FX quantization).
+    """
+    modes = ["float32", "jit"]
+
+    if hasattr(torch, "quantization") and hasattr(torch.quantization, "quantize_dynamic"):
+        modes.append("int8-dynamic")
+
+    if hasattr(torch, "autocast"):
+        modes.append("bfloat16")
+
+    try:
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+        modes.append("int8-static")
+    except ImportError:
+        pass
+
+    return [mode for mode in INFERENCE_MODES if mode in modes]
+
+
+def checkAvailable(mode):
+
+    if mode not in INFERENCE_MODES:
+        raise ValueError("Unknown inference mode: " + mode)
+
+    available = availableInferenceModes()
+    if mode not in available:
+        raise ValueError("The inference mode " + mode + " is not supported by PyTorch " + torch.__version__ +
+                         " (available: " + ", ".join(available) + ").")
+
+
+def weightsHash(filename):
+
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cacheFilenames(weights_filename, mode, tile_size, checked):
+    """
+    It returns the filenames of the converted model and of its info (accuracy check) in the cache.
+    The models checked on the reference tiles (and passed) and the ones never checked are cached separately.
+    """
+    name = os.path.splitext(os.path.basename(weights_filename))[0]
+    key = weightsHash(weights_filename)[:16] + "_" + torch.__version__.split("+")[0] + "_" + str(tile_size)
+    key += "_checked" if checked else "_unchecked"
+    base = os.path.join(CACHE_DIR, name + "_" + mode + "_" + key)
+    return (base + ".pt", base + ".json")
+
+
+def normalizeTile(rgb, average_norm):
+    """
+    RGB tile (H x W x 3, uint8) --> normalized tensor (3 x H x W), as done by MapClassifier.classifyBatch.
+    """
+    tensor = torch.from_numpy(np.ascontiguousarray(rgb)).permute(2, 0, 1).float() / 255.0
+    tensor -= torch.tensor(average_norm, dtype=torch.float32).view(3, 1, 1)
+    return tensor
+
+
+class ReferenceTiles(object):
+    """
+    The tiles (*.png) of a folder, labeled with the predictions of the float32 network.
+    """
+
+    def __init__(self, folder, average_norm):
+
+        self.filenames = sorted(glob.glob(os.path.join(folder, "*.png")))
+        self.average_norm = average_norm
+        self.labels = None
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def image(self, idx):
+
+        bgr = cv2.imread(self.filenames[idx], cv2.IMREAD_COLOR)
+        return normalizeTile(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB), self.average_norm)
+
+    def computeLabels(self, net):
+
+        self.labels = []
+        with torch.no_grad():
+            for idx in range(len(self.filenames)):
+                outputs = net(self.image(idx).unsqueeze(0))
+                self.labels.append(torch.argmax(outputs[0], dim=0))
+
+
+class AutocastNetwork(torch.nn.Module):
+    """
+    Run a network with the computations in bfloat16 on the CPU, the output is float32.
+    """
+
+    def __init__(self, net):
+        super(AutocastNetwork, self).__init__()
+        self.net = net
+
+    def forward(self, x):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            return self.net(x).float()
+
+
+def calibrationTiles(tiles, average_norm, tile_size, count=16):
+    """
+    Tiles used to calibrate the static quantization (random tiles if no reference tiles are given).
+    """
+    if tiles is None or len(tiles) == 0:
+        return [torch.rand(1, 3, tile_size, tile_size) - torch.tensor(average_norm).view(1, 3, 1, 1)]
+    return [tiles.image(idx).unsqueeze(0) for idx in range(min(count, len(tiles)))]
+
+
+def convertNetwork(net, mode, tile_size, average_norm, tiles=None):
+    """
+    Convert a float32 network (in eval mode) to the given inference mode.
+    """
+    checkAvailable(mode)
+
+    example = torch.rand(1, 3, tile_size, tile_size)
+
+    with torch.no_grad():
+
+        if mode == "float32":
+            return net
+
+        if mode == "bfloat16":
+            return AutocastNetwork(net)
+
+        if mode == "int8-dynamic":
+            net = torch.quantization.quantize_dynamic(net, {torch.nn.Linear}, dtype=torch.qint8)
+
+        elif mode == "int8-static":
+            from torch.ao.quantization import get_default_qconfig_mapping
+            from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+            qconfig_mapping = get_default_qconfig_mapping("x86")
+            prepared = prepare_fx(net, qconfig_mapping, example_inputs=(example,))
+            for tile in calibrationTiles(tiles, average_norm, tile_size):
+                prepared(tile)
+            net = convert_fx(prepared)
+
+        traced = torch.jit.trace(net, example)
+
+        # torch.jit.freeze is available from PyTorch 1.8, a traced model is still faster than the eager one
+        if hasattr(torch.jit, "freeze"):
+            return torch.jit.freeze(traced)
+        return traced
+
+
+def checkInferenceMode(net_float32, net, tiles, nclasses):
+    """
+    Compare the predictions of a converted network with the ones of the float32 network on the reference tiles.
+    The comparison runs on the CPU, as the converted models. It returns the agreement (the fraction of pixels
+    classified as by the float32 network) and the confusion matrix (rows: float32, columns: converted network).
+    """
+    if tiles.labels is None:
+        tiles.computeLabels(net_float32)
+
+    confusion_matrix = np.zeros((nclasses, nclasses), dtype=np.int64)
+    with torch.no_grad():
+        for idx in range(len(tiles)):
+            outputs = net(tiles.image(idx).unsqueeze(0))
+            predictions = torch.argmax(outputs[0], dim=0).numpy().ravel()
+            labels = tiles.labels[idx].numpy().ravel()
+            counts = np.bincount(labels * nclasses + predictions, minlength=nclasses * nclasses)
+            confusion_matrix += counts.reshape(nclasses, nclasses)
+
+    agreement = np.trace(confusion_matrix) / max(confusion_matrix.sum(), 1)
+
+    return (float(agreement), confusion_matrix)
+
+
+def prepareNetwork(net, weights_filename, mode, nclasses, average_norm, tile_size=768, tiles_folder=None):
+    """
+    It returns the network (float32, in eval mode) converted to the given inference mode. The converted model is
+    loaded from the cache if present, otherwise it is created. It is checked on the reference tiles (if given) and
+    cached only if it passed the check. If the predictions of the converted model differ too much from the float32 ones the float32 network is used.
+    """
+    if mode == "float32":
+        return net
+
+    checkAvailable(mode)
+
+    # the bfloat16 autocast does not change the model, there is nothing to cache
+    cached = mode != "bfloat16"
+
+    tiles = ReferenceTiles(tiles_folder, average_norm) if tiles_folder is not None else None
+    checked = tiles is not None and len(tiles) > 0
+
+    (model_filename, info_filename) = cacheFilenames(weights_filename, mode, tile_size, checked)
+    if cached and os.path.exists(model_filename):
+        converted = torch.jit.load(model_filename)
+    else:
+        converted = convertNetwork(net, mode, tile_size, average_norm, tiles)
+
+    info = { "weights": weights_filename, "mode": mode, "torch": torch.__version__ }
+    if checked:
+        # the cached models are checked again, the reference tiles can be different from the ones of the cache
+        (agreement, confusion_matrix) = checkInferenceMode(net, converted, tiles, nclasses)
+        info["agreement"] = agreement
+        info["confusion matrix"] = confusion_matrix.tolist()
+        if agreement < MIN_AGREEMENT:
+            logfile.warning("[AUTOCLASS] Inference mode " + mode + " rejected, the float32 network is used "
+                            "(agreement with float32 {:.4f}).".format(agreement))
+            for filename in [model_filename, info_filename]:
+                if os.path.exists(filename):
+                    os.remove(filename)
+            return net
+
+    if cached and not os.path.exists(model_filename):
+        # several processes can convert the same model at the same time
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        temp_filename = model_filename + "." + str(os.getpid()) + ".tmp"
+        torch.jit.save(converted, temp_filename)
+        os.replace(temp_filename, model_filename)
+        with open(info_filename, "w") as f:
+            json.dump(info, f)
+
+    return converted
@@ -0,0 +1,191 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+import json
+
+WHITESPACE = " \t\n\r"
+
+# characters that can continue a number
+NUMBER_CHARS = "0123456789.eE+-"
+
+
+class JSONStream(object):
+    """
+    Incremental JSON reader. The file is read in chunks and the values are decoded one at a time, so a
+    large array (e.g. the annotations of a map) never exists as a whole tree of dictionaries in memory.
+    The objects and arrays at the given paths are walked element by element and each element of the
+    arrays is passed to a converter as soon as it has been decoded, everything else is decoded with the
+    standard JSON decoder.
+
+    A path is a tuple of keys, "*" matches any index of an array, e.g.:
+
+        converters = { ("images", "*", "annotations"): blobFromDict }
+    """
+
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, file, converters):
+
+        self.file = file
+        self.converters = converters
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+        # the containers that must be walked to reach the converted arrays
+        self.walked = set()
+        for path in converters.keys():
+            for i in range(len(path)):
+                self.walked.add(path[:i])
+
+    def fill(self, size=None):
+        """
+        Read the next chunk, dropping the part of the buffer already decoded.
+        """
+        chunk = self.file.read(size if size is not None else JSONStream.CHUNK_SIZE)
+        if chunk == "":
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise json.JSONDecodeError("Unexpected end of file", self.buffer, self.pos)
+            self.fill()
+
+    def expect(self, char):
+
+        if self.peek() != char:
+            raise json.JSONDecodeError("Expecting '" + char + "'", self.buffer, self.pos)
+        self.pos += 1
+
+    @staticmethod
+    def isNumber(value):
+        return type(value) is int or type(value) is float
+
+    def numberMayContinue(self, end):
+        """
+        Check if the characters after a decoded number reach the end of the buffer without a separator.
+        """
+        while end < len(self.buffer) and self.buffer[end] in NUMBER_CHARS:
+            end += 1
+        return end == len(self.buffer)
+
+    def decodeValue(self):
+
+        self.peek()
+        # the value is decoded again from the start after each read: the size of the chunks is doubled,
+        # so a large value (e.g. an array that is not walked) is decoded O(log(size)) times, not O(size) times
+        size = JSONStream.CHUNK_SIZE
+        while True:
+            try:
+                (value, end) = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number cut by the end of the buffer is decoded as a shorter number (e.g. "12." as 12),
+                # it is accepted only if it cannot continue in the next chunk
+                if self.eof or not self.isNumber(value) or not self.numberMayContinue(end):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill(size)
+            size *= 2
+
+    def readValue(self, path):
+
+        converter = self.converters.get(path)
+        if converter is not None and self.peek() == "[":
+            return self.readArray(path, converter)
+
+        if path in self.walked:
+            char = self.peek()
+            if char == "{":
+                return self.readObject(path)
+            if char == "[":
+                return self.readArray(path, None)
+
+        return self.decodeValue()
+
+    def readObject(self, path):
+
+        self.expect("{")
+        obj = {}
+        if self.peek() == "}":
+            self.pos += 1
+            return obj
+
+        while True:
+            key = self.decodeValue()
+            self.expect(":")
+            obj[key] = self.readValue(path + (key,))
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect("}")
+                return obj
+
+    def readArray(self, path, converter):
+
+        self.expect("[")
+        array = []
+        if self.peek() == "]":
+            self.pos += 1
+            return array
+
+        item_path = path + ("*",)
+        while True:
+            value = self.readValue(item_path)
+            if converter is not None:
+                value = converter(value)
+            array.append(value)
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect("]")
+                return array
+
+    def atEnd(self):
+
+        try:
+            self.peek()
+            return False
+        except json.JSONDecodeError:
+            return True
+
+    def read(self):
+
+        value = self.readValue(())
+        if not self.atEnd():
+            raise json.JSONDecodeError("Extra data", self.buffer, self.pos)
+        return value
+
+
+def loadJSONStream(filename, converters):
+    """
+    Load a JSON file converting the elements of the arrays at the given paths while they are read (see JSONStream).
+    """
+    with open(filename, "r") as f:
+        return JSONStream(f, converters).read()
@@ -0,0 +1,107 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+from collections import OrderedDict
+from threading import RLock
+
+# default of the bounds not changed by setBudget (None means unbounded)
+UNCHANGED = object()
+
+
+class LRUCache(object):
+    """
+    Least Recently Used cache. The cache is bounded by the number of items and/or by the total
+    size of the items (in bytes, the size of each item is given when it is stored).
+    When a bound is exceeded the least recently used items are evicted.
+    """
+
+    def __init__(self, max_items=None, max_bytes=None):
+
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+
+        # key -> (value, size in bytes)
+        self.items = OrderedDict()
+        self.total_bytes = 0
+
+        self.lock = RLock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return default
+            self.items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, size=0):
+
+        with self.lock:
+            self.remove(key)
+
+            # an item larger than the whole budget is not stored at all
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+
+            self.items[key] = (value, size)
+            self.total_bytes += size
+            self.evict()
+
+    def remove(self, key):
+
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is not None:
+                self.total_bytes -= item[1]
+            return item is not None
+
+    def clear(self):
+
+        with self.lock:
+            self.items.clear()
+            self.total_bytes = 0
+
+    def setBudget(self, max_items=UNCHANGED, max_bytes=UNCHANGED):
+        """
+        Change the bounds of the cache, the bounds not given are left unchanged (None removes a bound).
+        """
+        with self.lock:
+            if max_items is not UNCHANGED:
+                self.max_items = max_items
+            if max_bytes is not UNCHANGED:
+                self.max_bytes = max_bytes
+            self.evict()
+
+    def evict(self):
+
+        with self.lock:
+            while len(self.items) > 0:
+                too_many = self.max_items is not None and len(self.items) > self.max_items
+                too_big = self.max_bytes is not None and self.total_bytes > self.max_bytes
+                if not too_many and not too_big:
+                    break
+                (key, item) = self.items.popitem(last=False)
+                self.total_bytes -= item[1]
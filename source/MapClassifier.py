@@ -19,7 +19,9 @@
 
 import os
 import math
+import queue
 import numpy as np
+from threading import Thread, Lock
 
 # PYTORCH
 import torch
@@ -31,10 +33,14 @@ from models.dataloaders import helpers as helpers
 # DEEPLAB V3+
 from models.deeplab import DeepLab
 
-from PyQt5.QtCore import QCoreApplication, Qt, QObject, pyqtSlot, pyqtSignal
+from PyQt5.QtCore import Qt, QObject, pyqtSlot, pyqtSignal
 from PyQt5.QtGui import QPainter, QImage, QColor, QPixmap, qRgb, qRed, qGreen, qBlue
 
 from source import utils
+from source.ConversionUtils import qimage2ndarray
+from source.ImagePyramid import ScaledTiledImage
+from source.InferenceModes import prepareNetwork
+from source.ModelRegistry import modelRegistry
 
 class MapClassifier(QObject):
     """
@@ -44,12 +50,27 @@ class MapClassifier(QObject):
     classification map.
     """
 
-    # custom signal
+    # custom signals (they can be emitted by the processing threads)
     updateProgress = pyqtSignal(float)
+    processingFinished = pyqtSignal()
 
-    def __init__(self, classifier_info, labels_info, parent=None):
+    # estimated memory needed by the network to classify one megapixel (activations of DeepLab V3+)
+    MEMORY_PER_MPIXEL = 1.5e9
+    MAX_BATCH_SIZE = 36
+
+    # groups of tiles waiting between two stages of the pipeline
+    QUEUE_SIZE = 2
+
+    # label maps larger than this (in pixels) are memory-mapped on disk instead of kept in memory
+    MEMMAP_MIN_PIXELS = 1 << 30
+
+    def __init__(self, classifier_info, labels_info, inference_mode="float32", reference_tiles=None, parent=None):
         super(QObject, self).__init__(parent)
 
+        # inference mode on the CPU (see InferenceModes), the reference tiles are used to check it
+        self.inference_mode = inference_mode
+        self.reference_tiles = reference_tiles
+
         self.label_colors = []
 
         self.classifier_name = classifier_info['Classifier Name']
@@ -65,26 +86,62 @@ class MapClassifier(QObject):
 
             self.label_colors.append(color)
 
+        # the pixels not classified (e.g. the borders of the map) are Background
+        self.background_index = self.label_names.index("Background") if "Background" in self.label_names else 0
+
         self.average_norm = classifier_info['Average Norm.']
         self.net = self._load_classifier(classifier_info['Weights'])
 
         self.flagStopProcessing = False
         self.processing_step = 0
         self.total_processing_steps = 0
+        self.progress_lock = Lock()
+        self.error_message = None
+        self.thread = None
+
+        self.batch_size = None      # crops classified together (None = chosen from the memory available)
+        self.num_threads = None     # threads used on the CPU (None = one per core)
+
+        self.blending = "average"       # aggregation of the shifted crops: "average" or "gaussian"
+        self.blending_weights = {}
+
+        self.label_map = None           # result of the classification, index of the class of each pixel (uint8)
+        self.label_map_filename = None  # set if the label map is memory-mapped
 
 
     def _load_classifier(self, modelName):
+        """
+        The network is taken from the registry of the networks, it stays loaded after the classification.
+        """
+        key = ("DeepLab", modelName, self.nclasses, self.inference_mode, self.reference_tiles, self.useCuda())
+        return modelRegistry().get(key, lambda: self.createNetwork(modelName))
+
+    def createNetwork(self, modelName):
 
         models_dir = "models/"
 
         network_name = os.path.join(models_dir, modelName)
 
-        classifier_pocillopora = DeepLab(backbone='resnet', output_stride=16, num_classes=self.nclasses)
-        classifier_pocillopora.load_state_dict(torch.load(network_name))
+        if self.useCuda():
+            classifier_pocillopora = DeepLab(backbone='resnet', output_stride=16, num_classes=self.nclasses)
+            classifier_pocillopora.load_state_dict(torch.load(network_name))
+            classifier_pocillopora.eval()
+            classifier_pocillopora.to(torch.device("cuda"))
+            return classifier_pocillopora
 
+        # the standard batch normalization (same parameters) can be traced and quantized
+        classifier_pocillopora = DeepLab(backbone='resnet', output_stride=16, num_classes=self.nclasses, sync_bn=False)
+        classifier_pocillopora.load_state_dict(torch.load(network_name, map_location="cpu"))
         classifier_pocillopora.eval()
 
-        return classifier_pocillopora
+        return prepareNetwork(classifier_pocillopora, network_name, self.inference_mode, self.nclasses,
+                              self.average_norm, tiles_folder=self.reference_tiles)
+
+    def useCuda(self):
+        """
+        The GPU is used when available, the inference modes apply only to the CPU.
+        """
+        return torch.cuda.is_available() and self.inference_mode == "float32"
 
 
     def run(self, img_map, TILE_SIZE, AGGREGATION_WINDOW_SIZE, AGGREGATION_STEP):
@@ -93,17 +150,10 @@ class MapClassifier(QObject):
         :param TILE_SIZE: Base tile. This corresponds to the INPUT SIZE of the network.
         :param AGGREGATION_WINDOW_SIZE: Size of the sub-windows to consider for the aggregation.
         :param AGGREGATION_STEP: Step, in pixels, to calculate the different scores.
-        :return:
+        :return: nothing, the result (class indices, see label_names) is stored in self.label_map
         """
 
-        # create a temporary folder to store the processing
-        temp_dir = "temp"
-        if not os.path.exists(temp_dir):
-            os.mkdir(temp_dir)
-
         # prepare for running..
-        STEP_SIZE = AGGREGATION_WINDOW_SIZE
-
         W = img_map.width()
         H = img_map.height()
 
@@ -130,10 +180,16 @@ class MapClassifier(QObject):
         tile_cols = int(wa_width / AGGREGATION_WINDOW_SIZE) + 1
         tile_rows = int(wa_height / AGGREGATION_WINDOW_SIZE) + 1
 
-        if torch.cuda.is_available():
+        # the predictions (class indices) are written directly in the label map
+        self.label_map = self.createLabelMap(W, H)
+
+        if self.useCuda():
             device = torch.device("cuda")
             self.net.to(device)
             torch.cuda.synchronize()
+        else:
+            device = torch.device("cpu")
+            torch.set_num_threads(self.cpuThreads())
 
         self.net.eval()
 
@@ -141,230 +197,349 @@ class MapClassifier(QObject):
         tiles_number = tile_rows * tile_cols
 
         self.processing_step = 0
-        self.total_processing_steps = 19 * tiles_number
+        self.total_processing_steps = 10 * tiles_number
 
-        for row in range(tile_rows):
+        # the 9 shifted crops of several tiles are classified together, in batches of batch_size crops
+        batch_size = self.batch_size if self.batch_size is not None else self.chooseBatchSize(TILE_SIZE, device)
+        tiles_per_group = max(1, batch_size // 9)
 
-            if self.flagStopProcessing is True:
-                break
+        tiles = [(row, col) for row in range(tile_rows) for col in range(tile_cols)]
+        groups = [tiles[i:i + tiles_per_group] for i in range(0, tiles_number, tiles_per_group)]
 
-            for col in range(tile_cols):
+        # pipeline: reading of the crops -> inference (this thread) -> aggregation and writing of the tiles,
+        # the stages are connected by bounded queues so the reading and the writing overlap with the inference
+        crops_queue = queue.Queue(maxsize=MapClassifier.QUEUE_SIZE)
+        scores_queue = queue.Queue(maxsize=MapClassifier.QUEUE_SIZE)
 
-                if self.flagStopProcessing is True:
-                    break
+        layout = (wa_top, wa_left, wa_width, wa_height, TILE_SIZE, AGGREGATION_WINDOW_SIZE, AGGREGATION_STEP)
 
-                scores = np.zeros((9, self.nclasses, TILE_SIZE, TILE_SIZE))
+        reader = Thread(target=self.readCrops, args=(img_map, groups, layout, crops_queue), daemon=True)
+        writer = Thread(target=self.writeTiles, args=(layout, scores_queue), daemon=True)
+        reader.start()
+        writer.start()
 
-                k = 0
-                for i in range(-1,2):
-                    for j in range(-1,2):
+        try:
+            while True:
+                item = self.getItem(crops_queue)
+                if item is None:
+                    break
 
-                        top = wa_top - AGGREGATION_STEP + row * STEP_SIZE + i * AGGREGATION_STEP
-                        left = wa_left - AGGREGATION_STEP + col * STEP_SIZE + j * AGGREGATION_STEP
-                        cropimg = utils.cropQImage(img_map, [top, left, TILE_SIZE, TILE_SIZE])
-                        img_np = utils.qimageToNumpyArray(cropimg)
+                (group, crops) = item
+                n = crops.shape[0]
 
-                        img_np = img_np.astype(np.float32)
-                        img_np = img_np / 255.0
+                # the scores stay on the device until the tiles have been aggregated
+                scores = torch.empty((n, self.nclasses, TILE_SIZE, TILE_SIZE), dtype=torch.float32, device=device)
+                for batch_start in range(0, n, batch_size):
 
-                        # H x W x C --> C x H x W
-                        img_np = img_np.transpose(2, 0, 1)
+                    if self.flagStopProcessing is True:
+                        break
 
-                        # Normalization (average subtraction)
-                        img_np[0] = img_np[0] - self.average_norm[0]
-                        img_np[1] = img_np[1] - self.average_norm[1]
-                        img_np[2] = img_np[2] - self.average_norm[2]
+                    batch_end = min(batch_start + batch_size, n)
+                    scores[batch_start:batch_end] = self.classifyBatch(crops[batch_start:batch_end], device)
+                    self.advanceProgress(batch_end - batch_start)
 
-                        with torch.no_grad():
+                if not self.putItem(scores_queue, (group, scores)):
+                    break
 
-                            img_tensor = torch.from_numpy(img_np)
-                            input = img_tensor.unsqueeze(0)
+            self.putItem(scores_queue, None)
 
-                            if torch.cuda.is_available():
-                                input = input.to(device)
+        except Exception as e:
+            self.fail(e)
 
-                            outputs = self.net(input)
+        reader.join()
+        writer.join()
 
-                            scores[k] = outputs[0].cpu().numpy()
-                            k = k + 1
+        if isinstance(self.label_map, np.memmap):
+            self.label_map.flush()
 
-                            self.processing_step += 1
-                            self.updateProgress.emit( (100.0 * self.processing_step) / self.total_processing_steps )
-                            QCoreApplication.processEvents()
+        torch.cuda.empty_cache()
+        del self.net
+        self.net = None
 
+    def readCrops(self, img_map, groups, layout, crops_queue):
+        """
+        First stage of the pipeline: it cuts the 9 shifted crops of each tile of the groups.
+        """
+        (wa_top, wa_left, wa_width, wa_height, TILE_SIZE, AGGREGATION_WINDOW_SIZE, AGGREGATION_STEP) = layout
+        STEP_SIZE = AGGREGATION_WINDOW_SIZE
 
-                if self.flagStopProcessing is True:
-                    break
+        try:
+            for group in groups:
+
+                crops = np.zeros((9 * len(group), TILE_SIZE, TILE_SIZE, 3), dtype=np.uint8)
+                n = 0
+                for (row, col) in group:
+                    for i in range(-1,2):
+                        for j in range(-1,2):
+                            top = wa_top - AGGREGATION_STEP + row * STEP_SIZE + i * AGGREGATION_STEP
+                            left = wa_left - AGGREGATION_STEP + col * STEP_SIZE + j * AGGREGATION_STEP
+                            if isinstance(img_map, ScaledTiledImage):
+                                # large maps, the crop is read from the pyramid
+                                crops[n] = img_map.readRegion(top, left, TILE_SIZE, TILE_SIZE)
+                            else:
+                                cropimg = utils.cropQImage(img_map, [top, left, TILE_SIZE, TILE_SIZE])
+                                crops[n] = qimage2ndarray(cropimg, copy=False)
+                            n += 1
+
+                if not self.putItem(crops_queue, (group, crops)):
+                    return
+
+            self.putItem(crops_queue, None)
+
+        except Exception as e:
+            self.fail(e)
+
+    def writeTiles(self, layout, scores_queue):
+        """
+        Last stage of the pipeline: it aggregates the scores of each tile and writes the result in the label map.
+        """
+        (wa_top, wa_left, wa_width, wa_height, TILE_SIZE, AGGREGATION_WINDOW_SIZE, AGGREGATION_STEP) = layout
+
+        try:
+            while True:
+                item = self.getItem(scores_queue)
+                if item is None:
+                    return
 
-                # preds_avg, preds_bayesian = self.aggregateScores(scores, tile_sz=TILE_SIZE,
-                #                                     center_window_size=AGGREGATION_WINDOW_SIZE, step=AGGREGATION_STEP)
+                (group, scores) = item
+                for t, (row, col) in enumerate(group):
 
-                preds_avg = self.aggregateScores(scores, tile_sz=TILE_SIZE,
+                    preds_avg = self.aggregateScores(scores[9 * t:9 * t + 9], tile_sz=TILE_SIZE,
                                                      center_window_size=AGGREGATION_WINDOW_SIZE, step=AGGREGATION_STEP)
 
-                values_t, predictions_t = torch.max(torch.from_numpy(preds_avg), 0)
-                preds = predictions_t.cpu().numpy()
+                    preds = torch.argmax(preds_avg, dim=0).to(torch.uint8).cpu().numpy()
 
-                resimg = np.zeros((preds.shape[0], preds.shape[1], 3), dtype='uint8')
+                    # the tiles on the border are cut to the working area
+                    xoffset = wa_left + col * AGGREGATION_WINDOW_SIZE
+                    yoffset = wa_top + row * AGGREGATION_WINDOW_SIZE
+                    w = min(AGGREGATION_WINDOW_SIZE, wa_left + wa_width - 1 - xoffset)
+                    h = min(AGGREGATION_WINDOW_SIZE, wa_top + wa_height - 1 - yoffset)
+                    if w > 0 and h > 0:
+                        self.label_map[yoffset:yoffset + h, xoffset:xoffset + w] = preds[:h, :w]
 
-                for label_index in range(self.nclasses):
-                    resimg[preds == label_index, :] = self.label_colors[label_index]
+                    self.advanceProgress(1)
 
-                tilename = str(row) + "_" + str(col) + ".png"
-                filename = os.path.join(temp_dir, tilename)
-                utils.rgbToQImage(resimg).save(filename)
+        except Exception as e:
+            self.fail(e)
 
-                self.processing_step += 1
-                self.updateProgress.emit( (100.0 * self.processing_step) / self.total_processing_steps )
-                QCoreApplication.processEvents()
+    def putItem(self, q, item):
+        """
+        Put an item in a queue of the pipeline waiting for a free slot. It returns False if the processing is stopped.
+        """
+        while self.flagStopProcessing is False:
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def getItem(self, q):
+        """
+        Get the next item of a queue of the pipeline, None at the end or if the processing is stopped.
+        """
+        while self.flagStopProcessing is False:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
 
-        # put tiles together
-        qimglabel = QImage(W, H, QImage.Format_RGB32)
+    def advanceProgress(self, steps):
 
-        xoffset = 0
-        yoffset = 0
+        with self.progress_lock:
+            self.processing_step += steps
+            progress = (100.0 * self.processing_step) / self.total_processing_steps
+        self.updateProgress.emit(progress)
 
-        painter = QPainter(qimglabel)
+    def fail(self, error):
+        """
+        Stop all the stages of the pipeline because of an error.
+        """
+        if self.error_message is None:
+            self.error_message = str(error)
+        self.flagStopProcessing = True
 
-        for r in range(tile_rows):
-            for c in range(tile_cols):
-                tilename = str(r) + "_" + str(c) + ".png"
-                filename = os.path.join(temp_dir, tilename)
-                qimg = QImage(filename)
+    def start(self, img_map, TILE_SIZE, AGGREGATION_WINDOW_SIZE, AGGREGATION_STEP):
+        """
+        Run the classification (see run()) on a background thread. processingFinished is emitted at the end,
+        also when the processing has been stopped or has failed (see error_message).
+        """
+        self.flagStopProcessing = False
+        self.error_message = None
 
-                xoffset = wa_left + c * AGGREGATION_WINDOW_SIZE
-                yoffset = wa_top + r * AGGREGATION_WINDOW_SIZE
+        self.thread = Thread(target=self.work, args=(img_map, TILE_SIZE, AGGREGATION_WINDOW_SIZE, AGGREGATION_STEP),
+                             daemon=True)
+        self.thread.start()
 
-                cut = False
-                W_prime = wa_width
-                H_prime = wa_height
+    def work(self, *args):
 
-                if xoffset + AGGREGATION_WINDOW_SIZE > wa_left + wa_width - 1:
-                    W_prime = wa_width + wa_left - xoffset - 1
-                    cut = True
+        try:
+            self.run(*args)
+        except Exception as e:
+            self.fail(e)
 
-                if yoffset + AGGREGATION_WINDOW_SIZE > wa_top + wa_height - 1:
-                    H_prime = wa_height + wa_top - yoffset - 1
-                    cut = True
+        self.processingFinished.emit()
 
-                if cut is True:
-                    qimg2 = qimg.copy(0, 0, W_prime, H_prime)
-                    painter.drawImage(xoffset, yoffset, qimg2)
-                else:
-                    painter.drawImage(xoffset, yoffset, qimg)
+    def isRunning(self):
+        return self.thread is not None and self.thread.is_alive()
 
-        # detach the qimglabel otherwise the Qt EXPLODES when memory is free
-        painter.end()
+    def wait(self):
 
-        labelfile = os.path.join(temp_dir, "labelmap.png")
-        qimglabel.save(labelfile)
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
 
-        torch.cuda.empty_cache()
-        del self.net
-        self.net = None
+    def createLabelMap(self, width, height):
+        """
+        Allocate the label map (one class index per pixel), filled with the Background index since the tiles
+        do not cover the borders of the map. The label maps of huge maps are memory-mapped on disk.
+        """
+        self.releaseLabelMap()
 
-    def stopProcessing(self):
+        if width * height < MapClassifier.MEMMAP_MIN_PIXELS:
+            return np.full((height, width), self.background_index, dtype=np.uint8)
 
-        self.flagStopProcessing = True
+        temp_dir = "temp"
+        if not os.path.exists(temp_dir):
+            os.mkdir(temp_dir)
 
-    def aggregateScores(self, scores, tile_sz, center_window_size, step):
+        self.label_map_filename = os.path.join(temp_dir, "labelmap.npy")
+        label_map = np.lib.format.open_memmap(self.label_map_filename, mode="w+", dtype=np.uint8,
+                                              shape=(height, width))
+        label_map.fill(self.background_index)
+        return label_map
+
+    def releaseLabelMap(self):
+
+        self.label_map = None
+        if self.label_map_filename is not None:
+            if os.path.exists(self.label_map_filename):
+                os.remove(self.label_map_filename)
+            self.label_map_filename = None
+
+    def classifyBatch(self, crops, device):
+        """
+        Classify a batch of crops (N x H x W x 3, uint8). It returns the scores (N x classes x H x W, float32)
+        as a tensor on the device.
         """
-        Calcute the classification scores using a Bayesian fusion aggregation.
-        """""
+        with torch.no_grad():
 
-        nscores = scores.shape[0]
-        nclasses = scores.shape[1]
+            # H x W x C --> C x H x W, normalization (average subtraction)
+            batch = torch.from_numpy(crops).to(device)
+            batch = batch.permute(0, 3, 1, 2).float() / 255.0
+            batch -= torch.tensor(self.average_norm, dtype=torch.float32, device=device).view(1, 3, 1, 1)
 
-        classification_scores = np.zeros((nscores, nclasses, center_window_size, center_window_size))
-        scores_counter = np.zeros((center_window_size, center_window_size), dtype=np.int8)
+            outputs = self.net(batch)
 
-        # aggregation limits
-        top = int((tile_sz - center_window_size) / 2)
-        left = int((tile_sz - center_window_size) / 2)
+            return outputs.float()
+
+    def cpuThreads(self):
+        """
+        Number of threads used by PyTorch on the CPU: by default one per core available to the process
+        (os.cpu_count() also counts the cores not usable, e.g. in containers or with restricted affinity).
+        """
+        if self.num_threads is not None:
+            return self.num_threads
 
-        k = 0
-        for i in range(-1,2):
-            for j in range(-1,2):
+        if hasattr(os, "sched_getaffinity"):
+            return max(1, len(os.sched_getaffinity(0)))
 
-                x1dest = j * step - left
-                y1dest = i * step - top
+        return os.cpu_count() or 1
 
-                x2dest = x1dest + tile_sz-1
-                y2dest = y1dest + tile_sz-1
+    def chooseBatchSize(self, tile_size, device):
+        """
+        Choose the number of crops classified together from the memory available (on the GPU or on the host).
+        """
+        per_crop = MapClassifier.MEMORY_PER_MPIXEL * (tile_size * tile_size) / 1.0e6
 
-                x1src = 0
-                if x1dest < 0:
-                    x1src = -x1dest
-                    x1dest = 0
+        available = None
+        if device.type == "cuda":
+            if hasattr(torch.cuda, "mem_get_info"):
+                (available, total) = torch.cuda.mem_get_info()
+            else:
+                props = torch.cuda.get_device_properties(device)
+                available = props.total_memory - torch.cuda.memory_allocated(device)
+        else:
+            try:
+                available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+            except (ValueError, OSError, AttributeError):
+                available = None
 
-                y1src = 0
-                if y1dest < 0:
-                    y1src = -y1dest
-                    y1dest = 0
+        if available is None:
+            return 9
 
-                if x2dest > center_window_size:
-                    x2dest = center_window_size
+        # half of the memory available is left as a margin
+        batch_size = int(0.5 * available / per_crop)
+        return max(1, min(batch_size, MapClassifier.MAX_BATCH_SIZE))
 
-                if y2dest > center_window_size:
-                    y2dest = center_window_size
+    def stopProcessing(self):
 
-                x2src = x1src + x2dest - x1dest
-                y2src = y1src + y2dest - y1dest
+        self.flagStopProcessing = True
 
-                classification_scores[k, :, y1dest:y2dest, x1dest:x2dest] = scores[k, :, y1src:y2src, x1src:x2src]
-                scores_counter[y1dest:y2dest, x1dest:x2dest] += 1
+    def blendingWeights(self, tile_sz, device):
+        """
+        Weight of each pixel of a crop in the aggregation: uniform ("average") or decreasing with the distance
+        from the center of the crop ("gaussian"), where the network sees less context.
+        """
+        key = (self.blending, tile_sz, str(device))
+        weights = self.blending_weights.get(key)
+        if weights is None:
+            if self.blending == "gaussian":
+                sigma = tile_sz / 4.0
+                x = torch.arange(tile_sz, dtype=torch.float32, device=device) - (tile_sz - 1) / 2.0
+                g = torch.exp(-0.5 * (x / sigma) ** 2)
+                weights = g.view(-1, 1) * g.view(1, -1)
+            else:
+                weights = torch.ones((tile_sz, tile_sz), dtype=torch.float32, device=device)
+            self.blending_weights = { key: weights }
 
-                k = k + 1
+        return weights
 
-                self.processing_step += 1
-                self.updateProgress.emit( (100.0 * self.processing_step) / self.total_processing_steps )
-                QCoreApplication.processEvents()
+    def aggregateScores(self, scores, tile_sz, center_window_size, step):
+        """
+        Aggregate the scores of the 9 shifted crops of a tile (tensor 9 x classes x tile_sz x tile_sz) on the
+        center window. The softmax of the stacked scores is accumulated with the weight of each pixel
+        (see blendingWeights) and normalized, everything in float32 on the device of the scores.
+        It returns the class probabilities (classes x center_window_size x center_window_size).
+        """
 
         #####   AGGREGATE SCORES BY AVERAGING THEM   ##################################################
 
         # NOTE: SOME APPROACHES AVERAGE THE SCORES DIRECTLY, OTHER ONES AVERAGE THE OUTPUT OF THE SOFTMAX
         #       HERE, WE AVERAGE THE OUTPUT OF THE SOFTMAX
 
-        softmax = torch.nn.Softmax(dim=0)
-
-        classification_scores_avg = np.zeros((nclasses, center_window_size, center_window_size))
-        for i in range(nscores):
-            prob = softmax(torch.from_numpy(classification_scores[i]))
-            classification_scores_avg = classification_scores_avg + prob.numpy()
-
-        classification_scores_avg = classification_scores_avg / nscores
-
-        #####   AGGREGATE SCORES USING BAYESIAN FUSION   #############################################
-
-        # NOTE THAT:
-        #                                              _____
-        #                                               | |
-        #               p(y|s_N , s_N-1 , s_0) =  p(y)  | |  p(s_i | y)
-        #                                             i=0..N
-        # CORRESPONDS TO:
-        #                                                          __
-        #                                                      (   \                )
-        #               p(y|s_N , s_N-1 , s_0) =  p(y) SOFTMAX (   /   p(s_i | y))  )
-        #                                                      (   ==               )
-        #                                                        i=0..N
-        #
-        # THIS AVOID NUMERICAL PROBLEMS FOR PRODUCTS WITH MANY TERMS.
-
-        # # bayesian aggregation
-        # classification_scores_bayes = np.zeros((nclasses, center_window_size, center_window_size))
-        #
-        # for i in range(nscores):
-        #     classification_scores_bayes = classification_scores_bayes + classification_scores[i]
-        #
-        # classification_scores_bayesian = np.zeros((nclasses, center_window_size, center_window_size))
-        #
-        # res = softmax(torch.from_numpy(classification_scores_bayes))
-        #
-        # # PRIOR probabilities
-        # prior = [0.7, 0.1, 0.1, 0.1]
-        #
-        # for i in range(nclasses):
-        #     classification_scores_bayesian[i] = prior[i] * res[i].numpy()
-
-        return classification_scores_avg
+        with torch.no_grad():
+
+            device = scores.device
+            nclasses = scores.shape[1]
+
+            prob = torch.softmax(scores, dim=1)
+            weights = self.blendingWeights(tile_sz, device)
+
+            accumulator = torch.zeros((nclasses, center_window_size, center_window_size), dtype=torch.float32, device=device)
+            weights_sum = torch.zeros((center_window_size, center_window_size), dtype=torch.float32, device=device)
+
+            # position of the center window in the crop without shift
+            offset = int((tile_sz - center_window_size) / 2)
+
+            k = 0
+            for i in range(-1,2):
+                for j in range(-1,2):
+
+                    # the center window in the coordinates of the shifted crop, clipped to the crop
+                    y1src = offset - i * step
+                    x1src = offset - j * step
+                    y1 = max(y1src, 0)
+                    x1 = max(x1src, 0)
+                    y2 = min(y1src + center_window_size, tile_sz)
+                    x2 = min(x1src + center_window_size, tile_sz)
+
+                    if y2 > y1 and x2 > x1:
+                        w = weights[y1:y2, x1:x2]
+                        accumulator[:, y1 - y1src:y2 - y1src, x1 - x1src:x2 - x1src] += prob[k, :, y1:y2, x1:x2] * w
+                        weights_sum[y1 - y1src:y2 - y1src, x1 - x1src:x2 - x1src] += w
+
+                    k = k + 1
 
+            return accumulator / weights_sum.clamp_min(1e-12)
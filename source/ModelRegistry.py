@@ -0,0 +1,140 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+import io
+import logging
+from threading import Thread, Lock
+
+from source.LRUCache import LRUCache
+
+logfile = logging.getLogger("tool-logger")
+
+
+def modelSize(net):
+    """
+    Memory (in bytes) used by the parameters and the buffers of a network. The frozen TorchScript models
+    (see InferenceModes) store the weights as constants of the graph, their size is the serialized one.
+    """
+    size = 0
+    for tensor in list(net.parameters()) + list(net.buffers()):
+        size += tensor.numel() * tensor.element_size()
+
+    if size == 0:
+        import torch
+        if isinstance(net, torch.jit.ScriptModule):
+            buffer = io.BytesIO()
+            torch.jit.save(net, buffer)
+            size = buffer.tell()
+
+    return size
+
+
+class ModelRegistry(object):
+    """
+    Process-wide registry of the loaded networks (DEXTR, the classifiers, ..). The networks are kept loaded
+    (warm) in a LRU cache bounded by the memory of their weights, so they are not read from the disk every time
+    they are used. A network can be loaded in advance on a background thread (see preload).
+    Each network is identified by a key and created by a loader, a function without arguments.
+    """
+
+    def __init__(self, max_bytes=1024*1024*1024):
+
+        self.cache = LRUCache(max_bytes=max_bytes)
+        self.lock = Lock()
+        self.key_locks = {}     # a network is loaded by one thread at a time
+        self.errors = {}        # last error loading each network in background (see preload)
+
+    def keyLock(self, key):
+
+        with self.lock:
+            lock = self.key_locks.get(key)
+            if lock is None:
+                lock = Lock()
+                self.key_locks[key] = lock
+            return lock
+
+    def isLoaded(self, key):
+        return key in self.cache
+
+    def get(self, key, loader):
+        """
+        It returns the network with the given key, loading it if it is not in the cache (if the network is being
+        loaded by another thread, e.g. by preload, it waits for it).
+        """
+        net = self.cache.get(key)
+        if net is not None:
+            return net
+
+        with self.keyLock(key):
+            net = self.cache.get(key)
+            if net is None:
+                net = loader()
+                self.cache.put(key, net, size=modelSize(net))
+                self.errors.pop(key, None)
+
+        return net
+
+    def preload(self, key, loader):
+        """
+        Load a network on a background thread.
+        """
+        thread = Thread(target=self.load, args=(key, loader), daemon=True)
+        thread.start()
+        return thread
+
+    def load(self, key, loader):
+        """
+        Load a network, it returns the error (None if the network has been loaded). The error is logged and
+        kept (see loadError), when the network is used it is loaded again and the error raised to the caller.
+        """
+        try:
+            self.get(key, loader)
+        except Exception as e:
+            logfile.error("[MODELS] Network " + str(key) + " cannot be loaded: " + str(e))
+            self.errors[key] = e
+            return e
+        return None
+
+    def loadError(self, key):
+        """
+        It returns the error of the last failed (background) load of a network, None if there was no error.
+        """
+        return self.errors.get(key)
+
+    def setBudget(self, max_bytes):
+        self.cache.setBudget(max_bytes=max_bytes)
+
+    def remove(self, key):
+        self.cache.remove(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+registry = None
+
+
+def modelRegistry():
+    """
+    It returns the registry of the networks of the process.
+    """
+    global registry
+    if registry is None:
+        registry = ModelRegistry()
+    return registry
@@ -24,6 +24,7 @@ from PyQt5.QtGui import QPainter, QImage, QPen, QBrush, QColor, qRgb
 from PyQt5.QtCore import Qt
 import random as rnd
 from source import utils
+from source.ConversionUtils import qimage2ndarray
 from skimage.filters import gaussian
 from skimage.segmentation import find_boundaries
 from skimage import measure
@@ -501,7 +502,7 @@ class NewDataset(object):
 		label_w = self.label_image.width()
 		label_h = self.label_image.height()
 
-		imglbl = utils.qimageToNumpyArray(self.label_image)
+		imglbl = qimage2ndarray(self.label_image)
 
 		num_classes = len(target_classes)
 
@@ -1087,7 +1088,7 @@ class NewDataset(object):
 			label_w = image_label.width()
 			label_h = image_label.height()
 			total_pixels += label_w * label_h
-			imglbl = utils.qimageToNumpyArray(image_label)
+			imglbl = qimage2ndarray(image_label)
 
 			# class 0 --> background
 			labelsint = np.zeros((label_h, label_w), dtype='int64')
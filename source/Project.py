@@ -10,6 +10,9 @@ from source.Annotation import Annotation
 from source.Blob import Blob
 from source.Label import Label
 from source.Correspondences import Correspondences
+from source.JSONStream import loadJSONStream
+from source.ProjectArchive import BINARY_PROJECT_EXTENSION, isBinaryProject, writeProjectArchive, readProjectArchive, \
+    readProjectHeader
 import pandas as pd
 
 
@@ -17,17 +20,28 @@ def loadProject(filename, labels_dict):
 
     dir = QDir(os.getcwd())
     filename = dir.relativeFilePath(filename)
-    f = open(filename, "r")
-    try:
-        data = json.load(f)
-    except json.JSONDecodeError as e:
-        raise Exception(str(e))
 
-
-    if "Map File" in data:
-        project = loadOldProject(data, labels_dict)
-    else:
+    # the format is detected from the content of the file
+    if isBinaryProject(filename):
+        (data, annotations) = readProjectArchive(filename)
+        for image_data, columns in zip(data["images"], annotations):
+            image_data["annotations"] = columns
         project = Project(**data)
+    else:
+        # the contours of the annotations are converted to compact arrays while the file is read, so the
+        # dictionaries of the annotations never exist all together in memory; the blobs are created when
+        # the annotations of a map are used for the first time (see Image.hydrateAnnotations)
+        converters = { ("images", "*", "annotations"): Blob.compactRecord,
+                       ("Segmentation Data",): blobFromDict }
+        try:
+            data = loadJSONStream(filename, converters)
+        except json.JSONDecodeError as e:
+            raise Exception(str(e))
+
+        if "Map File" in data:
+            project = loadOldProject(data, labels_dict)
+        else:
+            project = Project(**data)
 
     project.filename = filename
 
@@ -43,7 +57,47 @@ def loadProject(filename, labels_dict):
             im.id = "Map " + str(count)
         count += 1
 
-    f.close()
+    return project
+
+
+def loadProjectHeader(filename):
+    """
+    It returns the project dictionary without the annotations, the blobs are not created (e.g. to read
+    the maps of a project without loading it).
+    """
+
+    if isBinaryProject(filename):
+        return readProjectHeader(filename)
+
+    # the annotations are dropped while they are read
+    converters = { ("images", "*", "annotations"): lambda data: None,
+                   ("Segmentation Data",): lambda data: None }
+    try:
+        data = loadJSONStream(filename, converters)
+    except json.JSONDecodeError as e:
+        raise Exception(str(e))
+
+    for image_data in data.get("images", []):
+        image_data["annotations"] = []
+    if "Segmentation Data" in data:
+        data["Segmentation Data"] = []
+
+    return data
+
+
+def blobFromDict(data):
+
+    blob = Blob(None, 0, 0, 0)
+    blob.fromDict(data)
+    return blob
+
+
+def convertProject(filename, output_filename, labels_dict):
+    """
+    Convert a project to the format given by the extension of the output filename (e.g. from .json to binary).
+    """
+    project = loadProject(filename, labels_dict)
+    project.save(output_filename)
     return project
 
 
@@ -65,9 +119,7 @@ def loadOldProject(data, labels_dict):
     channel = Channel(filename=map_filename, type="RGB")
     image.channels.append(channel)
 
-    for blob_data in data["Segmentation Data"]:
-        blob = Blob(None, 0, 0, 0)
-        blob.fromDict(blob_data)
+    for blob in data["Segmentation Data"]:
         blob.setId(int(blob.id))  # id should be set again to update related info
         image.annotations.addBlob(blob)
 
@@ -92,6 +144,17 @@ class ProjectEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+class ProjectHeaderEncoder(ProjectEncoder):
+    """
+    Encode the project without the annotations (that are stored separately in the binary format).
+    """
+    def default(self, obj):
+        if isinstance(obj, Image):
+            return obj.save(include_annotations=False)
+
+        return ProjectEncoder.default(self, obj)
+
+
 
 class Project(object):
 
@@ -134,10 +197,24 @@ class Project(object):
     def save(self, filename = None):
         #try:
         data = self.__dict__
-        str = json.dumps(data, cls=ProjectEncoder)
 
         if filename is None:
             filename = self.filename
+
+        # binary format: the annotations are stored as columnar arrays
+        if filename.endswith(BINARY_PROJECT_EXTENSION):
+            header = json.dumps(data, cls=ProjectHeaderEncoder)
+            annotations = []
+            for image in self.images:
+                if not image.isHydrated() and isinstance(image.annotation_records, dict):
+                    annotations.append(image.annotation_records)
+                else:
+                    annotations.append(image.annotations.seg_blobs)
+            writeProjectArchive(filename, header, annotations)
+            return
+
+        str = json.dumps(data, cls=ProjectEncoder)
+
         f = open(filename, "w")
         f.write(str)
         f.close()
@@ -199,6 +276,25 @@ class Project(object):
         corr.set(blobs1, blobs2)
 
 
+    def scaledBlobs(self, image, conversion):
+        """
+        Copies of the blobs of an image in millimeters (the areas are in cm^2).
+        """
+        blobs = image.annotations.seg_blobs
+        (areas, perimeters, centroids) = image.annotations.computeMeasures(blobs, conversion)
+
+        scaled = []
+        for i, blob in enumerate(blobs):
+            blob_c = blob.copy()
+            blob_c.bbox = (blob_c.bbox * conversion).round().astype(int)
+            blob_c.contour = blob_c.contour * conversion
+            blob_c.area = areas[i] / 100
+            blob_c.perimeter = perimeters[i]
+            blob_c.centroid = centroids[i]
+            scaled.append(blob_c)
+
+        return scaled
+
     def computeCorrespondences(self, img_source_idx, img_target_idx):
         """
         Compute the correspondences between an image pair.
@@ -209,21 +305,8 @@ class Project(object):
 
         # switch form px to mm just for calculation (except areas that are in cm)
 
-        blobs1 = []
-        for blob in self.images[img_source_idx].annotations.seg_blobs:
-            blob_c = blob.copy()
-            blob_c.bbox = (blob_c.bbox*conversion1).round().astype(int)
-            blob_c.contour = blob_c.contour*conversion1
-            blob_c.area = blob_c.area*conversion1*conversion1 / 100
-            blobs1.append(blob_c)
-
-        blobs2 = []
-        for blob in self.images[img_target_idx].annotations.seg_blobs:
-            blob_c = blob.copy()
-            blob_c.bbox = (blob_c.bbox * conversion2).round().astype(int)
-            blob_c.contour = blob_c.contour * conversion2
-            blob_c.area = blob_c.area * conversion2 * conversion2 / 100
-            blobs2.append(blob_c)
+        blobs1 = self.scaledBlobs(self.images[img_source_idx], conversion1)
+        blobs2 = self.scaledBlobs(self.images[img_target_idx], conversion2)
 
         corr = self.getImagePairCorrespondences(img_source_idx, img_target_idx)
         corr.autoMatch(blobs1, blobs2)
@@ -0,0 +1,214 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+# BINARY PROJECT FORMAT.
+# The project is stored in a zip container (NumPy .npz) with:
+#  - "header": the project as JSON (utf-8) without the annotations
+#  - for each image i, the annotations as columnar arrays named "i/<column>". The contours of all the blobs
+#    are concatenated in a single array of points with a table of offsets (the same for the inner contours).
+
+import json
+import numpy as np
+
+from source.Blob import Blob
+
+BINARY_PROJECT_EXTENSION = ".tlb"
+BINARY_PROJECT_VERSION = 1
+
+ZIP_MAGIC = b"PK\x03\x04"
+
+
+def isBinaryProject(filename):
+    """
+    Check the first bytes of the file to detect the binary format (independently of the extension).
+    """
+    with open(filename, "rb") as f:
+        magic = f.read(4)
+    return magic == ZIP_MAGIC
+
+
+def stackContours(contours):
+    """
+    Concatenate a list of contours in a single (float32) array of points. It returns (points, offsets),
+    the points of the i-th contour are points[offsets[i]:offsets[i+1]].
+    """
+    offsets = np.zeros(len(contours) + 1, dtype=np.int64)
+    if len(contours) == 0:
+        return (np.zeros((0, 2), dtype=np.float32), offsets)
+
+    offsets[1:] = np.cumsum([contour.shape[0] for contour in contours])
+    points = np.concatenate([np.asarray(contour, dtype=np.float32).reshape(-1, 2) for contour in contours])
+    return (points, offsets)
+
+
+def blobsToColumns(blobs):
+    """
+    Convert a list of blobs to a dictionary of columns (arrays).
+    """
+
+    n = len(blobs)
+
+    inner_contours = []
+    inner_index = np.zeros(n + 1, dtype=np.int64)
+    for i, blob in enumerate(blobs):
+        inner_contours.extend(blob.inner_contours)
+        inner_index[i + 1] = len(inner_contours)
+
+    (contour_points, contour_offsets) = stackContours([blob.contour for blob in blobs])
+    (inner_points, inner_offsets) = stackContours(inner_contours)
+
+    columns = {
+        "id": np.array([blob.id for blob in blobs], dtype=np.int64),
+        "version": np.array([blob.version for blob in blobs], dtype=np.int64),
+        "area": np.array([blob.area for blob in blobs], dtype=np.float64),
+        "perimeter": np.array([blob.perimeter for blob in blobs], dtype=np.float64),
+        "centroid": np.array([blob.centroid for blob in blobs], dtype=np.float64).reshape(n, 2),
+        "bbox": np.array([blob.bbox for blob in blobs], dtype=np.int64).reshape(n, 4),
+        "contour points": contour_points,
+        "contour offsets": contour_offsets,
+        "inner points": inner_points,
+        "inner offsets": inner_offsets,
+        "inner index": inner_index,
+        "deep extreme points": np.array([blob.deep_extreme_points for blob in blobs], dtype=np.float64).reshape(n, 4, 2),
+        "class name": np.array([blob.class_name for blob in blobs], dtype=str),
+        "class color": np.array([blob.class_color for blob in blobs], dtype=np.int64).reshape(n, 3),
+        "instance name": np.array([blob.instance_name for blob in blobs], dtype=str),
+        "blob name": np.array([blob.blob_name for blob in blobs], dtype=str),
+        "note": np.array([blob.note for blob in blobs], dtype=str)
+    }
+
+    return columns
+
+
+def blobsFromColumns(columns):
+    """
+    Create the blobs from a dictionary of columns (see blobsToColumns).
+    """
+
+    ids = columns["id"].tolist()
+    versions = columns["version"].tolist()
+    areas = columns["area"].tolist()
+    perimeters = columns["perimeter"].tolist()
+    centroids = columns["centroid"]
+    bboxes = columns["bbox"]
+    contour_points = columns["contour points"]
+    contour_offsets = columns["contour offsets"]
+    inner_points = columns["inner points"]
+    inner_offsets = columns["inner offsets"]
+    inner_index = columns["inner index"]
+    extreme_points = columns["deep extreme points"]
+    has_extreme_points = extreme_points.reshape(-1, 8).any(axis=1)
+    class_names = columns["class name"].tolist()
+    class_colors = columns["class color"].tolist()
+    instance_names = columns["instance name"].tolist()
+    blob_names = columns["blob name"].tolist()
+    notes = columns["note"].tolist()
+
+    blobs = []
+    for i in range(len(ids)):
+
+        blob = Blob(None, 0, 0, 0)
+
+        blob.id = ids[i]
+        blob.version = versions[i]
+        blob.area = areas[i]
+        blob.perimeter = perimeters[i]
+        blob.centroid = centroids[i].copy()
+        blob.bbox = bboxes[i].copy()
+
+        blob.contour = Blob.compactContour(contour_points[contour_offsets[i]:contour_offsets[i + 1]])
+        blob.inner_contours = [Blob.compactContour(inner_points[inner_offsets[j]:inner_offsets[j + 1]])
+                               for j in range(inner_index[i], inner_index[i + 1])]
+
+        if has_extreme_points[i]:
+            blob.deep_extreme_points = extreme_points[i].copy()
+
+        blob.class_name = class_names[i]
+        blob.class_color = class_colors[i]
+        blob.instance_name = instance_names[i]
+        blob.blob_name = blob_names[i]
+        blob.note = notes[i]
+
+        blobs.append(blob)
+
+    return blobs
+
+
+def writeProjectArchive(filename, header, annotations):
+    """
+    Write the project in the binary format.
+    header is the project (as a JSON string) without the annotations, annotations contains for each image
+    the list of its blobs or its columns (see blobsToColumns).
+    """
+
+    arrays = {}
+    arrays["header"] = np.frombuffer(header.encode("utf-8"), dtype=np.uint8)
+    arrays["version"] = np.array([BINARY_PROJECT_VERSION])
+    arrays["images"] = np.array([len(annotations)])
+
+    for i, blobs in enumerate(annotations):
+        columns = blobs if isinstance(blobs, dict) else blobsToColumns(blobs)
+        for name, column in columns.items():
+            arrays[str(i) + "/" + name] = column
+
+    # NOTE: a file object is used, otherwise NumPy appends the .npz extension to the filename
+    with open(filename, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def readProjectArchive(filename):
+    """
+    Read a project saved in the binary format. It returns (data, annotations) where data is the
+    project dictionary (without annotations) and annotations contains the columns of each image.
+    The blobs are created from the columns when needed (see blobsFromColumns).
+    """
+
+    with np.load(filename, allow_pickle=False) as archive:
+
+        version = int(archive["version"][0])
+        if version > BINARY_PROJECT_VERSION:
+            raise Exception("The project has been saved with a newer version of TagLab (binary format version " + str(version) + ").")
+
+        data = json.loads(archive["header"].tobytes().decode("utf-8"))
+
+        annotations = []
+        for i in range(int(archive["images"][0])):
+            prefix = str(i) + "/"
+            columns = {}
+            for name in archive.files:
+                if name.startswith(prefix):
+                    columns[name[len(prefix):]] = archive[name]
+            annotations.append(columns)
+
+    return (data, annotations)
+
+
+def readProjectHeader(filename):
+    """
+    Read only the project dictionary (without annotations) of a project saved in the binary format,
+    the columns of the annotations are not read.
+    """
+
+    with np.load(filename, allow_pickle=False) as archive:
+
+        version = int(archive["version"][0])
+        if version > BINARY_PROJECT_VERSION:
+            raise Exception("The project has been saved with a newer version of TagLab (binary format version " + str(version) + ").")
+
+        return json.loads(archive["header"].tobytes().decode("utf-8"))
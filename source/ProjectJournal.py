@@ -0,0 +1,221 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+# EDIT JOURNAL.
+# The edits of the annotations are appended to a sidecar file (<project>.journal, one JSON record per line)
+# as soon as they are done. Periodically the whole project is written (compacted) into a snapshot
+# (<project>_autosave.tlb) on a background thread and the journal is restarted.
+# After a crash the project is recovered by loading the last snapshot and replaying the journal on top of it.
+#
+# Each record describes the net effect of an editing step on a map:
+#   { "image": <image id>, "remove": [ids], "add": [blobs], "class": [[id, class name]] }
+# The records are idempotent (remove by id, add replaces the blob with the same id, set the class by id),
+# so replaying a journal over a snapshot that already contains part of it gives the same result.
+
+import os
+import json
+from threading import Thread, Lock
+
+from source.Blob import Blob
+from source.Project import ProjectHeaderEncoder, loadProject
+from source.ProjectArchive import blobsToColumns, writeProjectArchive
+
+
+def journalFilenames(project_filename):
+    """
+    It returns the filenames of the journal, of the journal being compacted and of the snapshot of a project.
+    """
+    base, ext = os.path.splitext(project_filename)
+    journal = base + ".journal"
+    return (journal, journal + ".compacting", base + "_autosave.tlb")
+
+
+def hasRecoveryData(project_filename):
+    """
+    Check if a project has edits not saved (a snapshot or a journal left by a crash).
+    """
+    for filename in journalFilenames(project_filename):
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            return True
+    return False
+
+
+def replayRecord(project, record):
+
+    image = project.getImageFromId(record["image"])
+    if image is None:
+        return
+
+    annotations = image.annotations
+
+    for id in record["remove"]:
+        blob = annotations.blobById(id)
+        if blob is not None:
+            annotations.removeBlob(blob)
+
+    for data in record["add"]:
+        blob = Blob(None, 0, 0, 0)
+        blob.fromDict(data)
+        existing = annotations.blobById(blob.id)
+        if existing is not None:
+            annotations.removeBlob(existing)
+        annotations.addBlob(blob)
+
+    for (id, class_name) in record["class"]:
+        blob = annotations.blobById(id)
+        if blob is not None:
+            blob.class_name = class_name
+            if class_name in project.labels:
+                blob.class_color = project.labels[class_name].fill
+
+
+def recoverProject(project_filename, labels_dict):
+    """
+    Load the last snapshot of the project (or the project itself) and replay the journal on top of it.
+    """
+    (journal, compacting, snapshot) = journalFilenames(project_filename)
+
+    if os.path.exists(snapshot):
+        project = loadProject(snapshot, labels_dict)
+    else:
+        project = loadProject(project_filename, labels_dict)
+
+    for filename in [compacting, journal]:
+        if not os.path.exists(filename):
+            continue
+        with open(filename, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last record can be truncated by the crash
+                    break
+                replayRecord(project, record)
+
+    project.filename = project_filename
+    return project
+
+
+class ProjectJournal(object):
+    """
+    Append-only journal of the edits of a project with background compaction into a snapshot.
+    The journal is written and the snapshots are taken on the GUI thread, only the (slow) writing
+    of the snapshot runs on a background thread.
+    """
+
+    def __init__(self, project_filename):
+
+        (self.filename, self.compacting_filename, self.snapshot_filename) = journalFilenames(project_filename)
+
+        self.file = None
+        self.records = 0          # records written since the last snapshot
+        self.thread = None
+        self.lock = Lock()
+
+    def open(self):
+
+        if self.file is None:
+            self.file = open(self.filename, "a")
+
+    def close(self):
+
+        self.wait()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def append(self, image, removed, added, classes):
+        """
+        Record an editing step of the given image: the blobs removed, the blobs added and
+        the list of (blob, new class name).
+        """
+        # a blob added and removed in the same step has no effect
+        removed_now = [blob for blob in removed if not any(blob is b for b in added)]
+        added_now = [blob for blob in added if not any(blob is b for b in removed)]
+
+        if len(removed_now) == 0 and len(added_now) == 0 and len(classes) == 0:
+            return
+
+        record = { "image": image.id,
+                   "remove": [blob.id for blob in removed_now],
+                   "add": [blob.toDict() for blob in added_now],
+                   "class": [[blob.id, class_name] for (blob, class_name) in classes] }
+
+        self.open()
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        self.records += 1
+
+    def isCompacting(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def wait(self):
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def compact(self, project):
+        """
+        Take an immutable snapshot of the project and write it on a background thread.
+        It returns False if there is nothing to compact or a compaction is still running.
+        """
+        if self.records == 0 or self.isCompacting():
+            return False
+
+        # snapshot: the header and the annotations are converted to JSON/arrays here, the
+        # background thread never touches the blobs (that can be edited in the meantime)
+        header = json.dumps(project.__dict__, cls=ProjectHeaderEncoder)
+        annotations = []
+        for image in project.images:
+            if not image.isHydrated() and isinstance(image.annotation_records, dict):
+                annotations.append(image.annotation_records)
+            else:
+                annotations.append(blobsToColumns(image.annotations.seg_blobs))
+
+        # the records written up to now are covered by the snapshot: a new journal is started
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.filename):
+            os.replace(self.filename, self.compacting_filename)
+        self.records = 0
+
+        self.thread = Thread(target=self.writeSnapshot, args=(header, annotations), daemon=True)
+        self.thread.start()
+        return True
+
+    def writeSnapshot(self, header, annotations):
+
+        with self.lock:
+            temp_filename = self.snapshot_filename + ".tmp"
+            writeProjectArchive(temp_filename, header, annotations)
+            os.replace(temp_filename, self.snapshot_filename)
+            if os.path.exists(self.compacting_filename):
+                os.remove(self.compacting_filename)
+
+    def discard(self):
+        """
+        Remove the journal and the snapshot (e.g. after the project has been saved).
+        """
+        self.close()
+        self.records = 0
+        for filename in [self.filename, self.compacting_filename, self.snapshot_filename]:
+            if os.path.exists(filename):
+                os.remove(filename)
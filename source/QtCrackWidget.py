@@ -23,6 +23,7 @@ from PyQt5.QtWidgets import QWidget, QDialog, QSizePolicy, QSlider, QLabel, QPus
 from source.QtImageViewer import QtImageViewer
 from skimage.color import rgb2gray
 from source import utils
+from source.ConversionUtils import mask2qimage, qimage2ndarray
 
 class QtCrackWidget(QWidget):
 
@@ -34,7 +35,7 @@ class QtCrackWidget(QWidget):
         self.setStyleSheet("background-color: rgb(60,60,65); color: white")
 
         self.qimg_cropped = utils.cropQImage(map, blob.bbox)
-        arr = utils.qimageToNumpyArray(self.qimg_cropped)
+        arr = qimage2ndarray(self.qimg_cropped)
         self.input_arr = rgb2gray(arr) * 255
         self.tolerance = 20
         self.annotations = annotations
@@ -125,7 +126,7 @@ class QtCrackWidget(QWidget):
 
         arr = self.input_arr.copy()
         mask_crack = self.annotations.createCrack(self.blob, arr, self.xmap, self.ymap, self.tolerance, preview=True)
-        self.qimg_crack = utils.maskToQImage(mask_crack)
+        self.qimg_crack = mask2qimage(mask_crack)
         self.viewer.setOpacity(0.5)
         self.viewer.setOverlayImage(self.qimg_crack)
 
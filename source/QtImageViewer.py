@@ -1,14 +1,23 @@
 import os.path
 from PyQt5.QtCore import Qt, QPointF, QRectF, QFileInfo, QDir, pyqtSlot, pyqtSignal, QT_VERSION_STR
-from PyQt5.QtGui import QImage, QPixmap, QPainter, QPainterPath, QPen, QImageReader
+from PyQt5.QtGui import QImage, QPixmap, QPainter, QPainterPath, QPen, QImageReader, QTransform
 from PyQt5.QtWidgets import QApplication, QGraphicsView, QGraphicsScene, QFileDialog, QGraphicsPixmapItem
 
+from source.ImagePyramid import TiledImage
+from source.TileLoader import TileLoader
+
 class QtImageViewer(QGraphicsView):
     """
     PyQt image viewer widget w
     QGraphicsView handles a scene composed by an image plus shapes (rectangles, polygons, blobs).
     The input image (it must be a QImage) is internally converted into a QPixmap.
+    Large maps (TiledImage) are drawn by tiles: only the tiles of the pyramid level suitable for the current
+    zoom that intersect the viewport are in the scene. The tiles are loaded in background, until they
+    arrive the overview of the map (the smallest level of the pyramid) is visible in their place.
     """
+    # larger overlays are shown at a lower resolution (a QPixmap cannot exceed 32767 pixels per side)
+    OVERLAY_MAX_SIZE = 8192
+
     viewUpdated = pyqtSignal(QRectF)       #region visible in percentage
     viewHasChanged = pyqtSignal(float, float, float) #posx, posy, posz
 
@@ -24,7 +33,20 @@ class QtImageViewer(QGraphicsView):
         self.pixmapitem.setZValue(0)
         self.scene.addItem(self.pixmapitem)
 
+        # the overlay is drawn over the whole map, above the map (and its tiles) and below the blobs
+        self.overlay_item = QGraphicsPixmapItem()
+        self.overlay_item.setZValue(0.5)
+        self.scene.addItem(self.overlay_item)
+
         self.img_map = None
+
+        # tiled visualization
+        self.pyramid = None
+        self.tile_items = {}    # (level, tx, ty) -> QGraphicsPixmapItem
+        self.visible_tiles = set()
+        self.tile_loader = TileLoader()
+        self.tile_loader.tileLoaded.connect(self.addTile)
+
         # current image size
         self.imgwidth = 0
         self.imgheight = 0
@@ -72,22 +94,35 @@ class QtImageViewer(QGraphicsView):
         """
 
         self.img_map = img
+        self.clearOverlayImage()
         if type(img) is QImage:
+            self.setPyramid(None)
             imageARGB32 = img.convertToFormat(QImage.Format_ARGB32)
             self.pixmap = QPixmap.fromImage(imageARGB32)
             self.imgwidth = img.width()
             self.imgheight = img.height()
+            self.pixmapitem.setScale(1.0)
+            self.pixmapitem.setZValue(0)
+            self.pixmapitem.setPixmap(self.pixmap)
+        elif type(img) is TiledImage:
+            # the pixmap is the overview (smallest level) of the pyramid, it is drawn below the tiles as placeholder
+            self.setPyramid(img.pyramid)
+            last = self.pyramid.levelCount() - 1
+            self.pixmap = QPixmap.fromImage(self.pyramid.tileImage(last, 0, 0))
+            self.imgwidth = img.width()
+            self.imgheight = img.height()
+            self.pixmapitem.setScale(2 ** last)
+            self.pixmapitem.setZValue(-1)
+            self.pixmapitem.setPixmap(self.pixmap)
         else:
             raise RuntimeError("Argument must be a QImage.")
 
-        self.pixmapitem.setPixmap(self.pixmap)
-
         if zoomf < 0.0000001:
 
             # calculate zoom factor
 
             # Set scene size to image size (!)
-            self.setSceneRect(QRectF(self.pixmap.rect()))
+            self.setSceneRect(QRectF(0, 0, self.imgwidth, self.imgheight))
 
             # calculate zoom factor
             pixels_of_border = 10
@@ -103,6 +138,7 @@ class QtImageViewer(QGraphicsView):
     def viewChanged(self):
         if not self.imgwidth:
             return
+        self.updateTiles()
         rect = self.viewportToScenePercent()
         self.viewUpdated.emit(rect)
         posx = self.horizontalScrollBar().value() 
@@ -126,10 +162,80 @@ class QtImageViewer(QGraphicsView):
         """
         self.resetTransform()
         self.scale(self.zoom_factor, self.zoom_factor)
+        self.updateTiles()
         self.invalidateScene()
 
+    def updateTiles(self):
+        """
+        Keep in the scene only the tiles of the pyramid intersecting the viewport at the level given by the zoom.
+        """
+        if self.pyramid is None:
+            return
+
+        level = self.pyramid.levelForZoom(self.zoom_factor)
+        scale = 2 ** level
+        size = self.pyramid.tile_size * scale     # size of a tile in scene coordinates
+        (ntx, nty) = self.pyramid.tileCount(level)
+
+        view = self.viewportToScene()
+        tx1 = max(int(view.left() // size), 0)
+        ty1 = max(int(view.top() // size), 0)
+        tx2 = min(int(view.right() // size), ntx - 1)
+        ty2 = min(int(view.bottom() // size), nty - 1)
+
+        self.visible_tiles = set((level, tx, ty) for ty in range(ty1, ty2 + 1) for tx in range(tx1, tx2 + 1))
+
+        for key in list(self.tile_items.keys()):
+            if key not in self.visible_tiles:
+                self.scene.removeItem(self.tile_items.pop(key))
+
+        # the cached tiles are added immediately, the others are loaded in background (see addTile)
+        missing = []
+        for key in self.visible_tiles:
+            if key not in self.tile_items:
+                if self.tile_loader.tile(key) is not None:
+                    self.addTile(key)
+                else:
+                    missing.append(key)
+
+        self.tile_loader.request(missing)
+
+    @pyqtSlot(object)
+    def addTile(self, key):
+
+        if self.pyramid is None or key not in self.visible_tiles or key in self.tile_items:
+            return
+
+        pixmap = self.tile_loader.tile(key)
+        if pixmap is None:
+            return
+
+        (level, tx, ty) = key
+        scale = 2 ** level
+        item = QGraphicsPixmapItem(pixmap)
+        item.setPos(tx * self.pyramid.tile_size * scale, ty * self.pyramid.tile_size * scale)
+        item.setScale(scale)
+        item.setZValue(0)
+        self.scene.addItem(item)
+        self.tile_items[key] = item
+
+    def setPyramid(self, pyramid):
+
+        self.clearTiles()
+        self.pyramid = pyramid
+        self.tile_loader.setPyramid(pyramid)
+
+    def clearTiles(self):
+
+        for item in self.tile_items.values():
+            self.scene.removeItem(item)
+        self.tile_items = {}
+        self.visible_tiles = set()
+
     def clear(self):
         self.pixmapitem.setPixmap(QPixmap())
+        self.clearOverlayImage()
+        self.setPyramid(None)
         self.img_map = None
 
     def disableScrollBars(self):
@@ -175,24 +281,29 @@ class QtImageViewer(QGraphicsView):
         # UNUSED
     def setOpacity(self, opacity):
         self.opacity = opacity
+        self.overlay_item.setOpacity(opacity)
 
     def setOverlayImage(self, image):
         self.overlay_image = image.convertToFormat(QImage.Format_ARGB32)
         self.drawOverlayImage()
 
+    def clearOverlayImage(self):
+        self.overlay_image = QImage(1, 1, QImage.Format_ARGB32)
+        self.overlay_item.setPixmap(QPixmap())
+
     def drawOverlayImage(self):
 
         if self.overlay_image.width() <= 1:
             return
 
-        pxmap = self.pixmap.copy()
-        p = QPainter()
-        p.begin(pxmap)
-        p.setOpacity(self.opacity)
-        p.drawImage(0, 0, self.overlay_image)
-        p.end()
+        overlay = self.overlay_image
+        if max(overlay.width(), overlay.height()) > self.OVERLAY_MAX_SIZE:
+            overlay = overlay.scaled(self.OVERLAY_MAX_SIZE, self.OVERLAY_MAX_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
 
-        self.pixmapitem.setPixmap(pxmap)
+        # the overlay is stretched over the map (its own pixmap item, so it works also for the tiled maps)
+        self.overlay_item.setPixmap(QPixmap.fromImage(overlay))
+        self.overlay_item.setTransform(QTransform.fromScale(self.imgwidth / overlay.width(), self.imgheight / overlay.height()))
+        self.overlay_item.setOpacity(self.opacity)
 
 
 
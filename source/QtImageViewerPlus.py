@@ -98,6 +98,8 @@ class QtImageViewerPlus(QtImageViewer):
         self.tools.createTools()
 
         self.undo_data = Undo()
+        self.pending_undo = {}  # undo data of the images edited while not shown (see addBlobsToImage)
+        self.journal = None    # edit journal of the project (see ProjectJournal), set by TagLab
 
         self.dragSelectionStart = None
         self.dragSelectionRect = None
@@ -130,6 +132,11 @@ class QtImageViewerPlus(QtImageViewer):
     def setProject(self, project):
 
         self.project = project
+        self.pending_undo = {}
+
+    def setJournal(self, journal):
+
+        self.journal = journal
 
     def setImage(self, image, channel_idx=0):
         """
@@ -142,6 +149,10 @@ class QtImageViewerPlus(QtImageViewer):
         self.annotations = image.annotations
         self.selected_blobs = []
 
+        # the edits done while the image was not shown can be undone
+        if image in self.pending_undo:
+            self.undo_data = self.pending_undo.pop(image)
+
         for blob in self.annotations.seg_blobs:
             self.drawBlob(blob)
 
@@ -446,14 +457,10 @@ class QtImageViewerPlus(QtImageViewer):
         sx = self.dragSelectionStart[0]
         sy = self.dragSelectionStart[1]
         self.resetSelection()
-        for blob in self.annotations.seg_blobs:
+        for blob in self.annotations.blobsInsideBox(sy, sx, x - sx, y - sy):
             visible = self.project.isLabelVisible(blob.class_name)
             if not visible:
                 continue
-            box = blob.bbox
-
-            if sx > box[1] or sy > box[0] or x < box[1] + box[2] or y < box[0] + box[3]:
-                continue
             self.addToSelectedList(blob)
 
     @pyqtSlot(str)
@@ -578,8 +585,40 @@ class QtImageViewerPlus(QtImageViewer):
 #UNDO STUFF
 
     def saveUndo(self):
+        operation = self.undo_data.operation
+        self.journalStep(operation['add'], operation['remove'], operation['newclass'])
         self.undo_data.saveUndo()
 
+    def journalStep(self, removed, added, classes, image=None):
+        """
+        Append an editing step to the journal of the project (the undo data stores the blobs added
+        in 'remove' and the blobs removed in 'add', since they are the operations that revert the step).
+        """
+        if image is None:
+            image = self.image
+        if self.journal is not None and image is not None:
+            self.journal.append(image, removed, added, classes)
+
+    def addBlobsToImage(self, image, blobs):
+        """
+        Add blobs to an image as a single editing step (e.g. the results of the automatic classification).
+        If the image is not the one shown the step is journaled and its undo data is kept until the image is shown.
+        """
+        if image is self.image:
+            for blob in blobs:
+                self.addBlob(blob, selected=False)
+            self.saveUndo()
+            return
+
+        undo_data = self.pending_undo.setdefault(image, Undo())
+        for blob in blobs:
+            undo_data.addBlob(blob)
+            image.annotations.addBlob(blob)
+
+        operation = undo_data.operation
+        self.journalStep(operation['add'], operation['remove'], operation['newclass'], image)
+        undo_data.saveUndo()
+
     def undo(self):
         operation = self.undo_data.undo()
         if operation is None:
@@ -604,6 +643,8 @@ class QtImageViewerPlus(QtImageViewer):
             brush = self.project.classBrushFromName(blob)
             blob.qpath_gitem.setBrush(brush)
 
+        self.journalStep(operation['remove'], operation['add'], operation['class'])
+
         self.updateVisibility()
 
     def redo(self):
@@ -630,5 +671,7 @@ class QtImageViewerPlus(QtImageViewer):
             brush = self.project.classBrushFromName(blob)
             blob.qpath_gitem.setBrush(brush)
 
+        self.journalStep(operation['add'], operation['remove'], operation['newclass'])
+
         self.updateVisibility()
 
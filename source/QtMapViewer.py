@@ -22,7 +22,7 @@
 
 from PyQt5.QtCore import Qt, QRectF, pyqtSignal, pyqtSlot
 from PyQt5.QtGui import QImage, QPixmap, QPainter, QBrush, QPen, QColor, qRgb, qRgba, qRed, qGreen, qBlue
-from PyQt5.QtWidgets import QGraphicsView, QGraphicsScene
+from PyQt5.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsRectItem
 
 
 class QtMapViewer(QGraphicsView):
@@ -80,8 +80,7 @@ class QtMapViewer(QGraphicsView):
         self.HIGHLIGHT_RECT_WIDTH = 10
         self.HIGHLIGHT_RECT_HEIGHT = 10
         self.HIGHLIGHT_COLOR = QColor(200, 200, 200)
-        self.overlay_image = QImage(self.HIGHLIGHT_RECT_WIDTH, self.HIGHLIGHT_RECT_HEIGHT, QImage.Format_ARGB32)
-        self.overlay_image.fill(self.HIGHLIGHT_COLOR)
+        self.highlight_item = None
 
         self.setFixedWidth(self.THUMB_SIZE)
         self.setFixedHeight(self.THUMB_SIZE)
@@ -99,6 +98,8 @@ class QtMapViewer(QGraphicsView):
 
     def clear(self):
         self.initPixmapItem()
+        if self.highlight_item is not None:
+            self.highlight_item.setVisible(False)
 
     def setPixmap(self, pixmap):
         if pixmap is None:
@@ -190,6 +191,10 @@ class QtMapViewer(QGraphicsView):
     #     self.setImage(image)
     @pyqtSlot(QRectF)
     def drawOverlayImage(self, rect):
+        """
+        Highlight the visible region (given in percentage of the map). A rectangle item is moved over
+        the thumbnail, the pixmap is never copied.
+        """
 
         W = self.pixmap.width()
         H = self.pixmap.height()
@@ -198,18 +203,18 @@ class QtMapViewer(QGraphicsView):
         self.HIGHLIGHT_RECT_HEIGHT = rect.height() * H
         self.HIGHLIGHT_RECT_POSX = rect.left() * W
         self.HIGHLIGHT_RECT_POSY = rect.top() * H
-        self.overlay_image = QImage(self.HIGHLIGHT_RECT_WIDTH, self.HIGHLIGHT_RECT_HEIGHT, QImage.Format_ARGB32)
-        self.overlay_image.fill(self.HIGHLIGHT_COLOR)
-
-        if self.overlay_image.width() > 1:
-            pxmap = self.pixmap.copy()
-            p = QPainter()
-            p.begin(pxmap)
-            p.setOpacity(self.opacity)
-            p.drawImage(self.HIGHLIGHT_RECT_POSX, self.HIGHLIGHT_RECT_POSY, self.overlay_image)
-            p.end()
-
-            self.pixmapitem.setPixmap(pxmap)
+
+        if self.highlight_item is None:
+            self.highlight_item = QGraphicsRectItem()
+            self.highlight_item.setPen(QPen(Qt.NoPen))
+            self.highlight_item.setBrush(QBrush(self.HIGHLIGHT_COLOR))
+            self.highlight_item.setZValue(1)
+            self.scene.addItem(self.highlight_item)
+
+        self.highlight_item.setOpacity(self.opacity)
+        self.highlight_item.setRect(self.HIGHLIGHT_RECT_POSX, self.HIGHLIGHT_RECT_POSY,
+                                    self.HIGHLIGHT_RECT_WIDTH, self.HIGHLIGHT_RECT_HEIGHT)
+        self.highlight_item.setVisible(self.HIGHLIGHT_RECT_WIDTH > 1)
 
     def updateViewer(self):
         """ Show current zoom (if showing entire image, apply current aspect ratio mode).
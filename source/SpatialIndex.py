@@ -0,0 +1,146 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+
+class SpatialIndex(object):
+    """
+    Uniform grid over the bounding boxes of the blobs.
+    Each cell stores the blobs whose bbox overlaps it, so point and box queries only need
+    to test a few candidates instead of all the blobs of the map.
+    NOTE: the candidates returned are based on the bbox only, the caller must perform the exact test.
+    """
+
+    def __init__(self, cell_size=256):
+
+        self.cell_size = cell_size
+
+        # (cell_x, cell_y) -> list of blobs
+        self.cells = {}
+
+        # blob -> range of cells (cx1, cy1, cx2, cy2) where it is stored
+        self.blob_cells = {}
+
+    def cellRange(self, top, left, width, height):
+
+        cs = self.cell_size
+        cx1 = int(left) // cs
+        cy1 = int(top) // cs
+        cx2 = int(left + width) // cs
+        cy2 = int(top + height) // cs
+        return (cx1, cy1, cx2, cy2)
+
+    def insert(self, blob):
+
+        if blob in self.blob_cells:
+            self.remove(blob)
+
+        # BBOX ->  TOP, LEFT, WIDTH, HEIGHT
+        box = blob.bbox
+        cell_range = self.cellRange(box[0], box[1], box[2], box[3])
+        (cx1, cy1, cx2, cy2) = cell_range
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                self.cells.setdefault((cx, cy), []).append(blob)
+
+        self.blob_cells[blob] = cell_range
+
+    def remove(self, blob):
+
+        cell_range = self.blob_cells.pop(blob, None)
+        if cell_range is None:
+            return
+
+        (cx1, cy1, cx2, cy2) = cell_range
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is None:
+                    continue
+                cell.remove(blob)
+                if len(cell) == 0:
+                    del self.cells[(cx, cy)]
+
+    def update(self, blob):
+        """
+        Re-index a blob whose geometry has changed. Blobs not indexed are ignored.
+        """
+        if blob in self.blob_cells:
+            self.insert(blob)
+
+    def clear(self):
+
+        self.cells = {}
+        self.blob_cells = {}
+
+    def __contains__(self, blob):
+        return blob in self.blob_cells
+
+    def queryPoint(self, x, y):
+        """
+        Return the blobs whose bbox contains the point (x, y).
+        """
+        cs = self.cell_size
+        cell = self.cells.get((int(x) // cs, int(y) // cs))
+        if cell is None:
+            return []
+
+        candidates = []
+        for blob in cell:
+            box = blob.bbox
+            if box[1] <= x <= box[1] + box[2] and box[0] <= y <= box[0] + box[3]:
+                candidates.append(blob)
+        return candidates
+
+    def queryBox(self, top, left, width, height):
+        """
+        Return the blobs whose bbox intersects the given box (top, left, width, height).
+        """
+        (cx1, cy1, cx2, cy2) = self.cellRange(top, left, width, height)
+
+        bottom = top + height
+        right = left + width
+
+        found = set()
+        candidates = []
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is None:
+                    continue
+                for blob in cell:
+                    if id(blob) in found:
+                        continue
+                    found.add(id(blob))
+                    box = blob.bbox
+                    if box[1] > right or box[1] + box[2] < left or box[0] > bottom or box[0] + box[3] < top:
+                        continue
+                    candidates.append(blob)
+        return candidates
+
+    def queryInsideBox(self, top, left, width, height):
+        """
+        Return the blobs whose bbox is entirely contained in the given box (top, left, width, height).
+        """
+        candidates = []
+        for blob in self.queryBox(top, left, width, height):
+            box = blob.bbox
+            if box[1] < left or box[0] < top or box[1] + box[2] > left + width or box[0] + box[3] > top + height:
+                continue
+            candidates.append(blob)
+        return candidates
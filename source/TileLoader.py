@@ -0,0 +1,149 @@
+# TagLab
+# A semi-automatic segmentation tool
+#
+# Copyright(C) 2020
+# Visual Computing Lab
+# ISTI - Italian National Research Council
+# All rights reserved.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License (http://www.gnu.org/licenses/gpl.txt)
+# for more details.
+
+from threading import Lock
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QImage, QPixmap
+
+from source.LRUCache import LRUCache
+
+
+class TileTask(QRunnable):
+    """
+    Read a tile of the pyramid on a thread of the pool (QImage can be created outside the GUI thread, QPixmap cannot).
+    """
+
+    def __init__(self, loader, generation, pyramid, key):
+        QRunnable.__init__(self)
+        self.loader = loader
+        self.generation = generation
+        self.pyramid = pyramid
+        self.key = key
+
+    def run(self):
+        if not self.loader.startTask(self):
+            return
+        (level, tx, ty) = self.key
+        qimg = self.pyramid.tileImage(level, tx, ty)
+        self.loader.loaded.emit(self.generation, self.key, qimg)
+
+
+class TileLoader(QObject):
+    """
+    Load the tiles of a pyramid on a background thread pool. The loaded tiles are kept (as QPixmap)
+    in a LRU cache bounded in bytes, tileLoaded is emitted (on the GUI thread) when a requested tile is ready.
+    """
+
+    tileLoaded = pyqtSignal(object)
+
+    # internal: emitted by the workers, delivered on the GUI thread
+    loaded = pyqtSignal(int, object, QImage)
+
+    def __init__(self, max_threads=4, max_bytes=256*1024*1024, parent=None):
+        QObject.__init__(self, parent)
+
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_threads)
+
+        self.cache = LRUCache(max_bytes=max_bytes)
+
+        self.pyramid = None
+        self.generation = 0     # incremented when the pyramid changes, the tiles of the previous one are ignored
+        self.pending = set()    # tiles requested and not loaded yet (tileLoaded is emitted for them)
+        self.queued = {}        # tasks waiting for a thread of the pool, by tile
+        self.running = set()    # tiles being read by a thread of the pool
+        self.lock = Lock()
+
+        self.loaded.connect(self.onLoaded)
+
+    def setPyramid(self, pyramid):
+
+        with self.lock:
+            self.pool.clear()
+            self.pending = set()
+            self.queued = {}
+            self.running = set()
+            self.generation += 1
+            self.pyramid = pyramid
+
+    def cacheKey(self, key):
+        return (self.pyramid.cache_dir,) + tuple(key)
+
+    def tile(self, key):
+        """
+        It returns the pixmap of the tile (level, tx, ty) if it has been loaded, None otherwise.
+        """
+        if self.pyramid is None:
+            return None
+        return self.cache.get(self.cacheKey(key))
+
+    def request(self, keys):
+        """
+        Load the given tiles. The requests not started yet that are not in the list are dropped,
+        the tiles already being read are not requested again.
+        """
+        with self.lock:
+            self.pool.clear()
+            self.queued = {}
+            self.pending = set(key for key in self.pending if key in self.running)
+
+            if self.pyramid is None:
+                return
+
+            for key in keys:
+                if key in self.pending or self.tile(key) is not None:
+                    continue
+                self.pending.add(key)
+                if key not in self.running:
+                    task = TileTask(self, self.generation, self.pyramid, key)
+                    self.queued[key] = task
+                    self.pool.start(task)
+
+    def startTask(self, task):
+        """
+        Called by a task when a thread of the pool picks it up. It returns False if the task has been dropped
+        in the meantime (a task can start while request is clearing the pool).
+        """
+        with self.lock:
+            if task.generation != self.generation or self.queued.get(task.key) is not task:
+                return False
+            del self.queued[task.key]
+            self.running.add(task.key)
+            return True
+
+    @pyqtSlot(int, object, QImage)
+    def onLoaded(self, generation, key, qimg):
+
+        if generation != self.generation:
+            return
+
+        pixmap = QPixmap.fromImage(qimg)
+        self.cache.put(self.cacheKey(key), pixmap, size=4 * pixmap.width() * pixmap.height())
+
+        with self.lock:
+            self.running.discard(key)
+            emit = key in self.pending
+            self.pending.discard(key)
+
+        if emit:
+            self.tileLoaded.emit(key)
+
+    def wait(self):
+        self.pool.waitForDone()
@@ -1,11 +1,15 @@
-from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot
 
 from source.tools.Tool import Tool
 from source import utils
+from source.ConversionUtils import floatmap2qimage
+from source.ModelRegistry import modelRegistry
 
 import os
+import time
+import cv2
 import numpy as np
+from threading import Thread, Lock
 
 try:
     import torch
@@ -18,15 +22,116 @@ import models.deeplab_resnet as resnet
 from models.dataloaders import helpers as helpers
 from collections import OrderedDict
 
+# key of the DEXTR network in the registry of the networks
+DEEPEXTREME_MODEL = "dextr_corals"
+
+
+def loadDeepExtremeNetwork():
+    """
+    Create the DEXTR network and load its weights (on the GPU, if available).
+    """
+    #  Create the network and load the weights
+    deepextreme_net = resnet.resnet101(1, nInputChannels=4, classifier='psp')
+
+    models_dir = "models/"
+
+    # dictionary layers' names - weights
+    state_dict_checkpoint = torch.load(os.path.join(models_dir, DEEPEXTREME_MODEL + '.pth'),
+                                       map_location=lambda storage, loc: storage)
+
+    # Remove the prefix .module from the model when it is trained using DataParallel
+    if 'module.' in list(state_dict_checkpoint.keys())[0]:
+        new_state_dict = OrderedDict()
+        for k, v in state_dict_checkpoint.items():
+            name = k[7:]  # remove `module.` from multi-gpu training
+            new_state_dict[name] = v
+    else:
+        new_state_dict = state_dict_checkpoint
+
+    deepextreme_net.load_state_dict(new_state_dict)
+    deepextreme_net.eval()
+    if not torch.cuda.is_available():
+        print("CUDA NOT AVAILABLE!")
+
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    deepextreme_net.to(device)
+
+    return deepextreme_net
+
+
+def extremeHeatmap(height, width, points, sigma=10):
+    """
+    Heatmap of the extreme points (float32), maximum of the Gaussians centered on the points normalized
+    between 0 and 255 (as helpers.make_gt + helpers.cstm_normalize). The Gaussians are separable, so each one
+    is the outer product of two vectors.
+    """
+    x = np.arange(width, dtype=np.float32)
+    y = np.arange(height, dtype=np.float32)
+    k = np.float32(-4.0 * np.log(2.0) / sigma ** 2)
+
+    heatmap = np.zeros((height, width), dtype=np.float32)
+    for (x0, y0) in points:
+        gx = np.exp(k * (x - x0) ** 2)
+        gy = np.exp(k * (y - y0) ** 2)
+        np.maximum(heatmap, np.outer(gy, gx), out=heatmap)
+
+    min_value = heatmap.min()
+    heatmap -= min_value
+    heatmap *= 255.0 / max(heatmap.max(), 1e-8)
+    return heatmap
+
+
+def predictionToMask(pred, bbox, im_size, relax, thres):
+    """
+    Segmentation mask (uint8) of the cropped image from the prediction of the network, it gives the same result
+    of helpers.crop2fullmask(..., zero_pad=True, relax=relax) > thres but only the bounding box is resized
+    and thresholded (float32), without full size floating point buffers.
+    """
+    (h, w) = im_size
+    mask = np.zeros((h, w), dtype=np.uint8)
+
+    # bounding box of the mask (reduced by relax) clipped to the image
+    x1 = max(bbox[0] + relax, 0)
+    y1 = max(bbox[1] + relax, 0)
+    x2 = min(bbox[2] - relax, w - 1)
+    y2 = min(bbox[3] - relax, h - 1)
+    if x2 < x1 or y2 < y1:
+        return mask
+
+    crop = cv2.resize(pred.astype(np.float32), (int(bbox[2] - bbox[0] + 1), int(bbox[3] - bbox[1] + 1)),
+                      interpolation=cv2.INTER_CUBIC)
+    mask[y1:y2 + 1, x1:x2 + 1] = crop[y1 - bbox[1]:y2 - bbox[1] + 1, x1 - bbox[0]:x2 - bbox[0] + 1] > thres
+
+    return mask
+
 
 class DeepExtreme(Tool):
+
+    # segmentations run together in a single forward pass (at most)
+    MAX_BATCH_SIZE = 8
+
+    # diagnostic: save the predictions of the network (temp/dextr_prediction_<n>.png)
+    DIAGNOSTICS = False
+
+    # internal: emitted by the worker thread when a batch has been segmented, delivered on the GUI thread
+    batchSegmented = pyqtSignal(object)
+
     def __init__(self, viewerplus, pick_points):
         super(DeepExtreme, self).__init__(viewerplus)
         self.pick_points = pick_points
 
         self.CROSS_LINE_WIDTH = 2
         self.pick_style = {'width': self.CROSS_LINE_WIDTH, 'color': Qt.red,  'size': 6}
-        self.deepextreme_net = None
+
+        # the four points picked are queued and segmented in background, the sets of points
+        # queued while the network is running are segmented together in the next batch
+        self.queue = []
+        self.queue_lock = Lock()
+        self.worker = None
+
+        self.diagnostics_counter = 0
+
+        self.batchSegmented.connect(self.addSegmentations)
 
     def leftPressed(self, x, y, mods):
         points = self.pick_points.points
@@ -43,19 +148,29 @@ class DeepExtreme(Tool):
 
 
     def segmentWithDeepExtreme(self):
-        QApplication.setOverrideCursor(Qt.WaitCursor)
-        self.infoMessage.emit("Segmentation is ongoing..")
+        """
+        Queue the segmentation of the four points picked, the annotator can pick the next ones without waiting.
+        """
         self.log.emit("[TOOL][DEEPEXTREME] Segmentation begins..")
 
-        self.loadNetwork()
+        extreme_points_to_use = np.asarray(self.pick_points.points).astype(int)
+        job = self.prepareInput(extreme_points_to_use)
+
+        with self.queue_lock:
+            self.queue.append(job)
+            queued = len(self.queue)
+            if self.worker is None:
+                self.worker = Thread(target=self.processQueue, daemon=True)
+                self.worker.start()
 
+        self.infoMessage.emit("Segmentation is ongoing.. (" + str(queued) + " queued)")
+
+    def prepareInput(self, extreme_points_to_use):
+        """
+        Crop the map around the extreme points and create the input of the network (RGB + heatmap of the points).
+        """
         pad = 50
-        thres = 0.8
-        gpu_id = 0
-        device = torch.device("cuda:" + str(gpu_id) if torch.cuda.is_available() else "cpu")
-        self.deepextreme_net.to(device)
 
-        extreme_points_to_use = np.asarray(self.pick_points.points).astype(int)
         pad_extreme = 100
         left_map_pos = extreme_points_to_use[:, 0].min() - pad_extreme
         top_map_pos = extreme_points_to_use[:, 1].min() - pad_extreme
@@ -64,100 +179,172 @@ class DeepExtreme(Tool):
         height_extreme_points = extreme_points_to_use[:, 1].max() - extreme_points_to_use[:, 1].min()
         area_extreme_points = width_extreme_points * height_extreme_points
 
-        (img, extreme_points_new) = utils.prepareForDeepExtreme(self.viewerplus.img_map, extreme_points_to_use, pad_extreme)
-
-        with torch.no_grad():
+        start = time.perf_counter()
 
-            extreme_points_ori = extreme_points_new.astype(int)
+        (img, extreme_points_new) = utils.prepareForDeepExtreme(self.viewerplus.img_map, extreme_points_to_use, pad_extreme)
 
-            #  Crop image to the bounding box from the extreme points and resize
-            bbox = helpers.get_bbox(img, points=extreme_points_ori, pad=pad, zero_pad=True)
-            crop_image = helpers.crop_from_bbox(img, bbox, zero_pad=True)
-            resize_image = helpers.fixed_resize(crop_image, (512, 512)).astype(np.float32)
+        extreme_points_ori = extreme_points_new.astype(int)
+
+        #  Crop image to the bounding box from the extreme points and resize
+        bbox = helpers.get_bbox(img, points=extreme_points_ori, pad=pad, zero_pad=True)
+        crop_image = helpers.crop_from_bbox(img, bbox, zero_pad=True)
+        resize_image = helpers.fixed_resize(crop_image, (512, 512)).astype(np.float32)
+
+        #  Generate extreme point heat map normalized to image values
+        extreme_points = extreme_points_ori - [np.min(extreme_points_ori[:, 0]),
+                                               np.min(extreme_points_ori[:, 1])] + [pad, pad]
+
+        # remap the input points inside the 512 x 512 cropped box
+        extreme_points = (512 * extreme_points * [1 / crop_image.shape[1], 1 / crop_image.shape[0]]).astype(int)
+
+        crop_time = time.perf_counter()
+
+        #  Concatenate inputs (channels first): RGB + heatmap of the points
+        input_dextr = np.empty((4, 512, 512), dtype=np.float32)
+        input_dextr[0:3] = resize_image.transpose((2, 0, 1))
+        input_dextr[3] = extremeHeatmap(512, 512, extreme_points, sigma=10)
+
+        heatmap_time = time.perf_counter()
+
+        return { "input": input_dextr,
+                 "latency": { "crop": crop_time - start, "heatmap": heatmap_time - crop_time },
+                 "bbox": bbox,
+                 "image size": img.shape[:2],
+                 "map position": (left_map_pos, top_map_pos),
+                 "area": area_extreme_points,
+                 "points": extreme_points_to_use,
+                 "image": self.viewerplus.image }
+
+    def processQueue(self):
+        """
+        Worker thread: it segments the queued inputs in batches until the queue is empty.
+        """
+        while True:
+            with self.queue_lock:
+                jobs = self.queue[:DeepExtreme.MAX_BATCH_SIZE]
+                self.queue = self.queue[DeepExtreme.MAX_BATCH_SIZE:]
+                if len(jobs) == 0:
+                    self.worker = None
+                    return
+
+            try:
+                (preds, latency) = self.segmentBatch(jobs)
+                self.batchSegmented.emit((jobs, preds, latency, None))
+            except Exception as e:
+                self.batchSegmented.emit((jobs, None, None, str(e)))
+
+    def segmentBatch(self, jobs):
+        """
+        Run the network on a batch of inputs, it returns the predictions (probabilities, N x 512 x 512, float32)
+        and the time spent by the forward pass and by the upsampling.
+        """
+        deepextreme_net = modelRegistry().get(DEEPEXTREME_MODEL, loadDeepExtremeNetwork)
 
-            #  Generate extreme point heat map normalized to image values
-            extreme_points = extreme_points_ori - [np.min(extreme_points_ori[:, 0]),
-                                                   np.min(extreme_points_ori[:, 1])] + [pad, pad]
+        gpu_id = 0
+        use_cuda = torch.cuda.is_available()
+        device = torch.device("cuda:" + str(gpu_id) if use_cuda else "cpu")
 
-            # remap the input points inside the 512 x 512 cropped box
-            extreme_points = (512 * extreme_points * [1 / crop_image.shape[1], 1 / crop_image.shape[0]]).astype(
-                np.int)
+        with torch.no_grad():
 
-            # create the heatmap
-            extreme_heatmap = helpers.make_gt(resize_image, extreme_points, sigma=10)
-            extreme_heatmap = helpers.cstm_normalize(extreme_heatmap, 255)
+            inputs = torch.from_numpy(np.stack([job["input"] for job in jobs]))
 
-            #  Concatenate inputs and convert to tensor
-            input_dextr = np.concatenate((resize_image, extreme_heatmap[:, :, np.newaxis]), axis=2)
-            inputs = torch.from_numpy(input_dextr.transpose((2, 0, 1))[np.newaxis, ...])
+            start = time.perf_counter()
 
             # Run a forward pass
             inputs = inputs.to(device)
-            outputs = self.deepextreme_net.forward(inputs)
+            outputs = deepextreme_net.forward(inputs)
+            if use_cuda:
+                torch.cuda.synchronize()
+
+            forward_time = time.perf_counter()
+
             outputs = upsample(outputs, size=(512, 512), mode='bilinear', align_corners=True)
-            outputs = outputs.to(torch.device('cpu'))
+            preds = torch.sigmoid(outputs[:, 0]).to(torch.device('cpu')).numpy()
+
+            upsample_time = time.perf_counter()
+
+        return (preds, { "forward": forward_time - start, "upsample": upsample_time - forward_time })
+
+    @pyqtSlot(object)
+    def addSegmentations(self, results):
+        """
+        Create the blobs of a batch of segmentations, the whole batch is a single undo step.
+        """
+        (jobs, preds, latency, error) = results
+
+        if error is not None:
+            self.infoMessage.emit("Segmentation failed: " + error)
+            self.log.emit("[TOOL][DEEPEXTREME] Segmentation failed: " + error)
+            return
+
+        pad = 50
+        thres = 0.8
+
+        created = 0
+        self.viewerplus.resetSelection()
 
-            pred = np.transpose(outputs.data.numpy()[0, ...], (1, 2, 0))
-            pred = 1 / (1 + np.exp(-pred))
-            pred = np.squeeze(pred)
-            img_test = utils.floatmapToQImage(pred*255.0)
-            img_test.save("prediction.png")
-            result = helpers.crop2fullmask(pred, bbox, im_size=img.shape[:2], zero_pad=True, relax=pad) > thres
+        for job, pred in zip(jobs, preds):
 
+            # the map shown has been changed in the meantime
+            if job["image"] is not self.viewerplus.image:
+                self.log.emit("[TOOL][DEEPEXTREME] Segmentation discarded (the map has been changed).")
+                continue
 
-            segm_mask = result.astype(int)
+            if DeepExtreme.DIAGNOSTICS:
+                self.saveDiagnostics(pred)
+
+            start = time.perf_counter()
+
+            segm_mask = predictionToMask(pred, job["bbox"], job["image size"], pad, thres)
+
+            postprocess_time = time.perf_counter()
+
+            (left_map_pos, top_map_pos) = job["map position"]
 
             #TODO: move this function to blob!!!
-            blobs = self.viewerplus.annotations.blobsFromMask(segm_mask, left_map_pos, top_map_pos, area_extreme_points)
+            blobs = self.viewerplus.annotations.blobsFromMask(segm_mask, left_map_pos, top_map_pos, job["area"])
 
             for blob in blobs:
-                blob.deep_extreme_points = extreme_points_to_use
+                blob.deep_extreme_points = job["points"]
 
-            self.viewerplus.resetSelection()
             for blob in blobs:
                 self.viewerplus.addBlob(blob, selected=True)
                 self.blobInfo.emit(blob, "[TOOL][DEEPEXTREME][BLOB-CREATED]")
-            self.viewerplus.saveUndo()
-
-            self.infoMessage.emit("Segmentation done.")
-
-        self.log.emit("[TOOL][DEEPEXTREME] Segmentation ends.")
+                created += 1
 
-        QApplication.restoreOverrideCursor()
+            blobs_time = time.perf_counter()
 
-    def loadNetwork(self):
-        self.resetNetwork()
-        self.infoMessage.emit("Loading deepextreme network..")
+            self.logLatency(job["latency"], latency, len(jobs), postprocess_time - start, blobs_time - postprocess_time)
 
-        # Initialization
-        modelName = 'dextr_corals'
+        self.viewerplus.saveUndo()
 
-        #  Create the network and load the weights
-        self.deepextreme_net = resnet.resnet101(1, nInputChannels=4, classifier='psp')
+        with self.queue_lock:
+            queued = len(self.queue)
 
-        models_dir = "models/"
+        if queued > 0:
+            self.infoMessage.emit("Segmentation is ongoing.. (" + str(queued) + " queued)")
+        else:
+            self.infoMessage.emit("Segmentation done.")
 
-        # dictionary layers' names - weights
-        state_dict_checkpoint = torch.load(os.path.join(models_dir, modelName + '.pth'),
-                                           map_location=lambda storage, loc: storage)
+        self.log.emit("[TOOL][DEEPEXTREME] Segmentation ends (" + str(len(jobs)) + " segmentations, "
+                      + str(created) + " blobs).")
 
-        # Remove the prefix .module from the model when it is trained using DataParallel
-        if 'module.' in list(state_dict_checkpoint.keys())[0]:
-            new_state_dict = OrderedDict()
-            for k, v in state_dict_checkpoint.items():
-                name = k[7:]  # remove `module.` from multi-gpu training
-                new_state_dict[name] = v
-        else:
-            new_state_dict = state_dict_checkpoint
+    def logLatency(self, job_latency, batch_latency, batch_size, postprocess, blob_creation):
+        """
+        Log the time (ms) spent by each step of a segmentation (the forward pass and the upsampling are per batch).
+        """
+        message = "[TOOL][DEEPEXTREME] Latency (ms): crop {:.1f}, heatmap {:.1f}, forward {:.1f}, upsample {:.1f} " \
+                  "(batch of {:d}), post-process {:.1f}, blob creation {:.1f}".format(
+                  1000.0 * job_latency["crop"], 1000.0 * job_latency["heatmap"], 1000.0 * batch_latency["forward"],
+                  1000.0 * batch_latency["upsample"], batch_size, 1000.0 * postprocess, 1000.0 * blob_creation)
+        self.log.emit(message)
 
-        self.deepextreme_net.load_state_dict(new_state_dict)
-        self.deepextreme_net.eval()
-        if not torch.cuda.is_available():
-            print("CUDA NOT AVAILABLE!")
+    def saveDiagnostics(self, pred):
 
-    def resetNetwork(self):
-        torch.cuda.empty_cache()
+        temp_dir = "temp"
+        if not os.path.exists(temp_dir):
+            os.mkdir(temp_dir)
 
-        if self.deepextreme_net is not None:
-            del self.deepextreme_net
-            self.deepextreme_net = None
\ No newline at end of file
+        self.diagnostics_counter += 1
+        filename = os.path.join(temp_dir, "dextr_prediction_" + str(self.diagnostics_counter) + ".png")
+        floatmap2qimage(pred * 255.0).save(filename)
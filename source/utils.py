@@ -20,10 +20,11 @@
 # THIS FILE CONTAINS UTILITY FUNCTIONS, E.G. CONVERSION BETWEEN DATA TYPES, BASIC OPERATIONS, ETC.
 
 from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QImage, qRgb, qRgba
+from PyQt5.QtGui import QImage, QPolygonF, qRgb, qRgba
 import numpy as np
 import math
 from skimage.draw import line
+from source.ConversionUtils import qimage2ndarray, qimage2mask
 
 def clampCoords(x, y, W, H):
 
@@ -72,87 +73,6 @@ def showMaskAndCurve(mask, bbox, curve, fig_number):
     plt.imshow(arr)
     plt.show()
 
-def maskToQImage(mask):
-
-    h = mask.shape[0]
-    w = mask.shape[1]
-    qimg = QImage(w, h, QImage.Format_RGB32)
-    qimg.fill(qRgb(0, 0, 0))
-
-    for y in range(h):
-        for x in range(w):
-
-            if mask[y, x] == 1:
-                qimg.setPixel(x, y, qRgb(255, 255, 255))
-
-    return qimg
-
-def labelsToQImage(mask):
-
-    h = mask.shape[0]
-    w = mask.shape[1]
-    qimg = QImage(w, h, QImage.Format_RGB32)
-    qimg.fill(qRgb(0, 0, 0))
-
-    for y in range(h):
-        for x in range(w):
-            c = mask[y, x]
-            qimg.setPixel(x, y, qRgb(c*17, c*163, c*211))
-
-    return qimg
-
-def floatmapToQImage(floatmap, nodata = float('NaN')):
-
-    h = floatmap.shape[0]
-    w = floatmap.shape[1]
-    qimg = QImage(w, h, QImage.Format_RGB32)
-
-    qimg.fill(qRgb(0,0,0))
-
-    fmap = floatmap.copy()
-    max_value = np.max(fmap)
-    fmap[fmap == nodata] = max_value
-    min_value = np.min(fmap)
-
-    fmap = (fmap - min_value) / (max_value - min_value)
-    fmap = 255.0 * fmap
-    fmap = fmap.astype(np.uint8)
-
-    img = np.zeros([h, w, 3], dtype=np.uint8)
-    img[:,:,0] = fmap
-    img[:,:,1] = fmap
-    img[:,:,2] = fmap
-
-    qimg = rgbToQImage(img)
-
-    del fmap
-
-    return qimg
-
-def rgbToQImage(image):
-
-    h = image.shape[0]
-    w = image.shape[1]
-    ch = image.shape[2]
-
-    imgdata = np.zeros([h, w, 4], dtype=np.uint8)
-
-    if ch == 3:
-        imgdata[:, :, 2] = image[:, :, 0]
-        imgdata[:, :, 1] = image[:, :, 1]
-        imgdata[:, :, 0] = image[:, :, 2]
-        imgdata[:, :, 3] = 255
-        qimg = QImage(imgdata.data, w, h, QImage.Format_RGB32)
-
-    elif ch == 4:
-        imgdata[:, :, 3] = image[:, :, 0]
-        imgdata[:, :, 2] = image[:, :, 1]
-        imgdata[:, :, 1] = image[:, :, 2]
-        imgdata[:, :, 0] = image[:, :, 3]
-        qimg = QImage(imgdata.data, w, h, QImage.Format_ARGB32)
-
-    return qimg.copy()
-
 def prepareForDeepExtreme(qimage_map, four_points, pad_max):
     """
     Crop the image map (QImage) and return a NUMPY array containing it.
@@ -170,28 +90,36 @@ def prepareForDeepExtreme(qimage_map, four_points, pad_max):
     w = xmax - xmin
     h = ymax - ymin
     qimage_cropped = qimage_map.copy(xmin, ymin, w, h)
-
-    fmt = qimage_cropped.format()
-    assert(fmt == QImage.Format_RGB32)
-
-    arr = np.zeros((h, w, 3), dtype=np.uint8)
-
-    bits = qimage_cropped.bits()
-    bits.setsize(int(h*w*4))
-    arrtemp = np.frombuffer(bits, np.uint8).copy()
-    arrtemp = np.reshape(arrtemp, [h, w, 4])
-    arr[:, :, 0] = arrtemp[:, :, 2]
-    arr[:, :, 1] = arrtemp[:, :, 1]
-    arr[:, :, 2] = arrtemp[:, :, 0]
+    arr = qimage2ndarray(qimage_cropped)
 
     # update four point
-    four_points_updated = np.zeros((4,2), dtype=np.int)
+    four_points_updated = np.zeros((4,2), dtype=int)
     four_points_updated[:, 0] = four_points[:, 0] - xmin
     four_points_updated[:, 1] = four_points[:, 1] - ymin
 
     return (arr, four_points_updated)
 
 
+def pointsToQPolygonF(points, offset=0.0):
+    """
+    Convert an array of points (N x 2, in the [[x0, y0], [x1, y1], ...] format) to a QPolygonF.
+    The points are copied in bulk into the memory of the polygon (a QPointF is a pair of doubles).
+    """
+
+    n = points.shape[0]
+    qpolygon = QPolygonF(n)
+    if n == 0:
+        return qpolygon
+
+    ptr = qpolygon.data()
+    ptr.setsize(n * 2 * 8)
+    buffer = np.frombuffer(ptr, np.float64).reshape(n, 2)
+    buffer[:] = points
+    buffer += offset
+
+    return qpolygon
+
+
 def cropQImage(qimage_map, bbox):
 
     left = bbox[1]
@@ -204,26 +132,6 @@ def cropQImage(qimage_map, bbox):
     return qimage_cropped
 
 
-def qimageToNumpyArray(qimg):
-
-    w = qimg.width()
-    h = qimg.height()
-
-    fmt = qimg.format()
-    assert (fmt == QImage.Format_RGB32)
-
-    arr = np.zeros((h, w, 3), dtype=np.uint8)
-
-    bits = qimg.bits()
-    bits.setsize(int(h * w * 4))
-    arrtemp = np.frombuffer(bits, np.uint8).copy()
-    arrtemp = np.reshape(arrtemp, [h, w, 4])
-    arr[:, :, 0] = arrtemp[:, :, 2]
-    arr[:, :, 1] = arrtemp[:, :, 1]
-    arr[:, :, 2] = arrtemp[:, :, 0]
-
-    return arr
-
 def prepareLabelForDeepExtreme(qimage_map, four_points, pad_max):
     """
     Crop the image map (QImage) and return a NUMPY array containing it.
@@ -241,24 +149,10 @@ def prepareLabelForDeepExtreme(qimage_map, four_points, pad_max):
     w = xmax - xmin
     h = ymax - ymin
     qimage_cropped = qimage_map.copy(xmin, ymin, w, h)
-
-    fmt = qimage_cropped.format()
-    assert(fmt == QImage.Format_RGB32)
-
-    arr = np.zeros((h, w, 1), dtype=np.uint8)
-
-    bits = qimage_cropped.bits()
-    bits.setsize(int(h*w*4))
-    arrtemp = np.frombuffer(bits, np.uint8).copy()
-    arrtemp = np.reshape(arrtemp, [h, w, 4])
-
-    for y in range(h):
-        for x in range(w):
-            if arrtemp[y, x, 2] != 0 or arrtemp[y, x, 1] != 0 or arrtemp[y, x, 0] != 0:
-                arr[y, x] = 1
+    arr = qimage2mask(qimage_cropped).astype(np.uint8)[:, :, np.newaxis]
 
     # update four point
-    four_points_updated = np.zeros((4,2), dtype=np.int)
+    four_points_updated = np.zeros((4,2), dtype=int)
     four_points_updated[:, 0] = four_points[:, 0] - xmin
     four_points_updated[:, 1] = four_points[:, 1] - ymin
 
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules are imported as in TagLab.py (source.<module>), from the TagLab directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
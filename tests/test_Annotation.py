@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+annotation_module = pytest.importorskip("source.Annotation", exc_type=ImportError)
+Annotation = annotation_module.Annotation
+Blob = annotation_module.Blob
+
+
+def blobFromMask(mask, top, left):
+    blob = Blob(None, 0, 0, 0)
+    blob.updateUsingMask([top, left, mask.shape[1], mask.shape[0]], mask)
+    return blob
+
+
+def test_compute_measures():
+
+    rng = np.random.default_rng(0)
+    annotations = Annotation()
+    for i in range(20):
+        mask = np.zeros((40, 50), dtype=np.uint8)
+        mask[5:35, 5:45] = 1
+        mask[10:20, 10:20] = 0
+        mask[rng.integers(0, 40, 200), rng.integers(0, 50, 200)] = 1
+        annotations.addBlob(blobFromMask(mask, 100 * i, 50 * i))
+
+    scale = 2.5
+    (areas, perimeters, centroids) = annotations.computeMeasures(scale=scale)
+
+    # the same measures of the blobs (the area is the pixel count), in the new scale
+    for i, blob in enumerate(annotations.seg_blobs):
+        assert areas[i] == pytest.approx(blob.area * scale * scale)
+        assert perimeters[i] == pytest.approx(blob.perimeter * scale)
+        assert np.allclose(centroids[i], np.asarray(blob.centroid) * scale)
+
+
+def test_compute_measures_empty():
+
+    (areas, perimeters, centroids) = Annotation().computeMeasures()
+    assert areas.shape == (0,) and perimeters.shape == (0,) and centroids.shape == (0, 2)
@@ -0,0 +1,66 @@
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+BatchClassifier = pytest.importorskip("source.BatchClassifier", exc_type=ImportError)
+
+CLASSIFIER_INFO = { "Classifier Name": "Test", "Scale": 1.0 }
+
+
+@pytest.fixture
+def map_file(tmp_path):
+    filename = str(tmp_path / "map.png")
+    cv2.imwrite(filename, np.zeros((30, 40, 3), dtype=np.uint8))
+    return filename
+
+
+def writeProject(filename, images):
+    with open(filename, "w") as f:
+        json.dump({ "filename": filename, "labels": {}, "images": images }, f)
+
+
+def test_map_sizes_of_map(map_file):
+
+    assert BatchClassifier.mapSizes(map_file, 0.5) == [(40, 30, 0.5)]
+
+
+def test_map_sizes_of_project(tmp_path, map_file):
+
+    project_filename = str(tmp_path / "project.json")
+    annotations = [{ "id": 1, "contour": [[0.0, 0.0], [1.0, 1.0]] }]
+    channels = [{ "filename": map_file, "type": "RGB" }]
+    writeProject(project_filename, [
+        { "width": 1000, "height": 500, "map_px_to_mm_factor": 2.0, "channels": channels, "annotations": annotations },
+        { "width": None, "height": None, "map_px_to_mm_factor": 1.5, "channels": channels, "annotations": [] }])
+
+    assert BatchClassifier.mapSizes(project_filename, None) == [(1000, 500, 2.0), (40, 30, 1.5)]
+
+
+def test_unreadable_inputs_fail(tmp_path):
+
+    missing_map = str(tmp_path / "missing.png")
+    broken_project = str(tmp_path / "broken.json")
+    with open(broken_project, "w") as f:
+        f.write("{\"images\": [")
+    legacy_project = str(tmp_path / "legacy.json")
+    writeProject(legacy_project, [{ "width": None, "height": None, "channels": [], "annotations": [] }])
+
+    messages = []
+    jobs = [(filename, filename + ".tlb") for filename in [missing_map, broken_project, legacy_project]]
+    failed = BatchClassifier.runBatch(jobs, CLASSIFIER_INFO, {}, px_to_mm=1.0, max_workers=1, report=messages.append)
+
+    assert failed == [missing_map, broken_project, legacy_project]
+    assert sum("FAILED" in message for message in messages) == 3
+
+
+def test_map_sizes_of_binary_project(tmp_path):
+
+    from source.ProjectArchive import writeProjectArchive
+
+    project_filename = str(tmp_path / "project.tlb")
+    header = json.dumps({ "images": [{ "width": 800, "height": 600, "map_px_to_mm_factor": 0.5, "channels": [] }] })
+    writeProjectArchive(project_filename, header, [[]])
+
+    assert BatchClassifier.mapSizes(project_filename, None) == [(800, 600, 0.5)]
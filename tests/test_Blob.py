@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from scipy import ndimage as ndi
+
+blob_module = pytest.importorskip("source.Blob", exc_type=ImportError)
+Blob = blob_module.Blob
+
+
+@pytest.fixture(params=[False, True], ids=["two passes", "single pass"])
+def single_pass(request, monkeypatch):
+    monkeypatch.setattr(Blob, "SINGLE_PASS_CONTOURS", request.param)
+    return request.param
+
+
+def blobFromMask(mask, top=10, left=20):
+    blob = Blob(None, 0, 0, 0)
+    blob.createContourFromMask(mask, [top, left, mask.shape[1], mask.shape[0]])
+    return blob
+
+
+def test_square_with_hole(single_pass):
+
+    mask = np.ones((45, 45), dtype=np.uint8)
+    mask[12:32, 12:32] = 0
+
+    blob = blobFromMask(mask)
+    assert len(blob.inner_contours) == 1
+    assert np.array_equal(blob.getMask(), mask)
+    assert blob.contour[:, 0].min().round() == 20 and blob.contour[:, 0].max().round() == 64
+    assert blob.contour[:, 1].min().round() == 10 and blob.contour[:, 1].max().round() == 54
+
+
+def test_single_pass_masks(monkeypatch):
+
+    rng = np.random.default_rng(0)
+    for i in range(50):
+        mask = (ndi.gaussian_filter(rng.random((60, 70)), 2) > 0.5).astype(np.uint8)
+        if not mask.any():
+            continue
+
+        monkeypatch.setattr(Blob, "SINGLE_PASS_CONTOURS", False)
+        expected = blobFromMask(mask).getMask()
+        monkeypatch.setattr(Blob, "SINGLE_PASS_CONTOURS", True)
+        assert np.array_equal(blobFromMask(mask).getMask(), expected)
+
+
+def test_perimeter():
+
+    blob = Blob(None, 0, 0, 0)
+    square = np.array([[0.0, 0.0], [10.0, 0.0], [10.0, 10.0], [0.0, 10.0]], dtype=np.float32)
+    assert blob.calculateContourPerimeter(square) == pytest.approx(40.0)
+
+    blob.contour = square
+    blob.inner_contours = [np.array([[2.0, 2.0], [5.0, 2.0], [2.0, 6.0]])]
+    blob.calculatePerimeter()
+    assert blob.perimeter == pytest.approx(52.0)
@@ -0,0 +1,113 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from PyQt5.QtCore import Qt
+
+from source import ImagePyramid as image_pyramid
+from source.ImagePyramid import ImagePyramid, TiledImage, ScaledTiledImage, downsample
+
+
+@pytest.fixture
+def rgb():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, size=(300, 410, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(image, (5, 5), 0)
+
+
+@pytest.fixture
+def pyramid(tmp_path, rgb):
+    filename = str(tmp_path / "map.png")
+    cv2.imwrite(filename, cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+    pyramid = ImagePyramid(filename, tile_size=128)
+    pyramid.open()
+    return pyramid
+
+
+def test_levels(pyramid, rgb):
+
+    assert pyramid.levelCount() == 3
+    assert pyramid.levelSize(0) == (410, 300)
+    assert pyramid.levelSize(1) == (205, 150)
+    assert pyramid.levelSize(2) == (103, 75)
+    assert np.array_equal(pyramid.levels[0], rgb)
+    assert np.array_equal(pyramid.levels[1], downsample(rgb))
+
+
+def test_read_region(pyramid, rgb):
+
+    region = pyramid.readRegion(0, -10, 400, 30, 40)
+    assert region.shape == (40, 30, 3)
+    assert not region[:10].any()
+    assert not region[:, 10:].any()
+    assert np.array_equal(region[10:, :10], rgb[:30, 400:])
+
+
+@pytest.mark.parametrize("scale", [0.75, 1.3])
+def test_scaled_region(pyramid, rgb, scale):
+
+    (w, h) = (int(410 * scale), int(300 * scale))
+    expected = cv2.resize(rgb, (w, h), interpolation=cv2.INTER_LINEAR).astype(np.int16)
+
+    scaled = TiledImage(pyramid).scaled(w, h, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+    assert isinstance(scaled, ScaledTiledImage)
+    assert (scaled.width(), scaled.height()) == (w, h)
+
+    region = scaled.readRegion(20, 35, 100, 90)
+    assert np.abs(region.astype(np.int16) - expected[20:110, 35:135]).max() <= 1
+
+
+def test_scaled_region_from_level(pyramid):
+
+    # at scale 0.4 the regions are interpolated from the level 1
+    (w, h) = (164, 120)
+    level = np.asarray(pyramid.levels[1])
+    expected = cv2.resize(level, (w, h), interpolation=cv2.INTER_LINEAR).astype(np.int16)
+
+    region = pyramid.readScaledRegion(w, h, 0, 0, w, h)
+    assert np.abs(region.astype(np.int16) - expected).max() <= 1
+
+
+def test_scaled_tiles(pyramid):
+
+    # the tiles read separately (with the borders outside the map) form the whole rescaled map
+    scaled = TiledImage(pyramid).scaled(287, 210, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+    whole = scaled.readRegion(-16, -16, 320, 240)
+
+    tiles = np.zeros_like(whole)
+    for top in range(-16, 224, 64):
+        for left in range(-16, 304, 64):
+            tile = scaled.readRegion(top, left, 64, 64)
+            tiles[top + 16:top + 80, left + 16:left + 80] = tile[:240 - top - 16, :320 - left - 16]
+
+    assert np.array_equal(tiles, whole)
+    assert not whole[:16].any() and not whole[:, :16].any()
+    assert not whole[16 + 210:].any() and not whole[:, 16 + 287:].any()
+    assert whole[16:16 + 210, 16:16 + 287].any()
+
+
+def test_read_only_folder(tmp_path, rgb, monkeypatch):
+
+    folder = tmp_path / "maps"
+    folder.mkdir()
+    filename = str(folder / "map.png")
+    cv2.imwrite(filename, cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+
+    # the folder of the map cannot be written: the pyramid goes in the cache folder of the user
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(image_pyramid, "isWritableDir", lambda path: not path.startswith(str(folder)))
+
+    pyramid = ImagePyramid(filename, tile_size=128)
+    pyramid.open()
+
+    assert pyramid.cache_dir == image_pyramid.userCacheDir(filename)
+    assert pyramid.cache_dir.startswith(str(tmp_path / "cache"))
+    assert not os.path.exists(filename + ".pyramid")
+    assert np.array_equal(pyramid.levels[0], rgb)
+
+    # the pyramid is found again in the cache of the user
+    pyramid = ImagePyramid(filename, tile_size=128)
+    pyramid.open()
+    assert pyramid.isCached() and pyramid.cache_dir == image_pyramid.userCacheDir(filename)
@@ -0,0 +1,119 @@
+import os
+import logging
+
+import cv2
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from source import InferenceModes
+from source.InferenceModes import ReferenceTiles, checkInferenceMode, prepareNetwork
+
+AVERAGE_NORM = [0.5, 0.5, 0.5]
+
+
+class Flipped(torch.nn.Module):
+    """
+    It predicts the other class wherever the network predicts one of the two classes.
+    """
+
+    def __init__(self, net):
+        super(Flipped, self).__init__()
+        self.net = net
+
+    def forward(self, x):
+        return -self.net(x)
+
+
+@pytest.fixture
+def net():
+    torch.manual_seed(0)
+    return torch.nn.Conv2d(3, 2, 1).eval()
+
+
+@pytest.fixture
+def tiles_folder(tmp_path):
+    rng = np.random.default_rng(0)
+    folder = tmp_path / "tiles"
+    folder.mkdir()
+    for i in range(3):
+        cv2.imwrite(str(folder / ("tile" + str(i) + ".png")), rng.integers(0, 256, (16, 16, 3), dtype=np.uint8))
+    return str(folder)
+
+
+def test_check_same_network(net, tiles_folder):
+
+    tiles = ReferenceTiles(tiles_folder, AVERAGE_NORM)
+    (agreement, confusion_matrix) = checkInferenceMode(net, net, tiles, 2)
+
+    assert agreement == 1.0
+    assert confusion_matrix.sum() == 3 * 16 * 16
+    assert confusion_matrix[0, 1] == 0 and confusion_matrix[1, 0] == 0
+
+
+def test_check_flipped_network(net, tiles_folder):
+
+    tiles = ReferenceTiles(tiles_folder, AVERAGE_NORM)
+    (agreement, confusion_matrix) = checkInferenceMode(net, Flipped(net), tiles, 2)
+
+    assert agreement == 0.0
+    assert confusion_matrix[0, 0] == 0 and confusion_matrix[1, 1] == 0
+
+
+def test_rejected_mode(net, tiles_folder, tmp_path, monkeypatch, caplog):
+
+    monkeypatch.chdir(tmp_path)
+    torch.save(net.state_dict(), "test.net")
+    monkeypatch.setattr(InferenceModes, "convertNetwork", lambda net, *args: Flipped(net))
+
+    with caplog.at_level(logging.WARNING, logger="tool-logger"):
+        result = prepareNetwork(net, "test.net", "bfloat16", 2, AVERAGE_NORM, tile_size=16, tiles_folder=tiles_folder)
+
+    assert result is net
+    assert "rejected" in caplog.text
+
+
+def test_cached_model_is_checked(net, tiles_folder, tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    torch.save(net.state_dict(), "test.net")
+
+    prepareNetwork(net, "test.net", "jit", 2, AVERAGE_NORM, tile_size=16, tiles_folder=tiles_folder)
+    (model_filename, _) = InferenceModes.cacheFilenames("test.net", "jit", 16, True)
+    (unchecked_filename, _) = InferenceModes.cacheFilenames("test.net", "jit", 16, False)
+    assert os.path.exists(model_filename) and not os.path.exists(unchecked_filename)
+
+    # a cached model that does not pass the check anymore is not used and is removed from the cache
+    torch.jit.save(torch.jit.trace(Flipped(net), torch.rand(1, 3, 16, 16)), model_filename)
+    result = prepareNetwork(net, "test.net", "jit", 2, AVERAGE_NORM, tile_size=16, tiles_folder=tiles_folder)
+
+    assert result is net
+    assert not os.path.exists(model_filename)
+
+
+def test_rejected_model_is_not_cached(net, tiles_folder, tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    torch.save(net.state_dict(), "test.net")
+    monkeypatch.setattr(InferenceModes, "convertNetwork", lambda net, *args: torch.jit.trace(Flipped(net), torch.rand(1, 3, 16, 16)))
+
+    prepareNetwork(net, "test.net", "jit", 2, AVERAGE_NORM, tile_size=16, tiles_folder=tiles_folder)
+
+    for checked in [True, False]:
+        (model_filename, _) = InferenceModes.cacheFilenames("test.net", "jit", 16, checked)
+        assert not os.path.exists(model_filename)
+
+
+def test_available_modes(net, monkeypatch):
+
+    available = InferenceModes.availableInferenceModes()
+    assert available[:2] == ["float32", "jit"]
+    assert all(mode in InferenceModes.INFERENCE_MODES for mode in available)
+
+    # e.g. PyTorch 1.5 has no autocast on the CPU
+    monkeypatch.setattr(InferenceModes, "availableInferenceModes", lambda: ["float32", "jit"])
+    with pytest.raises(ValueError, match="not supported"):
+        prepareNetwork(net, "test.net", "bfloat16", 2, AVERAGE_NORM, tile_size=16)
+    with pytest.raises(ValueError, match="Unknown"):
+        prepareNetwork(net, "test.net", "float16", 2, AVERAGE_NORM, tile_size=16)
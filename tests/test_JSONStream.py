@@ -0,0 +1,94 @@
+import io
+import os
+import json
+
+import pytest
+
+from source.JSONStream import JSONStream
+from conftest import ROOT
+
+DOCUMENT = {
+    "name": "plot \"A\" è",
+    "map_px_to_mm_factor": 0.8627450980392157,
+    "width": 12345,
+    "height": -67890,
+    "scale": 1.5e-7,
+    "large": 6.02E+23,
+    "flags": [True, False, None],
+    "images": [
+        { "id": "im1", "annotations": [{ "id": 1, "area": 12.25, "contour": [[1.0, 2.5], [-3.75, 1e3]] },
+                                       { "id": 22, "area": 0, "contour": [] }] },
+        { "id": "im2", "annotations": [] },
+        { "id": "im3", "annotations": [{ "id": 333, "area": 123456.789, "note": "[1, 2]" }] }
+    ]
+}
+
+CONVERTERS = { ("images", "*", "annotations"): lambda d: ("blob", d["id"]) }
+
+
+def expected(data):
+    for image in data["images"]:
+        image["annotations"] = [("blob", d["id"]) for d in image["annotations"]]
+    return data
+
+
+def readStream(text, converters, chunk_size, monkeypatch):
+    monkeypatch.setattr(JSONStream, "CHUNK_SIZE", chunk_size)
+    return JSONStream(io.StringIO(text), converters).read()
+
+
+@pytest.mark.parametrize("indent", [None, 1])
+def test_chunk_boundaries(indent, monkeypatch):
+
+    text = json.dumps(DOCUMENT, indent=indent)
+    for chunk_size in range(1, 201):
+        result = readStream(text, CONVERTERS, chunk_size, monkeypatch)
+        assert result == expected(json.loads(text)), "CHUNK_SIZE = " + str(chunk_size)
+
+
+def test_sample_project(monkeypatch):
+
+    with open(os.path.join(ROOT, "projects", "sample_project.json"), "r") as f:
+        text = f.read()
+
+    converters = { ("Segmentation Data",): lambda d: d }
+    for chunk_size in range(2, 201):
+        assert readStream(text, converters, chunk_size, monkeypatch) == json.loads(text), \
+            "CHUNK_SIZE = " + str(chunk_size)
+
+
+@pytest.mark.parametrize("text", ["12", "-0.5", "1e-3", "true", "\"abc\"", "[1, 2.5]", "{\"a\": 1}"])
+def test_scalar_document(text, monkeypatch):
+
+    for chunk_size in range(1, len(text) + 2):
+        assert readStream(text, {}, chunk_size, monkeypatch) == json.loads(text)
+
+
+@pytest.mark.parametrize("text", ["{\"a\": 12.}", "[1, 2", "{\"a\": 1} 2", "[1e]"])
+def test_invalid(text, monkeypatch):
+
+    for chunk_size in range(1, len(text) + 2):
+        with pytest.raises(json.JSONDecodeError):
+            readStream(text, {}, chunk_size, monkeypatch)
+
+
+def test_large_value_decoded_few_times(monkeypatch):
+
+    data = { "images": [{ "id": "im1", "contour": [[i, i + 0.5] for i in range(20000)] }] }
+    text = json.dumps(data)
+
+    monkeypatch.setattr(JSONStream, "CHUNK_SIZE", 64)
+    stream = JSONStream(io.StringIO(text), CONVERTERS)
+    decoder = stream.decoder
+    calls = []
+
+    class CountingDecoder(object):
+        def raw_decode(self, s, idx=0):
+            calls.append(idx)
+            return decoder.raw_decode(s, idx)
+
+    stream.decoder = CountingDecoder()
+    assert stream.read() == data
+
+    # the chunk size grows while the same value is retried: O(log(len(text))) attempts, not O(len(text) / 64)
+    assert len(calls) < 40
@@ -0,0 +1,91 @@
+from source.LRUCache import LRUCache
+
+
+def test_byte_budget():
+
+    cache = LRUCache(max_bytes=100)
+    cache.put("a", 1, size=40)
+    cache.put("b", 2, size=40)
+    assert cache.total_bytes == 80
+
+    # "a" becomes the most recently used, "b" is evicted
+    assert cache.get("a") == 1
+    cache.put("c", 3, size=40)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.total_bytes == 80
+
+
+def test_item_budget():
+
+    cache = LRUCache(max_items=2)
+    for key in ["a", "b", "c"]:
+        cache.put(key, key.upper())
+    assert len(cache) == 2
+    assert cache.get("a") is None
+    assert cache.get("b") == "B" and cache.get("c") == "C"
+
+
+def test_replace():
+
+    cache = LRUCache(max_bytes=100)
+    cache.put("a", 1, size=60)
+    cache.put("a", 2, size=30)
+    assert cache.get("a") == 2
+    assert cache.total_bytes == 30
+
+
+def test_item_larger_than_budget():
+
+    cache = LRUCache(max_bytes=100)
+    cache.put("a", 1, size=50)
+    cache.put("b", 2, size=150)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.total_bytes == 50
+
+
+def test_set_budget():
+
+    cache = LRUCache(max_bytes=100)
+    for i in range(5):
+        cache.put(i, i, size=20)
+    cache.get(0)
+
+    cache.setBudget(max_bytes=40)
+    assert sorted(cache.items.keys()) == [0, 4]
+    assert cache.total_bytes == 40
+
+
+def test_remove_and_clear():
+
+    cache = LRUCache(max_bytes=100)
+    cache.put("a", 1, size=10)
+    cache.put("b", 2, size=20)
+
+    assert cache.remove("a") is True
+    assert cache.remove("a") is False
+    assert cache.total_bytes == 20
+
+    cache.clear()
+    assert len(cache) == 0 and cache.total_bytes == 0
+    assert cache.get("b", "missing") == "missing"
+
+
+def test_set_budget_keeps_the_other_bound():
+
+    cache = LRUCache(max_items=3, max_bytes=100)
+    for i in range(5):
+        cache.put(i, i, size=10)
+    assert sorted(cache.items.keys()) == [2, 3, 4]
+
+    cache.setBudget(max_bytes=200)
+    assert cache.max_items == 3 and cache.max_bytes == 200
+    cache.put(5, 5, size=10)
+    assert len(cache) == 3
+
+    cache.setBudget(max_items=10)
+    assert cache.max_items == 10 and cache.max_bytes == 200
+
+    cache.setBudget(max_items=None)
+    assert cache.max_items is None and cache.max_bytes == 200
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+
+from source.MapClassifier import MapClassifier
+
+CLASSIFIER_INFO = { "Classifier Name": "Test", "Num. Classes": 3, "Classes": ["Porite", "Pocillopora", "Background"],
+                    "Average Norm.": [0.5, 0.5, 0.5], "Weights": "test.net" }
+
+LABELS_INFO = { "Porite": [255, 0, 0], "Pocillopora": [0, 255, 0] }
+
+
+@pytest.fixture
+def classifier(monkeypatch):
+    # the network is not needed to allocate the label map
+    monkeypatch.setattr(MapClassifier, "_load_classifier", lambda self, name: None)
+    return MapClassifier(CLASSIFIER_INFO, LABELS_INFO)
+
+
+def test_label_map_background(classifier):
+
+    label_map = classifier.createLabelMap(300, 200)
+    assert label_map.shape == (200, 300)
+    assert label_map.dtype == np.uint8
+    assert np.all(label_map == 2)
+
+
+def test_memmap_label_map_background(classifier, monkeypatch, tmp_path):
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(MapClassifier, "MEMMAP_MIN_PIXELS", 0)
+
+    classifier.label_map = classifier.createLabelMap(300, 200)
+    assert isinstance(classifier.label_map, np.memmap)
+    assert np.all(classifier.label_map == 2)
+
+    filename = classifier.label_map_filename
+    assert (tmp_path / filename).exists()
+    classifier.releaseLabelMap()
+    assert not (tmp_path / filename).exists()
@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from source.ModelRegistry import ModelRegistry, modelSize
+
+
+class Tensor(object):
+
+    def __init__(self, numel, element_size=4):
+        self.count = numel
+        self.size = element_size
+
+    def numel(self):
+        return self.count
+
+    def element_size(self):
+        return self.size
+
+
+class Network(object):
+    """
+    The part of the interface of torch.nn.Module used by the registry.
+    """
+
+    def __init__(self, name, parameters=250, buffers=0):
+        self.name = name
+        self.tensors = [Tensor(parameters)]
+        self.extra = [Tensor(buffers, 8)] if buffers > 0 else []
+
+    def parameters(self):
+        return self.tensors
+
+    def buffers(self):
+        return self.extra
+
+
+def test_model_size():
+
+    assert modelSize(Network("a", 250, 10)) == 250 * 4 + 10 * 8
+
+
+def test_loaded_once():
+
+    registry = ModelRegistry(max_bytes=10000)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return Network("a")
+
+    net = registry.get("a", loader)
+    assert registry.get("a", loader) is net
+    assert registry.isLoaded("a")
+    assert len(loads) == 1
+
+
+def test_budget():
+
+    # each network uses 1000 bytes
+    registry = ModelRegistry(max_bytes=2500)
+    for name in ["a", "b", "c"]:
+        registry.get(name, lambda name=name: Network(name))
+
+    assert not registry.isLoaded("a")
+    assert registry.isLoaded("b") and registry.isLoaded("c")
+
+    # "b" becomes the most recently used, "c" is evicted
+    registry.get("b", lambda: None)
+    registry.setBudget(1500)
+    assert registry.isLoaded("b") and not registry.isLoaded("c")
+
+    registry.remove("b")
+    assert not registry.isLoaded("b")
+
+
+def test_concurrent_loading():
+
+    registry = ModelRegistry()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        time.sleep(0.05)
+        return Network("a")
+
+    thread = registry.preload("a", loader)
+    results = []
+    workers = [threading.Thread(target=lambda: results.append(registry.get("a", loader))) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    thread.join()
+
+    assert len(loads) == 1
+    assert all(net is results[0] for net in results)
+
+
+def test_preload_error():
+
+    registry = ModelRegistry()
+
+    def loader():
+        raise IOError("missing weights")
+
+    registry.preload("a", loader).join()
+    assert not registry.isLoaded("a")
+    with pytest.raises(IOError):
+        registry.get("a", loader)
+
+
+def test_frozen_model_size():
+
+    torch = pytest.importorskip("torch")
+
+    net = torch.nn.Sequential(torch.nn.Conv2d(3, 8, 3), torch.nn.ReLU()).eval()
+    frozen = torch.jit.freeze(torch.jit.trace(net, torch.rand(1, 3, 16, 16)))
+
+    assert len(list(frozen.parameters())) == 0
+    assert modelSize(frozen) >= modelSize(net) > 0
+
+
+def test_load_error(caplog):
+
+    registry = ModelRegistry(max_bytes=10000)
+
+    def loader():
+        raise FileNotFoundError("missing.net")
+
+    with caplog.at_level(logging.ERROR, logger="tool-logger"):
+        registry.preload("a", loader).join()
+
+    assert isinstance(registry.loadError("a"), FileNotFoundError)
+    assert "missing.net" in caplog.text
+    assert not registry.isLoaded("a")
+
+    # the error is raised when the network is used
+    with pytest.raises(FileNotFoundError):
+        registry.get("a", loader)
+
+    registry.get("a", lambda: Network("a"))
+    assert registry.loadError("a") is None
@@ -0,0 +1,104 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+project_module = pytest.importorskip("source.Project", exc_type=ImportError)
+
+from source.ProjectArchive import isBinaryProject, blobsToColumns, blobsFromColumns
+from conftest import ROOT
+
+loadProject = project_module.loadProject
+
+
+@pytest.fixture
+def labels_dict():
+    with open(os.path.join(ROOT, "config.json"), "r") as f:
+        return json.load(f)["Labels"]
+
+
+@pytest.fixture
+def project(labels_dict, monkeypatch):
+    # the paths of the projects are relative to the TagLab folder
+    monkeypatch.chdir(ROOT)
+    return loadProject(os.path.join("projects", "sample_project.json"), labels_dict)
+
+
+def blobRecords(image):
+    return [blob.toDict() for blob in image.annotations.seg_blobs]
+
+
+def assertSameBlobs(blobs, expected):
+
+    assert len(blobs) == len(expected)
+    for blob, other in zip(blobs, expected):
+        assert blob.id == other.id
+        assert blob.class_name == other.class_name and blob.class_color == other.class_color
+        assert blob.blob_name == other.blob_name and blob.note == other.note
+        assert blob.area == other.area and blob.perimeter == other.perimeter
+        assert np.array_equal(blob.bbox, other.bbox)
+        assert np.allclose(blob.centroid, other.centroid)
+        assert np.allclose(blob.contour, other.contour)
+        assert len(blob.inner_contours) == len(other.inner_contours)
+        for contour, other_contour in zip(blob.inner_contours, other.inner_contours):
+            assert np.allclose(contour, other_contour)
+        assert np.array_equal(blob.deep_extreme_points, other.deep_extreme_points)
+
+
+def test_columns(project):
+
+    blobs = project.images[0].annotations.seg_blobs
+    assert len(blobs) > 0
+    blobs[0].note = "note è"
+    blobs[0].deep_extreme_points = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0], [7.0, 8.0]])
+
+    assertSameBlobs(blobsFromColumns(blobsToColumns(blobs)), blobs)
+
+
+def test_empty_columns():
+
+    assert blobsFromColumns(blobsToColumns([])) == []
+
+
+def test_round_trip(project, labels_dict, tmp_path):
+
+    filename = str(tmp_path / "project.tlb")
+    project.save(filename)
+    assert isBinaryProject(filename)
+
+    loaded = loadProject(filename, labels_dict)
+    assert len(loaded.images) == len(project.images)
+    for image, other in zip(loaded.images, project.images):
+        assert image.id == other.id and image.map_px_to_mm_factor == other.map_px_to_mm_factor
+        assert [channel.filename for channel in image.channels] == [channel.filename for channel in other.channels]
+        assertSameBlobs(image.annotations.seg_blobs, other.annotations.seg_blobs)
+
+    # binary -> JSON -> binary
+    json_filename = str(tmp_path / "project.json")
+    loaded.save(json_filename)
+    assert not isBinaryProject(json_filename)
+    reloaded = loadProject(json_filename, labels_dict)
+    assert blobRecords(reloaded.images[0]) == blobRecords(project.images[0])
+
+
+def test_json_lazy_hydration(project, labels_dict, tmp_path):
+
+    filename = str(tmp_path / "project.json")
+    project.save(filename)
+    expected = project.images[0].annotations.seg_blobs
+
+    # the records are kept with compact contours, the blobs are created on first use
+    loaded = loadProject(filename, labels_dict)
+    image = loaded.images[0]
+    assert not image.isHydrated()
+    assert all(isinstance(record["contour"], np.ndarray) for record in image.annotation_records)
+
+    # saved without creating the blobs
+    json_filename = str(tmp_path / "saved.json")
+    loaded.save(json_filename)
+    assert not image.isHydrated()
+
+    assertSameBlobs(image.annotations.seg_blobs, expected)
+    reloaded = loadProject(json_filename, labels_dict)
+    assertSameBlobs(reloaded.images[0].annotations.seg_blobs, expected)
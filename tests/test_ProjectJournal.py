@@ -0,0 +1,136 @@
+import json
+import os
+
+import pytest
+
+journal_module = pytest.importorskip("source.ProjectJournal", exc_type=ImportError)
+
+from source.Project import loadProject
+from conftest import ROOT
+
+ProjectJournal = journal_module.ProjectJournal
+recoverProject = journal_module.recoverProject
+hasRecoveryData = journal_module.hasRecoveryData
+journalFilenames = journal_module.journalFilenames
+
+
+@pytest.fixture
+def labels_dict():
+    with open(os.path.join(ROOT, "config.json"), "r") as f:
+        return json.load(f)["Labels"]
+
+
+@pytest.fixture
+def project(labels_dict, monkeypatch, tmp_path):
+    # the paths of the projects are relative to the TagLab folder
+    monkeypatch.chdir(ROOT)
+    project = loadProject(os.path.join("projects", "sample_project.json"), labels_dict)
+    # the journal is written next to the project
+    project.filename = str(tmp_path / "project.tlb")
+    project.save(project.filename)
+    return project
+
+
+def blobRecords(image):
+    return sorted([blob.toDict() for blob in image.annotations.seg_blobs], key=lambda record: record["id"])
+
+
+def editProject(project, journal):
+    """
+    Add a blob, replace a blob with a modified copy, change the class of a blob and remove a blob, as the tools do.
+    """
+    image = project.images[0]
+    annotations = image.annotations
+    blobs = list(annotations.seg_blobs)
+    assert len(blobs) >= 2
+
+    added = blobs[0].copy()
+    added.id = annotations.getFreeId()
+    annotations.addBlob(added)
+    journal.append(image, [], [added], [])
+
+    modified = blobs[0].copy()
+    modified.note = "modified"
+    annotations.removeBlob(blobs[0])
+    annotations.addBlob(modified)
+    journal.append(image, [blobs[0]], [modified], [])
+
+    added.class_name = "Empty"
+    added.class_color = project.labels["Empty"].fill
+    journal.append(image, [], [], [(added, "Empty")])
+
+    annotations.removeBlob(blobs[1])
+    journal.append(image, [blobs[1]], [], [])
+
+    # a blob added and removed in the same step leaves no record
+    records = journal.records
+    journal.append(image, [modified], [modified], [])
+    assert journal.records == records
+
+
+def test_replay(project, labels_dict):
+
+    journal = ProjectJournal(project.filename)
+    editProject(project, journal)
+    journal.close()
+    assert hasRecoveryData(project.filename)
+
+    recovered = recoverProject(project.filename, labels_dict)
+    assert recovered.filename == project.filename
+    assert blobRecords(recovered.images[0]) == blobRecords(project.images[0])
+
+
+def test_replay_is_idempotent(project, labels_dict):
+
+    journal = ProjectJournal(project.filename)
+    editProject(project, journal)
+    journal.close()
+
+    # the same records replayed twice give the same project
+    with open(journal.filename, "r") as f:
+        records = f.read()
+    with open(journal.filename, "a") as f:
+        f.write(records)
+
+    recovered = recoverProject(project.filename, labels_dict)
+    assert blobRecords(recovered.images[0]) == blobRecords(project.images[0])
+
+
+def test_truncated_record(project, labels_dict):
+
+    journal = ProjectJournal(project.filename)
+    editProject(project, journal)
+    journal.close()
+
+    # a crash in the middle of a write leaves a partial last record
+    with open(journal.filename, "a") as f:
+        f.write('{"image": "')
+
+    recovered = recoverProject(project.filename, labels_dict)
+    assert blobRecords(recovered.images[0]) == blobRecords(project.images[0])
+
+
+def test_compaction(project, labels_dict):
+
+    journal = ProjectJournal(project.filename)
+    image = project.images[0]
+    blob = image.annotations.seg_blobs[0]
+    blob.note = "before the snapshot"
+    journal.append(image, [], [blob], [])
+
+    assert journal.compact(project)
+    journal.wait()
+    assert not journal.compact(project)  # nothing new to compact
+
+    (_, compacting, snapshot) = journalFilenames(project.filename)
+    assert os.path.exists(snapshot) and not os.path.exists(compacting)
+
+    # the edits after the snapshot are replayed on top of it
+    editProject(project, journal)
+    journal.close()
+
+    recovered = recoverProject(project.filename, labels_dict)
+    assert blobRecords(recovered.images[0]) == blobRecords(project.images[0])
+
+    journal.discard()
+    assert not hasRecoveryData(project.filename)
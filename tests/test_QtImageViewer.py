@@ -0,0 +1,62 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+from PyQt5.QtGui import QImage
+
+from source.ImagePyramid import ImagePyramid, TiledImage
+from source.QtImageViewer import QtImageViewer
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def viewer(app):
+    viewer = QtImageViewer()
+    yield viewer
+    # the tiles still being loaded must not outlive the viewer
+    viewer.clear()
+    viewer.tile_loader.wait()
+    viewer.deleteLater()
+    app.processEvents()
+
+
+def overlayRect(viewer):
+    rect = viewer.overlay_item.sceneBoundingRect()
+    return (rect.x(), rect.y(), rect.width(), rect.height())
+
+
+def test_overlay(viewer):
+
+    viewer.setImg(QImage(400, 300, QImage.Format_RGB32))
+
+    viewer.setOpacity(0.5)
+    viewer.setOverlayImage(QImage(200, 150, QImage.Format_ARGB32))
+    assert overlayRect(viewer) == (0, 0, 400, 300)
+    assert viewer.overlay_item.opacity() == 0.5
+
+    # a new map removes the overlay
+    viewer.setImg(QImage(400, 300, QImage.Format_RGB32))
+    assert viewer.overlay_item.pixmap().isNull()
+
+
+def test_overlay_tiled(viewer, tmp_path):
+
+    filename = str(tmp_path / "map.png")
+    cv2.imwrite(filename, np.zeros((300, 410, 3), dtype=np.uint8))
+    pyramid = ImagePyramid(filename, tile_size=128)
+    pyramid.open()
+
+    viewer.setImg(TiledImage(pyramid))
+    viewer.setOverlayImage(QImage(410, 300, QImage.Format_ARGB32))
+
+    assert not viewer.overlay_item.pixmap().isNull()
+    assert overlayRect(viewer) == (0, 0, 410, 300)
+    assert viewer.overlay_item.zValue() > max([0] + [item.zValue() for item in viewer.tile_items.values()])
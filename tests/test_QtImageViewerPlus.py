@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+from PyQt5.QtGui import QImage
+viewer_module = pytest.importorskip("source.QtImageViewerPlus", exc_type=ImportError)
+
+from source.Project import loadProject
+from source.ProjectJournal import ProjectJournal, recoverProject
+from conftest import ROOT
+
+QtImageViewerPlus = viewer_module.QtImageViewerPlus
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def viewer(app, project):
+    viewer = QtImageViewerPlus()
+    viewer.logfile = logging.getLogger("tool-logger")   # set by TagLab
+    viewer.setProject(project)
+    yield viewer
+    viewer.clear()
+
+
+@pytest.fixture
+def labels_dict():
+    with open(os.path.join(ROOT, "config.json"), "r") as f:
+        return json.load(f)["Labels"]
+
+
+@pytest.fixture
+def project(labels_dict, monkeypatch, tmp_path):
+    # the paths of the projects are relative to the TagLab folder
+    monkeypatch.chdir(ROOT)
+    project = loadProject(os.path.join("projects", "sample_project.json"), labels_dict)
+    # the journal is written next to the project
+    project.filename = str(tmp_path / "project.tlb")
+    project.save(project.filename)
+    # the map of the sample project is not in the repository
+    project.images[0].channels[0].qimage = QImage(64, 64, QImage.Format_RGB32)
+    return project
+
+
+def newBlobs(image, count):
+    blobs = []
+    for i in range(count):
+        blob = image.annotations.seg_blobs[0].copy()
+        blob.id = image.annotations.getFreeId() + i
+        blobs.append(blob)
+    return blobs
+
+
+def test_add_blobs_to_image_not_shown(viewer, project, labels_dict):
+
+    journal = ProjectJournal(project.filename)
+    viewer.setJournal(journal)
+
+    image = project.images[0]
+    count = len(image.annotations.seg_blobs)
+    blobs = newBlobs(image, 3)
+    viewer.addBlobsToImage(image, blobs)
+    journal.close()
+
+    assert len(image.annotations.seg_blobs) == count + 3
+
+    # the step is journaled
+    recovered = recoverProject(project.filename, labels_dict)
+    assert len(recovered.images[0].annotations.seg_blobs) == count + 3
+
+    # and it can be undone when the image is shown
+    viewer.setImage(image)
+    viewer.undo()
+    assert len(image.annotations.seg_blobs) == count
+    viewer.redo()
+    assert len(image.annotations.seg_blobs) == count + 3
+
+
+def test_add_blobs_to_image_shown(viewer, project):
+
+    image = project.images[0]
+    viewer.setImage(image)
+
+    count = len(image.annotations.seg_blobs)
+    viewer.addBlobsToImage(image, newBlobs(image, 2))
+    assert len(image.annotations.seg_blobs) == count + 2
+
+    viewer.undo()
+    assert len(image.annotations.seg_blobs) == count
@@ -0,0 +1,106 @@
+import random
+
+import pytest
+
+from source.SpatialIndex import SpatialIndex
+
+
+class Box(object):
+    """
+    A blob reduced to its bbox (top, left, width, height).
+    """
+
+    def __init__(self, bbox):
+        self.bbox = bbox
+
+
+def randomBox(rng):
+    return Box([rng.randint(-50, 2000), rng.randint(-50, 3000), rng.randint(0, 600), rng.randint(0, 400)])
+
+
+def containsPoint(box, x, y):
+    (top, left, width, height) = box.bbox
+    return left <= x <= left + width and top <= y <= top + height
+
+
+def intersects(box, top, left, width, height):
+    (btop, bleft, bwidth, bheight) = box.bbox
+    return not (bleft > left + width or bleft + bwidth < left or btop > top + height or btop + bheight < top)
+
+
+def inside(box, top, left, width, height):
+    (btop, bleft, bwidth, bheight) = box.bbox
+    return bleft >= left and btop >= top and bleft + bwidth <= left + width and btop + bheight <= top + height
+
+
+@pytest.fixture
+def rng():
+    return random.Random(0)
+
+
+@pytest.fixture
+def boxes(rng):
+    return [randomBox(rng) for i in range(500)]
+
+
+def indexOf(boxes, cell_size=256):
+    index = SpatialIndex(cell_size)
+    for box in boxes:
+        index.insert(box)
+    return index
+
+
+@pytest.mark.parametrize("cell_size", [16, 256, 5000])
+def test_queries(rng, boxes, cell_size):
+
+    index = indexOf(boxes, cell_size)
+
+    for i in range(300):
+        x = rng.uniform(-100, 3700)
+        y = rng.uniform(-100, 2500)
+        assert set(map(id, index.queryPoint(x, y))) == {id(box) for box in boxes if containsPoint(box, x, y)}
+
+        (top, left, width, height) = (rng.randint(-100, 2500), rng.randint(-100, 3700), rng.randint(0, 800),
+                                      rng.randint(0, 800))
+        found = index.queryBox(top, left, width, height)
+        assert len(found) == len(set(map(id, found)))
+        assert set(map(id, found)) == {id(box) for box in boxes if intersects(box, top, left, width, height)}
+        assert set(map(id, index.queryInsideBox(top, left, width, height))) == \
+            {id(box) for box in boxes if inside(box, top, left, width, height)}
+
+
+def test_update_and_remove(rng, boxes):
+
+    index = indexOf(boxes)
+
+    for box in boxes[:100]:
+        box.bbox = randomBox(rng).bbox
+        index.update(box)
+    for box in boxes[100:200]:
+        index.remove(box)
+
+    remaining = boxes[:100] + boxes[200:]
+    assert all(box in index for box in remaining)
+    assert not any(box in index for box in boxes[100:200])
+
+    # blobs not indexed are not added by update
+    outside = randomBox(rng)
+    index.update(outside)
+    assert outside not in index
+
+    for i in range(200):
+        x = rng.uniform(-100, 3700)
+        y = rng.uniform(-100, 2500)
+        assert set(map(id, index.queryPoint(x, y))) == {id(box) for box in remaining if containsPoint(box, x, y)}
+
+    for box in remaining:
+        index.remove(box)
+    assert index.cells == {}
+
+
+def test_clear(boxes):
+
+    index = indexOf(boxes)
+    index.clear()
+    assert index.queryBox(0, 0, 5000, 5000) == []
+    assert boxes[0] not in index
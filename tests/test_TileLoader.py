@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+from PyQt5.QtGui import QImage
+
+from source.TileLoader import TileLoader
+
+
+class SlowPyramid(object):
+    """
+    The reads of the tiles block until release is set, the reads are counted.
+    """
+
+    cache_dir = "slow.pyramid"
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.reads = []
+        self.lock = threading.Lock()
+
+    def tileImage(self, level, tx, ty):
+        with self.lock:
+            self.reads.append((level, tx, ty))
+        self.release.wait(5.0)
+        image = QImage(8, 8, QImage.Format_RGB32)
+        image.fill(0)
+        return image
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def waitFor(app, condition, timeout=5.0):
+    start = time.time()
+    while not condition() and time.time() - start < timeout:
+        app.processEvents()
+        time.sleep(0.001)
+    app.processEvents()
+    return condition()
+
+
+def test_running_tiles_are_not_read_again(app):
+
+    loader = TileLoader(max_threads=1)
+    pyramid = SlowPyramid()
+    loader.setPyramid(pyramid)
+
+    loaded = []
+    loader.tileLoaded.connect(loaded.append)
+
+    keys = [(0, 0, 0), (0, 1, 0), (0, 2, 0)]
+    loader.request(keys)
+    assert waitFor(app, lambda: len(loader.running) == 1)
+
+    # pan: the same tiles are requested again while the first one is being read
+    loader.request(keys[::-1])
+    loader.request(keys)
+
+    pyramid.release.set()
+    assert waitFor(app, lambda: len(loaded) == len(keys))
+    loader.wait()
+    app.processEvents()
+
+    assert sorted(pyramid.reads) == sorted(keys)
+    assert sorted(loaded) == sorted(keys)
+    assert all(loader.tile(key) is not None for key in keys)
+    assert len(loader.pending) == 0 and len(loader.queued) == 0 and len(loader.running) == 0
+
+
+def test_dropped_requests(app):
+
+    loader = TileLoader(max_threads=1)
+    pyramid = SlowPyramid()
+    loader.setPyramid(pyramid)
+
+    loader.request([(0, 0, 0), (0, 1, 0)])
+    assert waitFor(app, lambda: len(loader.running) == 1)
+
+    # the tile not started yet is dropped, the one being read is completed
+    loader.request([(1, 0, 0)])
+    pyramid.release.set()
+    loader.wait()
+    assert waitFor(app, lambda: len(loader.running) == 0)
+
+    assert sorted(pyramid.reads) == [(0, 0, 0), (1, 0, 0)]